@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from anode.models import ODEBlock
 from torchdiffeq import odeint, odeint_adjoint
 
@@ -8,16 +9,42 @@ class Conv2dTime(nn.Conv2d):
     """
     Implements time dependent 2d convolutions, by appending the time variable as
     an extra channel.
+
+    As the time channel is constant, its contribution to the output is t times
+    the response of the time slice of the kernel to a plane of ones, which only
+    differs from a bias at the borders because of zero padding. If fused is
+    True, this response is computed on a single plane and added to the
+    convolution of x, instead of concatenating a time channel to every input.
+    Weights are the same for both, but outputs differ by floating point
+    rounding, which changes the steps (and NFEs) of adaptive solvers. fused is
+    therefore False by default (see benchmarks.fused_conv_time for speed and
+    output differences).
+
+    Inputs with fewer than in_channels channels are convolved with the first
+    input channels of the kernel only (used to skip zero augmented channels).
     """
-    def __init__(self, in_channels, *args, **kwargs):
+    def __init__(self, in_channels, *args, fused=False, **kwargs):
         super(Conv2dTime, self).__init__(in_channels + 1, *args, **kwargs)
+        # The time response is only a single plane without groups and with
+        # zero padding
+        self.fused = fused and self.groups == 1 and self.padding_mode == 'zeros'
 
     def forward(self, t, x):
+        if self.fused:
+            # Shape (1, 1, height, width)
+            ones = x.new_ones((1, 1) + x.shape[2:])
+            # Shape (1, out_channels, out_height, out_width)
+            time_response = F.conv2d(ones, self.weight[:, :1], None, self.stride,
+                                     self.padding, self.dilation)
+            out = F.conv2d(x, self.weight[:, 1:1 + x.shape[1]], self.bias,
+                           self.stride, self.padding, self.dilation)
+            return out + t * time_response
         # Shape (batch_size, 1, height, width)
         t_img = torch.ones_like(x[:, :1, :, :]) * t
         # Shape (batch_size, channels + 1, height, width)
         t_and_x = torch.cat([t_img, x], 1)
-        return super(Conv2dTime, self).forward(t_and_x)
+        return self._conv_forward(t_and_x, self.weight[:, :t_and_x.shape[1]],
+                                  self.bias)
 
 
 class ConvODEFunc(nn.Module):
@@ -41,9 +68,13 @@ class ConvODEFunc(nn.Module):
 
     non_linearity : string
         One of 'relu' and 'softplus'
+
+    fused : bool
+        If True, time dependent convolutions add the response of the time
+        channel instead of concatenating it. See Conv2dTime.
     """
     def __init__(self, device, img_size, num_filters, augment_dim=0,
-                 time_dependent=False, non_linearity='relu'):
+                 time_dependent=False, non_linearity='relu', fused=False):
         super(ConvODEFunc, self).__init__()
         self.device = device
         self.augment_dim = augment_dim
@@ -51,16 +82,24 @@ class ConvODEFunc(nn.Module):
         self.time_dependent = time_dependent
         self.nfe = 0  # Number of function evaluations
         self.channels, self.height, self.width = img_size
+        self.data_channels = self.channels
         self.channels += augment_dim
         self.num_filters = num_filters
+        # Augmented state whose augmented channels are known to be zero (set
+        # by ODEBlock during a solve), for which the first layer skips them.
+        # Only the initial state of a solve is this tensor
+        self.zero_augmented_input = None
 
         if time_dependent:
             self.conv1 = Conv2dTime(self.channels, self.num_filters,
-                                    kernel_size=1, stride=1, padding=0)
+                                    kernel_size=1, stride=1, padding=0,
+                                    fused=fused)
             self.conv2 = Conv2dTime(self.num_filters, self.num_filters,
-                                    kernel_size=3, stride=1, padding=1)
+                                    kernel_size=3, stride=1, padding=1,
+                                    fused=fused)
             self.conv3 = Conv2dTime(self.num_filters, self.channels,
-                                    kernel_size=1, stride=1, padding=0)
+                                    kernel_size=1, stride=1, padding=0,
+                                    fused=fused)
         else:
             self.conv1 = nn.Conv2d(self.channels, self.num_filters,
                                    kernel_size=1, stride=1, padding=0)
@@ -85,6 +124,10 @@ class ConvODEFunc(nn.Module):
             Shape (batch_size, input_dim)
         """
         self.nfe += 1
+        if self.augment_dim > 0 and x is self.zero_augmented_input:
+            # Augmented channels are zero (e.g. at t=0), so only convolve the
+            # data channels in the first layer
+            x = x[:, :self.data_channels]
         if self.time_dependent:
             out = self.conv1(t, x)
             out = self.non_linearity(out)
@@ -92,7 +135,8 @@ class ConvODEFunc(nn.Module):
             out = self.non_linearity(out)
             out = self.conv3(t, out)
         else:
-            out = self.conv1(x)
+            out = self.conv1._conv_forward(x, self.conv1.weight[:, :x.shape[1]],
+                                           self.conv1.bias)
             out = self.non_linearity(out)
             out = self.conv2(out)
             out = self.non_linearity(out)
@@ -133,10 +177,19 @@ class ConvODENet(nn.Module):
     adjoint : bool
         If True calculates gradient with adjoint method, otherwise
         backpropagates directly through operations of ODE solver.
+
+    solver, checkpoint, warm_start, partition, precision, implicit_augment
+        Options of the solver and of how it is run. See anode.models.ODEBlock.
+
+    fused : bool
+        If True, time dependent convolutions add the response of the time
+        channel instead of concatenating it. See Conv2dTime.
     """
     def __init__(self, device, img_size, num_filters, output_dim=1,
                  augment_dim=0, time_dependent=False, non_linearity='relu',
-                 tol=1e-3, adjoint=False):
+                 tol=1e-3, adjoint=False, solver=None, checkpoint=False,
+                 warm_start=False, partition=False, precision=None,
+                 implicit_augment=False, fused=False):
         super(ConvODENet, self).__init__()
         self.device = device
         self.img_size = img_size
@@ -148,10 +201,13 @@ class ConvODENet(nn.Module):
         self.tol = tol
 
         odefunc = ConvODEFunc(device, img_size, num_filters, augment_dim,
-                              time_dependent, non_linearity)
+                              time_dependent, non_linearity, fused)
 
         self.odeblock = ODEBlock(device, odefunc, is_conv=True, tol=tol,
-                                 adjoint=adjoint)
+                                 adjoint=adjoint, solver=solver,
+                                 checkpoint=checkpoint, warm_start=warm_start,
+                                 partition=partition, precision=precision,
+                                 implicit_augment=implicit_augment)
 
         self.linear_layer = nn.Linear(self.flattened_dim, self.output_dim)
 
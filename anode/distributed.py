@@ -0,0 +1,133 @@
+import contextlib
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo'):
+    """Initializes the default process group from the environment variables
+    set by torchrun (RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT) and returns
+    rank and world size.
+
+    Parameters
+    ----------
+    backend : string
+        Backend of torch.distributed, gloo runs on CPU.
+    """
+    if not dist.is_initialized():
+        dist.init_process_group(backend)
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_distributed():
+    """Returns True if the default process group is initialized."""
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    """Returns rank of process, 0 if not distributed."""
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    """Returns number of processes, 1 if not distributed."""
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """Returns True for the process which logs and saves results."""
+    return get_rank() == 0
+
+
+@contextlib.contextmanager
+def main_process_first():
+    """Context manager which runs its body on the main process before the
+    other processes, e.g. to download a dataset once."""
+    if is_distributed() and not is_main_process():
+        dist.barrier()
+    yield
+    if is_distributed() and is_main_process():
+        dist.barrier()
+
+
+def broadcast_module(module, src=0):
+    """Copies parameters and buffers of module from process src to all
+    processes, so that all replicas start from the same weights."""
+    with torch.no_grad():
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            dist.broadcast(tensor, src)
+
+
+def all_reduce_gradients(parameters, flags=()):
+    """Averages gradients of parameters over all processes. Gradients are
+    flattened into a single buffer, so there is one all-reduce per step
+    instead of one per parameter. Missing gradients (e.g. of a process whose
+    step failed) count as zero.
+
+    Returns the sums of flags over all processes, which are reduced in the
+    same buffer, e.g. to tell the other processes that the step of this
+    process failed without a separate all-reduce.
+
+    Parameters
+    ----------
+    parameters : iterable of torch.nn.Parameter
+        Parameters in the same order on every process.
+
+    flags : sequence of floats
+        Values of the same length on every process.
+    """
+    params = list(parameters)
+    if not len(params):
+        return all_reduce_sum(flags) if len(flags) else []
+    flat = torch.cat([param.grad.reshape(-1) if param.grad is not None
+                      else param.new_zeros(param.numel()) for param in params] +
+                     [params[0].new_tensor(flags).reshape(-1)])
+    dist.all_reduce(flat)
+    num_flags = len(flags)
+    flag_sums = flat[flat.numel() - num_flags:].tolist()
+    flat /= dist.get_world_size()
+    offset = 0
+    for param in params:
+        if param.grad is not None:
+            param.grad.copy_(flat[offset:offset + param.numel()].view_as(param.grad))
+        offset += param.numel()
+    return flag_sums
+
+
+def all_reduce_sum(values):
+    """Returns sum of a list of floats over all processes.
+
+    Parameters
+    ----------
+    values : list of floats
+        Values in the same order on every process.
+    """
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def all_reduce_max(values):
+    """Returns maximum of a list of floats over all processes."""
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return tensor.tolist()
+
+
+def all_reduce_mean(values):
+    """Returns mean of a list of floats over all processes.
+
+    Parameters
+    ----------
+    values : list of floats
+        Values in the same order on every process.
+    """
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return (tensor / dist.get_world_size()).tolist()
+
+
+def broadcast_object(obj, src=0):
+    """Returns obj of process src on all processes."""
+    objects = [obj]
+    dist.broadcast_object_list(objects, src)
+    return objects[0]
@@ -0,0 +1,179 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.func import functional_call, stack_module_state, vmap
+from torchdiffeq import odeint
+
+
+def max_replica_norm(tensor):
+    """Returns maximum over replicas of the RMS norm of every replica. Used as
+    error norm of adaptive solvers, instead of the RMS norm over all replicas,
+    which lets the error of a single replica exceed its tolerance by up to a
+    factor sqrt(num_replicas).
+
+    Parameters
+    ----------
+    tensor : torch.Tensor
+        Shape (num_replicas, ...).
+    """
+    return tensor.reshape(tensor.shape[0], -1).pow(2).mean(1).sqrt().max()
+
+
+class EnsembleODEBlock(nn.Module):
+    """Solves the ODEs of several ODEBlocks with independent weights in a single
+    batched call. The weights of the odefuncs are stacked along a new first
+    dimension and the dynamics of all replicas are evaluated at once with
+    torch.func.vmap, so the per kernel overhead of small odefuncs is paid once
+    for all replicas.
+
+    As the replicas share one solver, they share its step sizes and therefore
+    their number of function evaluations (NFEs of single replicas are not
+    available). For adaptive solvers, the error of every replica is normed
+    separately (see max_replica_norm), so a step is only accepted if it
+    satisfies the tolerances of every replica. The replica needing the
+    smallest steps (e.g. with the stiffest dynamics) therefore sets the steps
+    of all replicas.
+
+    Parameters
+    ----------
+    odeblocks : list of anode.models.ODEBlock instances
+        ODEBlocks with the same architecture and solver. Gradients are
+        calculated by backpropagating through the solver (adjoint,
+        checkpointing and the other solver options of ODEBlock are not
+        supported).
+    """
+
+    def __init__(self, odeblocks):
+        super(EnsembleODEBlock, self).__init__()
+        self.num_replicas = len(odeblocks)
+        self.solver = copy.deepcopy(odeblocks[0].solver)
+        self.telemetry = None
+        odefuncs = [odeblock.odefunc for odeblock in odeblocks]
+        self.augment_dim = odefuncs[0].augment_dim
+        # Stateless copy of odefunc, called with the weights of each replica.
+        # Kept in a tuple so that its (meta) parameters are not registered
+        template = copy.deepcopy(odefuncs[0]).to('meta')
+        template.compiled = False
+        template.nfe = 0
+        self._template = (template,)
+
+        params, _ = stack_module_state(odefuncs)
+        # Parameter names cannot contain dots
+        self._param_names = {name: name.replace('.', '_') for name in params}
+        for name, param in params.items():
+            self.register_parameter(self._param_names[name],
+                                    nn.Parameter(param.detach()))
+        self.register_buffer('integration_time', torch.tensor([0., 1.]),
+                             persistent=False)
+
+    @property
+    def odefunc(self):
+        """Stateless odefunc, whose nfe attribute counts the function
+        evaluations (of all replicas at once)."""
+        return self._template[0]
+
+    def stacked_params(self):
+        """Returns dict of odefunc parameter names and stacked parameters of
+        shape (num_replicas,) + shape of parameter."""
+        return {name: getattr(self, attr) for name, attr in self._param_names.items()}
+
+    def forward(self, x):
+        """Solves ODEs of all replicas starting from x.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Shape (batch_size, data_dim) or (num_replicas, batch_size,
+            data_dim).
+
+        Returns
+        -------
+        Solutions at final time, of shape (num_replicas, batch_size,
+        data_dim + augment_dim).
+        """
+        self.odefunc.nfe = 0
+        if x.dim() == 2:
+            # Same batch for every replica
+            x = x.unsqueeze(0).expand(self.num_replicas, -1, -1)
+        if self.augment_dim > 0:
+            aug = x.new_zeros(x.shape[:2] + (self.augment_dim,))
+            x = torch.cat([x, aug], 2)
+        options = self.solver.options()
+        if self.solver.is_adaptive:
+            options['norm'] = max_replica_norm
+        out = odeint(self._dynamics, x, self.integration_time.type_as(x),
+                     rtol=self.solver.rtol, atol=self.solver.atol,
+                     method=self.solver.method, options=options)
+        return out[1]
+
+    def _dynamics(self, t, z):
+        """Dynamics of all replicas. z has shape (num_replicas, batch_size,
+        dim)."""
+        return vmap(self._replica_dynamics, in_dims=(0, None, 0))(
+            self.stacked_params(), t, z)
+
+    def _replica_dynamics(self, params, t, z):
+        return functional_call(self.odefunc, params, (t, z))
+
+
+class EnsembleODENet(nn.Module):
+    """Trains several ODENets with independent weights (e.g. the num_reps
+    replicas of an experiment) at once: the ODEs of all replicas are solved in
+    one batched call (see EnsembleODEBlock) and the linear layers are applied
+    as one batched matrix multiplication. As optimizers such as SGD and Adam
+    act elementwise, training the stacked weights is the same as training the
+    replicas separately on the same batches.
+
+    Parameters
+    ----------
+    models : list of anode.models.ODENet instances
+        Replicas with the same architecture (typically different
+        initializations). Their weights are copied back with unstack.
+    """
+
+    def __init__(self, models):
+        super(EnsembleODENet, self).__init__()
+        self.num_replicas = len(models)
+        self.output_dim = models[0].output_dim
+        # Not registered, only used to copy trained weights back
+        self._models = tuple(models)
+        self.odeblock = EnsembleODEBlock([model.odeblock for model in models])
+        # Shape (num_replicas, output_dim, feature_dim)
+        self.linear_weight = nn.Parameter(torch.stack(
+            [model.linear_layer.weight.detach() for model in models]))
+        # Shape (num_replicas, output_dim)
+        self.linear_bias = nn.Parameter(torch.stack(
+            [model.linear_layer.bias.detach() for model in models]))
+
+    def forward(self, x, return_features=False):
+        """Returns predictions of all replicas, of shape (num_replicas,
+        batch_size, output_dim).
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Shape (batch_size, data_dim), the same batch is used for all
+            replicas.
+
+        return_features : bool
+            If True, also returns features of shape (num_replicas, batch_size,
+            data_dim + augment_dim).
+        """
+        features = self.odeblock(x)
+        pred = torch.baddbmm(self.linear_bias.unsqueeze(1), features,
+                             self.linear_weight.transpose(1, 2))
+        if return_features:
+            return features, pred
+        return pred
+
+    def unstack(self):
+        """Copies trained weights of every replica back into the ODENets the
+        ensemble was created from and returns them."""
+        params = self.odeblock.stacked_params()
+        with torch.no_grad():
+            for i, model in enumerate(self._models):
+                for name, param in model.odeblock.odefunc.named_parameters():
+                    param.copy_(params[name][i])
+                model.linear_layer.weight.copy_(self.linear_weight[i])
+                model.linear_layer.bias.copy_(self.linear_bias[i])
+        return list(self._models)
@@ -0,0 +1,94 @@
+import json
+import queue
+import threading
+
+
+class MetricsWriter():
+    """Appends records (dicts) as lines of JSON to a file from a background
+    thread, so that training never waits on file I/O. Every record is written
+    once, so the cost of logging does not grow with the length of the run.
+
+    Parameters
+    ----------
+    path : string
+        Path to JSONL file. Records are appended if the file already exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        """Queues record to be appended to the file."""
+        self._queue.put(record)
+
+    def flush(self):
+        """Blocks until all queued records have been written."""
+        self._queue.join()
+
+    def close(self):
+        """Writes all queued records and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        with open(self.path, 'a') as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    self._queue.task_done()
+                    break
+                f.write(json.dumps(record) + '\n')
+                # Flush whenever the queue is empty, so the file is up to date
+                # if the run crashes (e.g. when exceeding max_num_steps)
+                if self._queue.empty():
+                    f.flush()
+                self._queue.task_done()
+
+
+def read_metrics(path):
+    """Reads a metrics file written by anode.training.Trainer and returns its
+    histories, in the same format as Trainer.histories (e.g. {'loss_history':
+    [...], 'epoch_loss_history': [...], ...}). Records of epochs discarded by
+    a rollback to a checkpoint are dropped. If training stopped early, the
+    reason and estimated savings are returned in histories['stop'].
+
+    Parameters
+    ----------
+    path : string
+        Path to JSONL file written by MetricsWriter.
+    """
+    step_records = []
+    epoch_records = []
+    stop = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record_type = record.get("type", "step")
+            if record_type == "step":
+                step_records.append(record)
+            elif record_type == "epoch":
+                epoch_records.append(record)
+            elif record_type == "rollback":
+                step_records = [r for r in step_records
+                                if r["step"] < record["step"]]
+                epoch_records = [r for r in epoch_records
+                                 if r["epoch"] < record["epoch"]]
+            elif record_type == "stop":
+                stop = {key: value for key, value in record.items()
+                        if key != 'type'}
+
+    histories = {}
+    # Step records have keys like 'loss', epoch records like 'epoch_loss'
+    for record in step_records + epoch_records:
+        for key, value in record.items():
+            if key in ('type', 'step', 'epoch'):
+                continue
+            histories.setdefault(key + '_history', []).append(value)
+    if stop is not None:
+        histories['stop'] = stop
+    return histories
@@ -1,9 +1,41 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from math import pi
+from anode.solvers import (MAX_NUM_STEPS, RUNGE_KUTTA_METHODS,
+                           RungeKuttaSolver, SolverSpec, StepSizeCache,
+                           odeint_checkpoint)
 from torchdiffeq import odeint, odeint_adjoint
 
-MAX_NUM_STEPS = 1000  # Maximum number of steps for ODE solver
+# Reduced precision dtypes in which ODEBlock can evaluate the dynamics
+PRECISION_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+# Dynamics regularizers ODEBlock can integrate alongside the state
+REGULARIZERS = ('kinetic_energy', 'jacobian_frobenius')
+
+
+def compile_dynamics(function):
+    """Compiles function with torch.compile if it is available (torch >= 2.0),
+    otherwise returns function unchanged so that it runs eagerly.
+
+    Parameters
+    ----------
+    function : callable
+        Function of (t, x) computing the dynamics of an ODE system.
+    """
+    if hasattr(torch, 'compile'):
+        return torch.compile(function, dynamic=True)
+    return function
+
+
+def _autocast_enabled(device_type):
+    """Returns True if autocast is enabled for device_type."""
+    try:
+        return torch.is_autocast_enabled(device_type)
+    except TypeError:
+        # torch < 2.4 only has separate functions for CUDA and CPU
+        if device_type == 'cuda':
+            return torch.is_autocast_enabled()
+        return torch.is_autocast_cpu_enabled()
 
 
 class ODEFunc(nn.Module):
@@ -28,10 +60,18 @@ class ODEFunc(nn.Module):
 
     non_linearity : string
         One of 'relu' and 'softplus'
+
+    compiled : bool
+        If True, folds the time input into the bias of the first linear layer
+        (so no time tensor is allocated and concatenated at every function
+        evaluation) and compiles the dynamics with torch.compile. Without
+        gradients (e.g. evaluation), hidden activations are instead written
+        into buffers allocated once per batch size, so only the output (which
+        the solver keeps) is allocated at every function evaluation.
     """
 
     def __init__(self, device, data_dim, hidden_dim, augment_dim=0,
-                 time_dependent=False, non_linearity='relu'):
+                 time_dependent=False, non_linearity='relu', compiled=False):
         super(ODEFunc, self).__init__()
         self.device = device
         self.augment_dim = augment_dim
@@ -40,6 +80,12 @@ class ODEFunc(nn.Module):
         self.hidden_dim = hidden_dim
         self.nfe = 0  # Number of function evaluations
         self.time_dependent = time_dependent
+        self.compiled = compiled
+        # Augmented state whose augmented dimensions are known to be zero (set
+        # by ODEBlock during a solve), for which the first layer skips them.
+        # Only the initial state of a solve is this tensor, so this saves part
+        # of the first function evaluation of every solve
+        self.zero_augmented_input = None
 
         if time_dependent:
             self.fc1 = nn.Linear(self.input_dim + 1, hidden_dim)
@@ -53,6 +99,13 @@ class ODEFunc(nn.Module):
         elif non_linearity == 'softplus':
             self.non_linearity = nn.Softplus()
 
+        # Hidden activations of the compiled dynamics without gradients, by
+        # batch size, dtype, device and inference mode
+        self._activation_buffers = {}
+
+        if compiled:
+            self._compiled_dynamics = compile_dynamics(self._fused_dynamics)
+
     def forward(self, t, x):
         """
         Parameters
@@ -66,21 +119,172 @@ class ODEFunc(nn.Module):
         # Forward pass of model corresponds to one function evaluation, so
         # increment counter
         self.nfe += 1
+        if self.augment_dim > 0 and x is self.zero_augmented_input:
+            # Augmented dimensions are zero (e.g. at t=0), so only multiply the
+            # data dimensions by the first layer
+            x = x[:, :self.data_dim]
+        if self.compiled:
+            if not torch.is_grad_enabled() and not _autocast_enabled(x.device.type):
+                # Autograd does not need the activations, so reuse buffers
+                # (out= arguments are not supported under autocast)
+                return self._buffered_dynamics(t, x)
+            return self._compiled_dynamics(t, x)
+        # Columns of first layer weight multiplying x (x may exclude the
+        # augmented dimensions)
+        offset = 1 if self.time_dependent else 0
+        weight = self.fc1.weight[:, :offset + x.shape[1]]
         if self.time_dependent:
             # Shape (batch_size, 1)
             t_vec = torch.ones(x.shape[0], 1).to(self.device) * t
             # Shape (batch_size, data_dim + 1)
             t_and_x = torch.cat([t_vec, x], 1)
             # Shape (batch_size, hidden_dim)
-            out = self.fc1(t_and_x)
+            out = F.linear(t_and_x, weight, self.fc1.bias)
         else:
-            out = self.fc1(x)
+            out = F.linear(x, weight, self.fc1.bias)
         out = self.non_linearity(out)
         out = self.fc2(out)
         out = self.non_linearity(out)
         out = self.fc3(out)
         return out
 
+    def _fused_dynamics(self, t, x):
+        """Same dynamics as forward, but the time input is folded into the
+        first linear layer as W_t * t + b instead of being concatenated to x."""
+        if self.time_dependent:
+            # First column of fc1 weight multiplies time, the rest multiply x
+            # Shape (hidden_dim,)
+            bias = self.fc1.bias + t * self.fc1.weight[:, 0]
+            # Shape (batch_size, hidden_dim)
+            out = F.linear(x, self.fc1.weight[:, 1:1 + x.shape[1]], bias)
+        else:
+            out = F.linear(x, self.fc1.weight[:, :x.shape[1]], self.fc1.bias)
+        out = self.non_linearity(out)
+        out = self.fc2(out)
+        out = self.non_linearity(out)
+        out = self.fc3(out)
+        return out
+
+    def _buffered_dynamics(self, t, x):
+        """Same dynamics as _fused_dynamics, but the time dependent bias and
+        the hidden activations are written into preallocated buffers. Only
+        valid without gradients."""
+        key = (x.shape[0], x.dtype, x.device, torch.is_inference_mode_enabled())
+        if key not in self._activation_buffers:
+            self._activation_buffers[key] = (
+                x.new_empty(self.hidden_dim),
+                x.new_empty((x.shape[0], self.hidden_dim)),
+                x.new_empty((x.shape[0], self.hidden_dim)))
+        bias, hidden1, hidden2 = self._activation_buffers[key]
+        if self.time_dependent:
+            # First column of fc1 weight multiplies time, the rest multiply x
+            torch.mul(self.fc1.weight[:, 0], t, out=bias)
+            bias += self.fc1.bias
+            weight = self.fc1.weight[:, 1:1 + x.shape[1]]
+        else:
+            bias.copy_(self.fc1.bias)
+            weight = self.fc1.weight[:, :x.shape[1]]
+        torch.addmm(bias, x, weight.t(), out=hidden1)
+        hidden1 = self.non_linearity(hidden1)
+        torch.addmm(self.fc2.bias, hidden1, self.fc2.weight.t(), out=hidden2)
+        hidden2 = self.non_linearity(hidden2)
+        # The solver keeps the derivatives of its stages, so the output is
+        # not reused
+        return self.fc3(hidden2)
+
+    def __getstate__(self):
+        # Compiled functions cannot be pickled, so recompile when unpickling
+        state = self.__dict__.copy()
+        state.pop('_compiled_dynamics', None)
+        state['_activation_buffers'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.compiled:
+            self._compiled_dynamics = compile_dynamics(self._fused_dynamics)
+
+
+class AutocastDynamics(nn.Module):
+    """Evaluates odefunc under autocast, so that its linear and convolutional
+    layers run in reduced precision, and returns the derivative in the dtype of
+    the state. The solver therefore accumulates the state and estimates the
+    error in full precision.
+
+    Parameters
+    ----------
+    odefunc : ODEFunc instance or anode.conv_models.ConvODEFunc instance
+
+    dtype : torch.dtype
+        One of torch.bfloat16 and torch.float16.
+    """
+
+    def __init__(self, odefunc, dtype):
+        super(AutocastDynamics, self).__init__()
+        self.odefunc = odefunc
+        self.dtype = dtype
+
+    def forward(self, t, x):
+        with torch.autocast(x.device.type, dtype=self.dtype):
+            out = self.odefunc(t, x)
+        return out.to(x.dtype)
+
+
+class RegularizedDynamics(nn.Module):
+    """Dynamics of a state augmented with the integrals of the regularizers of
+    RNODE (Finlay et al., 2020), so that they are computed by the same solve as
+    the state. The augmented state has shape (batch_size, state_dim +
+    len(regularizers)), where the first state_dim entries are the flattened
+    state and the last ones the regularizers integrated so far:
+
+    kinetic_energy : ||f(t, x)||^2
+    jacobian_frobenius : ||e^T df/dx||^2, where e is a Gaussian noise fixed for
+        the solve, which is an unbiased estimate of the squared Frobenius norm
+        of the Jacobian of f.
+
+    Parameters
+    ----------
+    func : callable
+        Function of (t, x) defining dynamics of system (e.g. ODEFunc).
+
+    state_shape : tuple of ints
+        Shape of a single (unflattened) state, e.g. (channels, height, width).
+
+    regularizers : tuple of strings
+        Subset of REGULARIZERS.
+    """
+
+    def __init__(self, func, state_shape, regularizers):
+        super(RegularizedDynamics, self).__init__()
+        self.func = func
+        self.state_shape = state_shape
+        self.state_dim = torch.Size(state_shape).numel()
+        self.regularizers = regularizers
+        self.noise = None
+
+    def forward(self, t, z):
+        grad_enabled = torch.is_grad_enabled()
+        x = z[:, :self.state_dim].reshape((z.shape[0],) + self.state_shape)
+        with torch.enable_grad():
+            if 'jacobian_frobenius' in self.regularizers and not x.requires_grad:
+                # Solves without gradients (e.g. forward pass of the adjoint
+                # method) still need the Jacobian with respect to the state
+                x = x.detach().requires_grad_()
+            dx = self.func(t, x)
+            out = [dx.reshape(z.shape[0], -1)]
+            for regularizer in self.regularizers:
+                if regularizer == 'kinetic_energy':
+                    # Shape (batch_size, 1)
+                    out.append(out[0].pow(2).sum(1, keepdim=True))
+                else:
+                    if self.noise is None or self.noise.shape != dx.shape:
+                        self.noise = torch.randn_like(dx)
+                    vjp, = torch.autograd.grad(dx, x, self.noise,
+                                               create_graph=grad_enabled)
+                    out.append(vjp.reshape(z.shape[0], -1).pow(2).sum(1, keepdim=True))
+        out = torch.cat(out, 1)
+        return out if grad_enabled else out.detach()
+
 
 class ODEBlock(nn.Module):
     """Solves ODE defined by odefunc.
@@ -96,20 +300,117 @@ class ODEBlock(nn.Module):
         If True, treats odefunc as a convolutional model.
 
     tol : float
-        Error tolerance.
+        Error tolerance. Used as rtol and atol unless solver sets them.
 
     adjoint : bool
         If True calculates gradient with adjoint method, otherwise
         backpropagates directly through operations of ODE solver.
+
+    solver : None or dict or anode.solvers.SolverSpec
+        Solver used to solve the ODE. If None uses dopri5, if dict it contains
+        the arguments of SolverSpec (e.g. {"method": "rk4", "num_steps": 10}).
+
+    checkpoint : bool
+        If True, only stores the accepted states and step sizes of the solver
+        and calculates gradient by recomputing one step at a time during the
+        backward pass. Cannot be used together with adjoint.
+
+    warm_start : bool
+        If True, records the accepted step sizes of every solve and starts the
+        next solve from the first step size of the previous one, instead of
+        selecting it from scratch. The cache is reset when the solver
+        tolerances, the odefunc or the weights (via load_state_dict) change.
+        Requires an adaptive solver and cannot be used together with adjoint.
+
+    partition : bool
+        If True, estimates how hard each sample is to integrate with a trial
+        step and solves the easy and hard samples as separate sub-batches, so
+        that a few hard samples do not force small steps on the whole batch.
+        Requires the dopri5 solver.
+
+    partition_ratio : float
+        A sample is hard if its error ratio on the trial step is more than
+        partition_ratio times the median of the nonzero error ratios of the
+        batch (so that many trivially easy samples, with zero error, do not
+        make every other sample hard). The default of 32 corresponds to
+        samples needing steps about 2 times smaller.
+
+    precision : None or string
+        If None evaluates odefunc in the precision of its inputs. If one of
+        'bf16' and 'fp16', evaluates odefunc under autocast in that precision,
+        while the state, its error estimate and step size control stay in
+        float32. 'fp16' requires a GPU, 'bf16' also speeds up CPUs with native
+        bfloat16 support.
+
+    regularizers : tuple of strings
+        Subset of REGULARIZERS. In training mode, integrates these regularizers
+        of the dynamics alongside the state (see RegularizedDynamics) and
+        stores their batch mean at the final time in self.regularization, so
+        that they can be added to the loss (see anode.training.Trainer).
+
+    implicit_augment : bool
+        If True and odefunc is augmented, the first layer of odefunc skips the
+        augmented dimensions when evaluated at the initial state (where they
+        are zero). Without gradients (e.g. evaluation), the augmented state is
+        also allocated once per batch shape and reused across batches, only
+        copying the data into it.
     """
 
-    def __init__(self, device, odefunc, is_conv=False, tol=1e-3, adjoint=False):
+    def __init__(self, device, odefunc, is_conv=False, tol=1e-3, adjoint=False,
+                 solver=None, checkpoint=False, warm_start=False,
+                 partition=False, partition_ratio=32., precision=None,
+                 regularizers=(), implicit_augment=False):
         super(ODEBlock, self).__init__()
         self.adjoint = adjoint
+        self.checkpoint = checkpoint
+        self.warm_start = warm_start
+        self.partition = partition
+        self.partition_ratio = partition_ratio
+        # Sizes and NFEs of sub-batches of last partitioned solve
+        self.partition_stats = {}
+        self.telemetry = None
+        self._telemetry_handles = []
+        self.step_size_cache = StepSizeCache()
         self.device = device
         self.is_conv = is_conv
         self.odefunc = odefunc
         self.tol = tol
+        self.solver = SolverSpec.from_config(solver, tol)
+        self.precision = precision
+        self.regularizers = tuple(regularizers)
+        # Regularizers of last forward pass in training mode
+        self.regularization = {}
+        # Shape of a single state while solving the regularized ODE
+        self._regularized_shape = None
+        self.implicit_augment = implicit_augment
+        # Augmented states reused across batches, by shape, dtype and device
+        self._augment_buffers = {}
+
+        for regularizer in self.regularizers:
+            if regularizer not in REGULARIZERS:
+                raise ValueError("Unknown regularizer {}, use one of {}".format(
+                    regularizer, REGULARIZERS))
+        if precision is not None and precision not in PRECISION_DTYPES:
+            raise ValueError("precision must be None or one of {}".format(
+                tuple(PRECISION_DTYPES)))
+        if precision == 'fp16' and torch.device(device).type != 'cuda':
+            # Autocast only supports float16 on GPU
+            raise ValueError("precision 'fp16' requires a CUDA device, use "
+                             "'bf16' on {}".format(torch.device(device).type))
+        if adjoint and checkpoint:
+            raise ValueError("Only one of adjoint and checkpoint can be True")
+        if checkpoint and self.solver.method not in RUNGE_KUTTA_METHODS:
+            raise ValueError("Checkpointing requires one of {} as solver "
+                             "method".format(RUNGE_KUTTA_METHODS))
+        if warm_start and (adjoint or self.solver.method != 'dopri5'):
+            raise ValueError("Warm starting requires the dopri5 solver and "
+                             "cannot be used with adjoint")
+        if partition and self.solver.method != 'dopri5':
+            raise ValueError("Partitioning requires the dopri5 solver")
+        # Preallocate integration time [0, 1] rather than creating it in
+        # every forward pass
+        self.register_buffer('integration_time', torch.tensor([0., 1.]),
+                             persistent=False)
 
     def forward(self, x, eval_times=None):
         """Solves ODE starting from x.
@@ -128,40 +429,238 @@ class ODEBlock(nn.Module):
         self.odefunc.nfe = 0
 
         if eval_times is None:
-            integration_time = torch.tensor([0, 1]).float().type_as(x)
+            integration_time = self.integration_time.type_as(x)
         else:
             integration_time = eval_times.type_as(x)
 
-        if self.odefunc.augment_dim > 0:
-            if self.is_conv:
-                # Add augmentation
-                batch_size, channels, height, width = x.shape
-                aug = torch.zeros(batch_size, self.odefunc.augment_dim,
-                                  height, width).to(self.device)
-                # Shape (batch_size, channels + augment_dim, height, width)
-                x_aug = torch.cat([x, aug], 1)
+        x_aug = self._augment(x)
+
+        regularize = len(self.regularizers) > 0 and self.training and \
+            torch.is_grad_enabled()
+        if regularize:
+            # Flatten state and append regularizers, which start at 0
+            state_shape = x_aug.shape[1:]
+            x_aug = torch.cat([x_aug.reshape(x_aug.shape[0], -1),
+                               x_aug.new_zeros(x_aug.shape[0],
+                                               len(self.regularizers))], 1)
+            self._regularized_shape = state_shape
+        elif self.implicit_augment:
+            # Let odefunc skip the zero augmented dimensions at initial state
+            self.odefunc.zero_augmented_input = x_aug
+
+        # Only cache step sizes of solves to the final time, as requested
+        # eval_times clip the steps of the solver
+        update_cache = eval_times is None
+        try:
+            if self.telemetry is None:
+                out = self._solve_batch(x_aug, integration_time, update_cache)
             else:
-                # Add augmentation
-                aug = torch.zeros(x.shape[0], self.odefunc.augment_dim).to(self.device)
-                # Shape (batch_size, data_dim + augment_dim)
-                x_aug = torch.cat([x, aug], 1)
-        else:
-            x_aug = x
-
-        if self.adjoint:
-            out = odeint_adjoint(self.odefunc, x_aug, integration_time,
-                                 rtol=self.tol, atol=self.tol, method='dopri5',
-                                 options={'max_num_steps': MAX_NUM_STEPS})
-        else:
-            out = odeint(self.odefunc, x_aug, integration_time,
-                         rtol=self.tol, atol=self.tol, method='dopri5',
-                         options={'max_num_steps': MAX_NUM_STEPS})
+                self.telemetry.start_solve(x.shape[0], x.device)
+                try:
+                    with self.telemetry.saved_tensors_hooks():
+                        out = self._solve_batch(x_aug, integration_time,
+                                                update_cache)
+                except Exception as e:
+                    # Record failed solves, to diagnose NFE blow ups
+                    self.telemetry.end_solve(x.device, error=e)
+                    self.telemetry.flush()
+                    raise
+                self.telemetry.end_solve(x.device)
+        finally:
+            self._regularized_shape = None
+            self.odefunc.zero_augmented_input = None
+
+        if regularize:
+            state_dim = x_aug.shape[1] - len(self.regularizers)
+            self.regularization = {
+                regularizer: out[-1, :, state_dim + i].mean()
+                for i, regularizer in enumerate(self.regularizers)
+            }
+            # Shape (len(integration_time), batch_size) + state_shape
+            out = out[:, :, :state_dim].reshape(out.shape[:2] + state_shape)
 
         if eval_times is None:
             return out[1]  # Return only final time
         else:
             return out
 
+    def _augment(self, x):
+        """Appends augment_dim zero dimensions (or channels) to x."""
+        if self.odefunc.augment_dim > 0:
+            # Shape (batch_size, data_dim + augment_dim) or (batch_size,
+            # channels + augment_dim, height, width)
+            shape = (x.shape[0], x.shape[1] + self.odefunc.augment_dim) + \
+                tuple(x.shape[2:])
+            if self.implicit_augment and not torch.is_grad_enabled():
+                # Buffers are only reused without gradients, so no autograd
+                # graph can hold a buffer overwritten by the next batch. Tensors
+                # allocated in inference mode can only be modified in inference
+                # mode, so they are cached separately
+                key = (shape, x.dtype, x.device, torch.is_inference_mode_enabled())
+                x_aug = self._augment_buffers.get(key)
+                if x_aug is None:
+                    # Only a few batch shapes are expected (e.g. the last
+                    # batch of an epoch is smaller)
+                    if len(self._augment_buffers) >= 4:
+                        self._augment_buffers = {}
+                    # Augmented dimensions are never written, so stay zero
+                    x_aug = x.new_zeros(shape)
+                    self._augment_buffers[key] = x_aug
+                x_aug[:, :x.shape[1]].copy_(x)
+                return x_aug
+            # Add augmentation
+            aug = x.new_zeros((x.shape[0], self.odefunc.augment_dim) +
+                              tuple(x.shape[2:]))
+            return torch.cat([x, aug], 1)
+        return x
+
+    def _solve_batch(self, x, integration_time, update_cache=True):
+        """Solves ODE for a batch, partitioning it if required."""
+        if self.partition and x.shape[0] > 1:
+            return self._partitioned_solve(x, integration_time, update_cache)
+        return self._solve(x, integration_time, update_cache)
+
+    def _solve(self, x, integration_time, update_cache=True):
+        """Solves ODE starting from x (after augmentation) and returns solution
+        at every time in integration_time."""
+        # Only switch to RungeKuttaSolver to record steps when telemetry asks
+        # for it, as it changes the solve being observed
+        records_steps = self.telemetry is not None and \
+            self.telemetry.solver_steps and not self.adjoint and \
+            self.solver.method in RUNGE_KUTTA_METHODS
+        if self.checkpoint or self.warm_start or records_steps:
+            return self._runge_kutta_solve(x, integration_time, update_cache)
+        elif self.adjoint:
+            return odeint_adjoint(self._dynamics(), x, integration_time,
+                                  rtol=self.solver.rtol, atol=self.solver.atol,
+                                  method=self.solver.method,
+                                  options=self.solver.options())
+        else:
+            return odeint(self._dynamics(), x, integration_time,
+                          rtol=self.solver.rtol, atol=self.solver.atol,
+                          method=self.solver.method,
+                          options=self.solver.options())
+
+    def _partitioned_solve(self, x, integration_time, update_cache=True):
+        """Splits batch into easy and hard samples, solves them separately and
+        scatters the solutions back into the original order. Gradients flow
+        through the indexing, so they are the same as for separate solves."""
+        nfe_start = self.odefunc.nfe
+        with torch.no_grad():
+            solver = RungeKuttaSolver(self._dynamics(), self.solver)
+            error_ratios = solver.sample_error_ratios(float(integration_time[0]), x)
+            nonzero_ratios = error_ratios[error_ratios > 0]
+            if len(nonzero_ratios):
+                is_hard = error_ratios > self.partition_ratio * nonzero_ratios.median()
+            else:
+                # All samples are trivially easy
+                is_hard = torch.zeros_like(error_ratios, dtype=torch.bool)
+        hard_indices = is_hard.nonzero().squeeze(1)
+        easy_indices = (~is_hard).nonzero().squeeze(1)
+        num_hard = len(hard_indices)
+        pilot_nfe = self.odefunc.nfe - nfe_start
+
+        if num_hard == 0:
+            out = self._solve(x, integration_time, update_cache)
+            self.partition_stats = {"sizes": [len(x)], "pilot_nfe": pilot_nfe,
+                                    "nfes": [self.odefunc.nfe - nfe_start - pilot_nfe]}
+            return out
+
+        nfe_easy_start = self.odefunc.nfe
+        out_easy = self._solve(x[easy_indices], integration_time, update_cache)
+        nfe_hard_start = self.odefunc.nfe
+        # Step sizes of hard samples should not warm start easy batches
+        out_hard = self._solve(x[hard_indices], integration_time,
+                               update_cache=False)
+        self.partition_stats = {
+            "sizes": [len(easy_indices), num_hard],
+            "pilot_nfe": pilot_nfe,
+            "nfes": [nfe_hard_start - nfe_easy_start,
+                     self.odefunc.nfe - nfe_hard_start]
+        }
+
+        # Shape (len(integration_time), batch_size, ...)
+        out = torch.cat([out_easy, out_hard], 1)
+        # Undo permutation of batch
+        inverse = torch.argsort(torch.cat([easy_indices, hard_indices]))
+        return out[:, inverse]
+
+    def _runge_kutta_solve(self, x, integration_time, update_cache=True):
+        """Solves ODE with anode.solvers.RungeKuttaSolver, which supports
+        checkpointing and warm starting.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Initial state (after augmentation).
+
+        integration_time : torch.Tensor
+
+        update_cache : bool
+            If True and warm starting, stores accepted step sizes in cache.
+        """
+        key = self._step_size_key()
+        first_step = None
+        if self.warm_start:
+            first_step = self.step_size_cache.first_step(key)
+        solver = RungeKuttaSolver(self._dynamics(), self.solver, first_step)
+        if self.checkpoint:
+            out = odeint_checkpoint(solver, x, integration_time)
+        else:
+            out = solver.integrate(x, integration_time)
+        if self.warm_start and update_cache:
+            self.step_size_cache.update(key, [dt for _, dt in solver.accepted_steps])
+        if self.telemetry is not None:
+            self.telemetry.record_steps(solver)
+        return out
+
+    def _dynamics(self):
+        """Returns function passed to the ODE solvers, which is odefunc
+        evaluated with the precision policy."""
+        if self.precision is None:
+            dynamics = self.odefunc
+        else:
+            dynamics = AutocastDynamics(self.odefunc,
+                                        PRECISION_DTYPES[self.precision])
+        if self._regularized_shape is not None:
+            dynamics = RegularizedDynamics(dynamics, self._regularized_shape,
+                                           self.regularizers)
+        return dynamics
+
+    def attach_telemetry(self, telemetry):
+        """Attaches an anode.telemetry.SolverTelemetry, which records statistics
+        of every solve. Returns telemetry.
+
+        Parameters
+        ----------
+        telemetry : anode.telemetry.SolverTelemetry
+        """
+        self.detach_telemetry()
+        self.telemetry = telemetry
+        self._telemetry_handles = [
+            self.odefunc.register_forward_pre_hook(telemetry._before_func),
+            self.odefunc.register_forward_hook(telemetry._after_func)
+        ]
+        return telemetry
+
+    def detach_telemetry(self):
+        """Removes telemetry attached with attach_telemetry."""
+        for handle in self._telemetry_handles:
+            handle.remove()
+        self._telemetry_handles = []
+        self.telemetry = None
+
+    def _step_size_key(self):
+        """Step sizes can only be reused by solves with the same solver
+        settings and dynamics."""
+        return (self.solver.method, self.solver.rtol, self.solver.atol,
+                id(self.odefunc))
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        # Step sizes of previous model are no longer relevant
+        self.step_size_cache.reset()
+        super(ODEBlock, self)._load_from_state_dict(*args, **kwargs)
+
     def trajectory(self, x, timesteps):
         """Returns ODE trajectory.
 
@@ -174,8 +673,40 @@ class ODEBlock(nn.Module):
             Number of timesteps in trajectory.
         """
         integration_time = torch.linspace(0., 1., timesteps)
-        tmp = self.forward(x, eval_times=integration_time)  # FIXME : for debugging
-        return tmp
+        if self.solver.method == 'dopri5':
+            # Interpolate a single solve instead of solving for every timestep
+            return self.dense_trajectory(x)(integration_time)
+        return self.forward(x, eval_times=integration_time)
+
+    def dense_trajectory(self, x):
+        """Solves ODE starting from x once with dopri5 and returns its dense
+        output, an anode.solvers.DenseSolution which evaluates the trajectory
+        at any times in [0, 1] without further function evaluations. For
+        example, dense_trajectory(x)(torch.linspace(0., 1., 100)) has shape
+        (100, batch_size, self.odefunc.input_dim).
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Shape (batch_size, self.odefunc.data_dim)
+        """
+        self.odefunc.nfe = 0
+        if self.telemetry is not None:
+            # Function evaluations should not be added to the previous solve
+            self.telemetry.flush()
+        first_step = None
+        if self.warm_start:
+            first_step = self.step_size_cache.first_step(self._step_size_key())
+        solver = RungeKuttaSolver(self._dynamics(), self.solver, first_step)
+        x_aug = self._augment(x)
+        if self.implicit_augment:
+            self.odefunc.zero_augmented_input = x_aug
+        try:
+            solver.integrate(x_aug, self.integration_time.type_as(x),
+                             keep_dense=True)
+        finally:
+            self.odefunc.zero_augmented_input = None
+        return solver.dense_solution()
 
 
 class ODENet(nn.Module):
@@ -211,11 +742,19 @@ class ODENet(nn.Module):
     adjoint : bool
         If True calculates gradient with adjoint method, otherwise
         backpropagates directly through operations of ODE solver.
+
+    compiled : bool
+        If True uses the allocation free, compiled dynamics of ODEFunc.
+
+    solver, checkpoint, warm_start, partition, precision, implicit_augment
+        Options of the solver and of how it is run. See ODEBlock.
     """
 
     def __init__(self, device, data_dim, hidden_dim, output_dim=1,
                  augment_dim=0, time_dependent=False, non_linearity='relu',
-                 tol=1e-3, adjoint=False):
+                 tol=1e-3, adjoint=False, compiled=False, solver=None,
+                 checkpoint=False, warm_start=False, partition=False,
+                 precision=None, implicit_augment=False):
         super(ODENet, self).__init__()
         self.device = device
         self.data_dim = data_dim
@@ -226,9 +765,13 @@ class ODENet(nn.Module):
         self.tol = tol
 
         self.odefunc = ODEFunc(device, data_dim, hidden_dim, augment_dim,
-                               time_dependent, non_linearity)
+                               time_dependent, non_linearity, compiled)
 
-        self.odeblock = ODEBlock(device, self.odefunc, tol=tol, adjoint=adjoint)
+        self.odeblock = ODEBlock(device, self.odefunc, tol=tol, adjoint=adjoint,
+                                 solver=solver, checkpoint=checkpoint,
+                                 warm_start=warm_start, partition=partition,
+                                 precision=precision,
+                                 implicit_augment=implicit_augment)
         # self.odeblock.odefunc.input_dim = data_dim + augment_dim
         # The role of linear layer y= A^T . X + B is to transform feature_dim (odefunc.input_dim) to output_dim
         self.linear_layer = nn.Linear(self.odeblock.odefunc.input_dim,
@@ -242,12 +785,30 @@ class ODENet(nn.Module):
         return pred
 
     def trajectory(self, x, timesteps):
-        features_trajectory = self.odeblock.trajectory(x, timesteps)
-        features = self.odeblock(x)
-        pred = self.linear_layer(features)
-        features_trajectory[timesteps - 1, 0, 0] = pred.item()  # FIXME : assume data_dim = 1
-        features_trajectory[timesteps - 1, 0, 1] = 0  # FIXME : assume augment_dim = 1
-        return features_trajectory
+        """Returns trajectory of features and predictions for a batch of
+        inputs, computed from a single ODE solve without gradients.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Shape (batch_size, data_dim)
+
+        timesteps : int
+            Number of timesteps in trajectory.
+
+        Returns
+        -------
+        features_trajectory : torch.Tensor
+            Shape (timesteps, batch_size, data_dim + augment_dim)
+
+        pred : torch.Tensor
+            Predictions from features at final time. Shape
+            (batch_size, output_dim)
+        """
+        with torch.no_grad():
+            features_trajectory = self.odeblock.trajectory(x, timesteps)
+            pred = self.linear_layer(features_trajectory[-1])
+        return features_trajectory, pred
 
     def get_nfe(self):
         return self.odefunc.nfe
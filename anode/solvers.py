@@ -0,0 +1,584 @@
+import torch
+
+MAX_NUM_STEPS = 1000  # Maximum number of steps for ODE solver
+
+# Names of torchdiffeq solvers with adaptive step sizes
+ADAPTIVE_METHODS = ('dopri8', 'dopri5', 'bosh3', 'fehlberg2', 'adaptive_heun')
+# Names of torchdiffeq solvers working on a fixed grid of time steps
+FIXED_GRID_METHODS = ('euler', 'midpoint', 'rk4', 'explicit_adams',
+                      'implicit_adams')
+
+
+class SolverSpec():
+    """Specification of the ODE solver used by an ODEBlock.
+
+    Parameters
+    ----------
+    method : string
+        Name of torchdiffeq solver. One of ADAPTIVE_METHODS (e.g. 'dopri5') or
+        FIXED_GRID_METHODS (e.g. 'rk4' or 'midpoint').
+
+    rtol : float
+        Relative error tolerance of adaptive solvers.
+
+    atol : float
+        Absolute error tolerance of adaptive solvers.
+
+    max_num_steps : int
+        Maximum number of steps taken by adaptive solvers.
+
+    step_size : None or float
+        Step size of fixed grid solvers.
+
+    num_steps : None or int
+        Number of steps taken by fixed grid solvers over the integration
+        interval. Exactly one of step_size and num_steps must be set for fixed
+        grid solvers.
+    """
+
+    def __init__(self, method='dopri5', rtol=1e-3, atol=1e-3,
+                 max_num_steps=MAX_NUM_STEPS, step_size=None, num_steps=None):
+        if method not in ADAPTIVE_METHODS + FIXED_GRID_METHODS:
+            raise ValueError("Unknown solver method {}".format(method))
+        if method in FIXED_GRID_METHODS and (step_size is None) == (num_steps is None):
+            raise ValueError("Fixed grid solver {} requires exactly one of "
+                             "step_size and num_steps".format(method))
+        if method in ADAPTIVE_METHODS and (step_size is not None or num_steps is not None):
+            raise ValueError("Adaptive solver {} does not take step_size or "
+                             "num_steps".format(method))
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.max_num_steps = max_num_steps
+        self.step_size = step_size
+        self.num_steps = num_steps
+
+    @classmethod
+    def from_config(cls, config=None, tol=1e-3):
+        """Creates a SolverSpec from a solver entry of a model config.
+
+        Parameters
+        ----------
+        config : None or dict or SolverSpec
+            If None, returns a dopri5 solver. If dict, keys are arguments of
+            SolverSpec (see the "solver" entries of config.json).
+
+        tol : float
+            Default for rtol and atol if they are not specified in config.
+        """
+        if isinstance(config, SolverSpec):
+            return config
+        kwargs = {"rtol": tol, "atol": tol}
+        if config is not None:
+            kwargs.update(config)
+        return cls(**kwargs)
+
+    @property
+    def is_adaptive(self):
+        return self.method in ADAPTIVE_METHODS
+
+    def options(self):
+        """Returns options dict to pass to torchdiffeq.odeint."""
+        if self.is_adaptive:
+            return {'max_num_steps': self.max_num_steps}
+        if self.step_size is not None:
+            return {'step_size': self.step_size}
+        return {'grid_constructor': self._uniform_grid}
+
+    def _uniform_grid(self, func, y0, t):
+        """Grid of num_steps equally spaced steps between t[0] and t[-1]."""
+        return torch.linspace(float(t[0]), float(t[-1]), self.num_steps + 1,
+                              dtype=t.dtype, device=t.device)
+
+    def to_config(self):
+        """Returns dict which can be stored in a config file."""
+        config = {"method": self.method}
+        if self.is_adaptive:
+            config.update({"rtol": self.rtol, "atol": self.atol,
+                           "max_num_steps": self.max_num_steps})
+        elif self.step_size is not None:
+            config["step_size"] = self.step_size
+        else:
+            config["num_steps"] = self.num_steps
+        return config
+
+    def __repr__(self):
+        return "SolverSpec({})".format(
+            ", ".join("{}={}".format(k, v) for k, v in self.to_config().items()))
+
+
+class ButcherTableau():
+    """Butcher tableau of an explicit Runge-Kutta method.
+
+    Parameters
+    ----------
+    alpha : list of floats
+        Time offsets (as a fraction of the step size) of stages 2 to s.
+
+    beta : list of lists of floats
+        Weights of previous stages used to compute stages 2 to s.
+
+    c_sol : list of floats
+        Weights of stages used to compute the solution.
+
+    c_error : None or list of floats
+        Weights of stages used to compute the local error estimate. None for
+        methods without an embedded error estimate.
+
+    fsal : bool
+        If True, last stage is evaluated at the solution (first same as last),
+        so it can be reused as the first stage of the next step.
+    """
+
+    def __init__(self, alpha, beta, c_sol, c_error=None, fsal=False):
+        self.alpha = alpha
+        self.beta = beta
+        self.c_sol = c_sol
+        self.c_error = c_error
+        self.fsal = fsal
+
+
+# Dormand-Prince 5(4) tableau, as used by dopri5 in torchdiffeq
+DOPRI5_TABLEAU = ButcherTableau(
+    alpha=[1 / 5, 3 / 10, 4 / 5, 8 / 9, 1., 1.],
+    beta=[
+        [1 / 5],
+        [3 / 40, 9 / 40],
+        [44 / 45, -56 / 15, 32 / 9],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+        [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+    ],
+    c_sol=[35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0],
+    c_error=[
+        35 / 384 - 1951 / 21600,
+        0,
+        500 / 1113 - 22642 / 50085,
+        125 / 192 - 451 / 720,
+        -2187 / 6784 + 12231 / 42400,
+        11 / 84 - 649 / 6300,
+        -1. / 60.,
+    ],
+    fsal=True)
+
+# Tableaus of fixed grid methods, matching the torchdiffeq methods of the same
+# name (rk4 is the 3/8 rule variant used by torchdiffeq)
+FIXED_GRID_TABLEAUS = {
+    'euler': ButcherTableau(alpha=[], beta=[], c_sol=[1.]),
+    'midpoint': ButcherTableau(alpha=[1 / 2], beta=[[1 / 2]], c_sol=[0., 1.]),
+    'rk4': ButcherTableau(alpha=[1 / 3, 2 / 3, 1.],
+                          beta=[[1 / 3], [-1 / 3, 1.], [1., -1., 1.]],
+                          c_sol=[1 / 8, 3 / 8, 3 / 8, 1 / 8]),
+}
+
+# Weights of stages giving the solution at the midpoint of a dopri5 step,
+# used to fit its continuous extension (Shampine, 1986)
+DPS_C_MID = [
+    6025192743 / 30085553152 / 2, 0, 51252292925 / 65400821598 / 2,
+    -2691868925 / 45128329728 / 2, 187940372067 / 1594534317056 / 2,
+    -1776094331 / 19743644256 / 2, 11237099 / 235043384 / 2
+]
+
+# Methods supported by RungeKuttaSolver
+RUNGE_KUTTA_METHODS = ('dopri5',) + tuple(FIXED_GRID_TABLEAUS.keys())
+
+# Constants of the adaptive step size controller (same as torchdiffeq)
+SAFETY = 0.9
+IFACTOR = 10.
+DFACTOR = 0.2
+
+
+def _weighted_sum(weights, k):
+    """Returns sum of weights[i] * k[i], skipping zero weights."""
+    total = 0.
+    for weight, k_i in zip(weights, k):
+        if weight != 0:
+            total = total + weight * k_i
+    return total
+
+
+def _rms_norm(tensor):
+    return tensor.pow(2).mean().sqrt()
+
+
+def _interp_fit(y0, y1, k, dt):
+    """Fits the fourth order polynomial continuous extension of a dopri5 step
+    from its stage derivatives k, as in torchdiffeq. Returns coefficients of
+    shape (5,) + y0.shape, from lowest to highest order."""
+    y_mid = y0 + dt * _weighted_sum(DPS_C_MID, k)
+    f0 = k[0]
+    f1 = k[-1]
+    a = 2 * dt * (f1 - f0) - 8 * (y1 + y0) + 16 * y_mid
+    b = dt * (5 * f0 - 3 * f1) + 18 * y0 + 14 * y1 - 32 * y_mid
+    c = dt * (f1 - 4 * f0) - 11 * y0 - 5 * y1 + 16 * y_mid
+    d = dt * f0
+    e = y0
+    return torch.stack([e, d, c, b, a])
+
+
+class DenseSolution():
+    """Continuous extension of a dopri5 solve. Holds the interpolating
+    polynomial of every accepted step, so the solution can be evaluated at any
+    time in the integration interval without further function evaluations.
+
+    Parameters
+    ----------
+    step_starts : list of floats
+        Start time of every accepted step.
+
+    step_ends : list of floats
+        End time of every accepted step.
+
+    coefficients : torch.Tensor
+        Polynomial coefficients of every accepted step. Shape
+        (num_steps, 5) + state shape.
+    """
+
+    def __init__(self, step_starts, step_ends, coefficients):
+        self.step_starts = torch.tensor(step_starts, dtype=torch.float64)
+        self.step_ends = torch.tensor(step_ends, dtype=torch.float64)
+        self.coefficients = coefficients
+
+    def __call__(self, t):
+        """Evaluates solution at times t. Returns tensor of shape
+        (len(t),) + state shape.
+
+        Parameters
+        ----------
+        t : torch.Tensor
+            Times in integration interval.
+        """
+        t = t.detach().cpu().to(torch.float64)
+        # Index of step containing every time
+        step_index = torch.searchsorted(self.step_starts, t, right=True) - 1
+        step_index = step_index.clamp(0, len(self.step_starts) - 1)
+        # Position of every time within its step, between 0 and 1
+        x = (t - self.step_starts[step_index]) / \
+            (self.step_ends[step_index] - self.step_starts[step_index])
+        coefficients = self.coefficients
+        # Shape (len(t), 5)
+        powers = x.unsqueeze(1) ** torch.arange(5, dtype=torch.float64)
+        powers = powers.to(dtype=coefficients.dtype, device=coefficients.device)
+        powers = powers.view(powers.shape + (1,) * (coefficients.dim() - 2))
+        step_index = step_index.to(coefficients.device)
+        return (powers * coefficients[step_index]).sum(1)
+
+
+class RungeKuttaSolver():
+    """Explicit Runge-Kutta ODE solver which, unlike torchdiffeq, gives access
+    to the steps it takes. Steps are clipped so that the solver lands exactly
+    on every requested time, which allows the solve to be recomputed step by
+    step.
+
+    Parameters
+    ----------
+    func : callable
+        Function of (t, x) defining dynamics of system.
+
+    spec : SolverSpec
+        Solver specification. Method must be one of RUNGE_KUTTA_METHODS.
+
+    first_step : None or float
+        Size of first step of adaptive solvers. If None, it is selected from
+        the initial state, which costs an extra function evaluation and often
+        leads to rejected steps early in the solve.
+    """
+
+    def __init__(self, func, spec, first_step=None):
+        if spec.method not in RUNGE_KUTTA_METHODS:
+            raise ValueError("RungeKuttaSolver does not support method {}, "
+                             "use one of {}".format(spec.method, RUNGE_KUTTA_METHODS))
+        self.func = func
+        self.spec = spec
+        self.first_step = first_step
+        if spec.method == 'dopri5':
+            self.tableau = DOPRI5_TABLEAU
+        else:
+            self.tableau = FIXED_GRID_TABLEAUS[spec.method]
+        self.order = 5  # Order of dopri5, used by step size controller
+        self.accepted_steps = []  # List of (t0, dt) of accepted steps
+        self.num_rejected = 0
+        # For every interval between requested times, list of (t0, dt, y0) of
+        # accepted steps
+        self.checkpoints = []
+        # Coefficients of continuous extension of every accepted step
+        self.dense_coefficients = []
+
+    def step(self, t0, y0, dt, f0=None):
+        """Takes a single Runge-Kutta step of size dt from (t0, y0). Returns
+        solution, derivative at solution (None if method is not first same as
+        last), error estimate (None for fixed grid methods) and list of stage
+        derivatives.
+
+        Parameters
+        ----------
+        t0 : float
+
+        y0 : torch.Tensor
+
+        dt : float
+
+        f0 : None or torch.Tensor
+            Derivative at (t0, y0). Computed if None.
+        """
+        if f0 is None:
+            f0 = self.func(self._time(t0, y0), y0)
+        k = [f0]
+        for alpha_i, beta_i in zip(self.tableau.alpha, self.tableau.beta):
+            y_i = y0 + dt * _weighted_sum(beta_i, k)
+            k.append(self.func(self._time(t0 + alpha_i * dt, y0), y_i))
+        if self.tableau.fsal:
+            # Last stage was evaluated at solution
+            y1 = y_i
+            f1 = k[-1]
+        else:
+            y1 = y0 + dt * _weighted_sum(self.tableau.c_sol, k)
+            f1 = None
+        if self.tableau.c_error is None:
+            y1_error = None
+        else:
+            y1_error = dt * _weighted_sum(self.tableau.c_error, k)
+        return y1, f1, y1_error, k
+
+    def integrate(self, y0, t, keep_checkpoints=False, keep_dense=False):
+        """Solves ODE starting from y0 at t[0]. Returns solution at every time
+        in t, of shape (len(t),) + y0.shape.
+
+        Parameters
+        ----------
+        y0 : torch.Tensor
+
+        t : torch.Tensor
+            Increasing times at which to return solution.
+
+        keep_checkpoints : bool
+            If True, stores (t0, dt, y0) of every accepted step in
+            self.checkpoints.
+
+        keep_dense : bool
+            If True, stores coefficients of the continuous extension of every
+            accepted dopri5 step, see dense_solution.
+        """
+        if keep_dense and self.spec.method != 'dopri5':
+            raise ValueError("Dense output requires the dopri5 solver")
+        times = t.tolist()
+        adaptive = self.spec.is_adaptive
+        t0 = times[0]
+        y = y0
+        f = None
+        if adaptive:
+            f = self.func(self._time(t0, y0), y0)
+            if self.first_step is None:
+                dt = self._initial_step_size(t0, y0, f)
+            else:
+                dt = self.first_step
+        elif self.spec.step_size is not None:
+            dt = self.spec.step_size
+        else:
+            dt = (times[-1] - times[0]) / self.spec.num_steps
+
+        solution = [y0]
+        for t_end in times[1:]:
+            checkpoints = []
+            num_steps = 0
+            while t0 < t_end:
+                if adaptive:
+                    assert num_steps < self.spec.max_num_steps, \
+                        'max_num_steps exceeded ({}>={})'.format(num_steps, self.spec.max_num_steps)
+                num_steps += 1
+                # Clip step so that solver lands exactly on t_end (allowing
+                # for round off so fixed grids do not take a tiny extra step)
+                lands = t_end - (t0 + dt) <= 1e-6 * dt
+                dt_step = t_end - t0 if lands else dt
+                assert t0 + dt_step > t0, 'underflow in dt {}'.format(dt_step)
+
+                y1, f1, y1_error, k = self.step(t0, y, dt_step, f)
+
+                if adaptive:
+                    # Step size control is not differentiated through
+                    error_tol = self.spec.atol + self.spec.rtol * torch.max(y.abs(), y1.abs()).detach()
+                    error_ratio = float(_rms_norm(y1_error.detach() / error_tol))
+                    accept_step = error_ratio <= 1
+                    dt = self._optimal_step_size(dt_step, error_ratio)
+                else:
+                    accept_step = True
+
+                if accept_step:
+                    if keep_checkpoints:
+                        checkpoints.append((t0, dt_step, y))
+                    if keep_dense:
+                        self.dense_coefficients.append(
+                            _interp_fit(y, y1, k, dt_step))
+                    self.accepted_steps.append((t0, dt_step))
+                    t0 = t_end if lands else t0 + dt_step
+                    y = y1
+                    f = f1
+                else:
+                    self.num_rejected += 1
+            self.checkpoints.append(checkpoints)
+            solution.append(y)
+        return torch.stack(solution)
+
+    def sample_error_ratios(self, t0, y0):
+        """Estimates how hard every sample in a batch is to integrate. Takes a
+        trial step of initial step size from (t0, y0) and returns, for every
+        sample, the RMS norm of its local error relative to the tolerance.
+        Since local error of dopri5 scales as dt^5, a sample with an error
+        ratio 32 times larger needs steps roughly 2 times smaller.
+
+        Parameters
+        ----------
+        t0 : float
+
+        y0 : torch.Tensor
+            Shape (batch_size, ...).
+        """
+        if self.spec.method != 'dopri5':
+            raise ValueError("Error estimates require the dopri5 solver")
+        f0 = self.func(self._time(t0, y0), y0)
+        if self.first_step is None:
+            dt = self._initial_step_size(t0, y0, f0)
+        else:
+            dt = self.first_step
+        y1, _, y1_error, _ = self.step(t0, y0, dt, f0)
+        error_tol = self.spec.atol + self.spec.rtol * torch.max(y0.abs(), y1.abs())
+        # Shape (batch_size,)
+        return (y1_error / error_tol).pow(2).flatten(1).mean(1).sqrt()
+
+    def dense_solution(self):
+        """Returns DenseSolution of last call to integrate with
+        keep_dense=True."""
+        return DenseSolution([t0 for t0, _ in self.accepted_steps],
+                             [t0 + dt for t0, dt in self.accepted_steps],
+                             torch.stack(self.dense_coefficients))
+
+    def _time(self, t, y):
+        """Time as a tensor with the same dtype and device as y."""
+        return torch.tensor(t, dtype=y.dtype, device=y.device)
+
+    def _optimal_step_size(self, dt, error_ratio):
+        """Returns size of next step given the error ratio of the last step."""
+        if error_ratio == 0:
+            return dt * IFACTOR
+        dfactor = 1. if error_ratio < 1 else DFACTOR
+        factor = min(IFACTOR, max(SAFETY / error_ratio ** (1. / self.order), dfactor))
+        return dt * factor
+
+    def _initial_step_size(self, t0, y0, f0):
+        """Selects size of first step, following torchdiffeq (and E. Hairer,
+        S. P. Norsett, G. Wanner, Solving Ordinary Differential Equations I,
+        Sec. II.4). Step size selection is not differentiated through."""
+        order = self.order - 1
+        with torch.no_grad():
+            scale = self.spec.atol + y0.abs() * self.spec.rtol
+            d0 = float(_rms_norm(y0 / scale))
+            d1 = float(_rms_norm(f0 / scale))
+            if d0 < 1e-5 or d1 < 1e-5:
+                h0 = 1e-6
+            else:
+                h0 = 0.01 * d0 / d1
+            y1 = y0 + h0 * f0
+            f1 = self.func(self._time(t0 + h0, y0), y1)
+            d2 = float(_rms_norm((f1 - f0) / scale)) / h0
+        if d1 <= 1e-15 and d2 <= 1e-15:
+            h1 = max(1e-6, h0 * 1e-3)
+        else:
+            h1 = (0.01 / max(d1, d2)) ** (1. / (order + 1))
+        return min(100 * h0, h1)
+
+
+class _CheckpointedOdeint(torch.autograd.Function):
+    """Solves ODE without storing the graph of the solver. Only the accepted
+    states and step sizes are kept, and the backward pass recomputes one step
+    at a time to backpropagate through it (as in ACA, Zhuang et al. 2020)."""
+
+    @staticmethod
+    def forward(ctx, solver, y0, t, *params):
+        solution = solver.integrate(y0, t, keep_checkpoints=True)
+        ctx.solver = solver
+        ctx.save_for_backward(*params)
+        return solution
+
+    @staticmethod
+    def backward(ctx, grad_solution):
+        solver = ctx.solver
+        params = ctx.saved_tensors
+        grad_params = [torch.zeros_like(param) for param in params]
+        grad_y = grad_solution[-1]
+        # Traverse intervals between requested times, and the steps within
+        # them, in reverse order
+        for i in reversed(range(len(solver.checkpoints))):
+            for t0, dt, y0 in reversed(solver.checkpoints[i]):
+                with torch.enable_grad():
+                    y0 = y0.detach().requires_grad_(True)
+                    y1, _, _, _ = solver.step(t0, y0, dt)
+                    grads = torch.autograd.grad(y1, (y0,) + params, grad_y,
+                                                allow_unused=True)
+                grad_y = grads[0]
+                for grad_param, grad in zip(grad_params, grads[1:]):
+                    if grad is not None:
+                        grad_param += grad
+            # Add gradient with respect to solution at start of interval
+            grad_y = grad_y + grad_solution[i]
+        # Free checkpoints
+        solver.checkpoints = []
+        ctx.solver = None
+        return (None, grad_y, None) + tuple(grad_params)
+
+
+def odeint_checkpoint(solver, y0, t):
+    """Solves ODE with solver, backpropagating through the solver by
+    recomputing one step at a time from stored checkpoints. Memory is
+    O(number of steps x size of state) and gradients are the exact gradients of
+    the discretized solve (unlike the adjoint method, which re-solves the ODE
+    backwards in time).
+
+    Parameters
+    ----------
+    solver : RungeKuttaSolver
+        Solver whose func is a torch.nn.Module defining dynamics of system.
+
+    y0 : torch.Tensor
+        Initial state.
+
+    t : torch.Tensor
+        Increasing times at which to return solution.
+    """
+    params = tuple(param for param in solver.func.parameters()
+                   if param.requires_grad)
+    return _CheckpointedOdeint.apply(solver, y0, t, *params)
+
+
+class StepSizeCache():
+    """Accepted step sizes of the previous solve of an ODEBlock, used to warm
+    start the next solve. Consecutive batches from the same model need almost
+    the same step sizes, so the first step of the previous solve is a good
+    first step for the next one.
+
+    The cache is only used by solves with the same key (e.g. same tolerances
+    and model) as the solve which filled it.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.step_sizes = []  # Accepted step sizes of previous solve
+        self.hits = 0  # Number of solves which were warm started
+        self.misses = 0  # Number of solves which were not warm started
+
+    def first_step(self, key):
+        """Returns first step for a solve with given key, or None if the cache
+        does not hold steps for this key."""
+        if key == self.key and len(self.step_sizes):
+            self.hits += 1
+            return self.step_sizes[0]
+        self.misses += 1
+        return None
+
+    def update(self, key, step_sizes):
+        """Stores accepted step sizes of a solve with given key."""
+        self.key = key
+        self.step_sizes = list(step_sizes)
+
+    def reset(self):
+        self.key = None
+        self.step_sizes = []
@@ -0,0 +1,128 @@
+from numpy import mean
+
+
+class StoppingPolicy():
+    """Decides when anode.training.Trainer should stop training. Policies are
+    checked after every batch (end_of_epoch is False) and after every epoch
+    (end_of_epoch is True), and return the reason for stopping or None to
+    continue training.
+    """
+
+    def check(self, trainer, end_of_epoch):
+        """Returns reason for stopping (a string) or None.
+
+        Parameters
+        ----------
+        trainer : anode.training.Trainer
+
+        end_of_epoch : bool
+        """
+        raise NotImplementedError
+
+
+class LossPlateau(StoppingPolicy):
+    """Stops when the epoch loss has not decreased by more than min_delta for
+    patience epochs.
+
+    Parameters
+    ----------
+    patience : int
+
+    min_delta : float
+    """
+
+    def __init__(self, patience, min_delta=0.):
+        self.patience = patience
+        self.min_delta = min_delta
+
+    def check(self, trainer, end_of_epoch):
+        if not end_of_epoch:
+            return None
+        # Losses of ensembles are lists with the loss of every replica
+        losses = [mean(loss) for loss in trainer.histories['epoch_loss_history']]
+        if len(losses) <= self.patience:
+            return None
+        best_before = min(losses[:-self.patience])
+        if min(losses[-self.patience:]) > best_before - self.min_delta:
+            return "loss plateaued for {} epochs".format(self.patience)
+        return None
+
+
+class WallClockBudget(StoppingPolicy):
+    """Stops when the training time exceeds budget seconds.
+
+    Parameters
+    ----------
+    budget : float
+        Budget in seconds.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def check(self, trainer, end_of_epoch):
+        if trainer.train_time > self.budget:
+            return "wall clock budget of {}s exceeded".format(self.budget)
+        return None
+
+
+class NFEBudget(StoppingPolicy):
+    """Stops when the cumulative number of function evaluations (forward and
+    backward) exceeds budget.
+
+    Parameters
+    ----------
+    budget : int
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def check(self, trainer, end_of_epoch):
+        if trainer.total_nfes > self.budget:
+            return "NFE budget of {} exceeded".format(self.budget)
+        return None
+
+
+class NFECeiling(StoppingPolicy):
+    """Stops when the number of function evaluations (forward and backward) of
+    a batch exceeds ceiling, i.e. when the dynamics have become so stiff that
+    further training is excessively expensive.
+
+    Parameters
+    ----------
+    ceiling : int
+    """
+
+    def __init__(self, ceiling):
+        self.ceiling = ceiling
+
+    def check(self, trainer, end_of_epoch):
+        if trainer.last_batch_nfes > self.ceiling:
+            return "NFE per batch ceiling of {} exceeded ({} NFEs)".format(
+                self.ceiling, trainer.last_batch_nfes)
+        return None
+
+
+def stopping_policies_from_config(config):
+    """Creates stopping policies from the "stopping" entry of a training
+    config, e.g. {"patience": 5, "min_delta": 1e-4, "time_budget": 3600,
+    "nfe_budget": 1e7, "nfe_ceiling": 2000}. All entries are optional.
+
+    Parameters
+    ----------
+    config : None or dict
+    """
+    if config is None:
+        return []
+    policies = []
+    if "patience" in config:
+        policies.append(LossPlateau(config["patience"],
+                                    config.get("min_delta", 0.)))
+    if "time_budget" in config:
+        policies.append(WallClockBudget(config["time_budget"]))
+    if "nfe_budget" in config:
+        policies.append(NFEBudget(config["nfe_budget"]))
+    if "nfe_ceiling" in config:
+        policies.append(NFECeiling(config["nfe_ceiling"]))
+    return policies
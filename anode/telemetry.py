@@ -0,0 +1,180 @@
+import json
+import time
+import numpy as np
+import torch
+
+# Edges of step size histogram, two bins per decade from 1e-6 to 1
+STEP_SIZE_BIN_EDGES = [10 ** (e / 2.) for e in range(-12, 1)]
+
+
+class SolverTelemetry():
+    """Records statistics of every solve of an ODEBlock. Attach it with
+    ODEBlock.attach_telemetry. For every solve, a record (a dict) is created
+    with the following entries:
+
+    batch_size : size of batch solved.
+    forward_nfe, backward_nfe : number of function evaluations during the
+        solve and during the following backward pass (adjoint solve or
+        recomputation of checkpointed steps).
+    accepted_steps, rejected_steps : number of steps of the solver.
+    step_size_histogram : counts of accepted step sizes in the bins defined
+        by bin_edges.
+    solve_time : wall time of the solve in seconds.
+    forward_func_time, backward_func_time : wall time spent in the ODE
+        function during the solve and during the backward pass.
+    saved_tensor_bytes : memory held by tensors saved for the backward pass
+        (or by checkpoints), which grows with the number of steps.
+    peak_cuda_memory : peak memory allocated on GPU during the solve (None on
+        CPU).
+    error : message of the error raised by the solver (e.g. when exceeding
+        max_num_steps), None if the solve succeeded.
+
+    Step statistics require the solve to run on anode.solvers.RungeKuttaSolver
+    (as with checkpoint or warm_start), otherwise they are None. Attaching
+    telemetry does not change the solver unless solver_steps is True.
+
+    A record is completed (passed to hooks and written to the JSONL file) when
+    flush is called, e.g. by anode.training.Trainer after the backward pass,
+    or when the next solve starts.
+
+    Parameters
+    ----------
+    jsonl_path : None or string
+        If not None, every record is appended as a line of JSON to this file.
+
+    bin_edges : list of floats
+        Edges of step size histogram. Step sizes outside the edges are counted
+        in the first or last bin.
+
+    solver_steps : bool
+        If True, ODEBlock solves all non adjoint solves with dopri5, euler,
+        midpoint or rk4 with RungeKuttaSolver instead of torchdiffeq, to
+        record their steps. NFEs and timings are then those of
+        RungeKuttaSolver, which may differ from those of the same model
+        without telemetry.
+    """
+
+    def __init__(self, jsonl_path=None, bin_edges=STEP_SIZE_BIN_EDGES,
+                 solver_steps=False):
+        self.jsonl_path = jsonl_path
+        self.bin_edges = bin_edges
+        self.solver_steps = solver_steps
+        self.records = []
+        self.hooks = []
+        self._record = None  # Record of current solve, until flushed
+        self._step_sizes = []
+        self._in_solve = False
+        self._func_start = None
+        self._saved_storages = {}
+
+    def register_hook(self, hook):
+        """Registers hook(record), called whenever a record is completed."""
+        self.hooks.append(hook)
+
+    def start_solve(self, batch_size, device):
+        """Starts a new record. Called by ODEBlock at start of forward."""
+        self.flush()
+        self._record = {
+            "batch_size": batch_size,
+            "forward_nfe": 0, "backward_nfe": 0,
+            "accepted_steps": None, "rejected_steps": None,
+            "step_size_histogram": None, "bin_edges": self.bin_edges,
+            "solve_time": None,
+            "forward_func_time": 0., "backward_func_time": 0.,
+            "saved_tensor_bytes": 0, "peak_cuda_memory": None,
+            "error": None
+        }
+        self._step_sizes = []
+        self._saved_storages = {}
+        self._in_solve = True
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        self._solve_start = time.time()
+
+    def end_solve(self, device, error=None):
+        """Ends the solve of current record. Called by ODEBlock at end of
+        forward, with the error raised by the solver if the solve failed."""
+        self._record["solve_time"] = time.time() - self._solve_start
+        if error is not None:
+            self._record["error"] = str(error)
+        self._record["saved_tensor_bytes"] += sum(self._saved_storages.values())
+        self._saved_storages = {}
+        if device.type == 'cuda':
+            self._record["peak_cuda_memory"] = torch.cuda.max_memory_allocated(device)
+        if self._record["accepted_steps"] is not None:
+            sizes = np.clip(self._step_sizes, self.bin_edges[0], self.bin_edges[-1])
+            counts, _ = np.histogram(sizes, self.bin_edges)
+            self._record["step_size_histogram"] = counts.tolist()
+        self._in_solve = False
+
+    def record_steps(self, solver):
+        """Adds steps of an anode.solvers.RungeKuttaSolver to current record.
+        Called once for every (sub-batch) solve."""
+        record = self._record
+        if record is None:
+            return
+        if record["accepted_steps"] is None:
+            record["accepted_steps"] = 0
+            record["rejected_steps"] = 0
+        record["accepted_steps"] += len(solver.accepted_steps)
+        record["rejected_steps"] += solver.num_rejected
+        self._step_sizes.extend(dt for _, dt in solver.accepted_steps)
+        for checkpoints in solver.checkpoints:
+            for _, _, y in checkpoints:
+                record["saved_tensor_bytes"] += y.numel() * y.element_size()
+
+    def saved_tensors_hooks(self):
+        """Context manager recording the memory of tensors saved for backward
+        during the solve. Storages shared by several saved tensors are only
+        counted once."""
+        def pack(tensor):
+            storage = tensor.untyped_storage()
+            self._saved_storages[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        def unpack(tensor):
+            return tensor
+
+        return torch.autograd.graph.saved_tensors_hooks(pack, unpack)
+
+    def _before_func(self, module, inputs):
+        """Forward pre-hook of odefunc."""
+        self._func_start = time.time()
+
+    def _after_func(self, module, inputs, output):
+        """Forward hook of odefunc."""
+        if self._record is None:
+            return
+        elapsed = time.time() - self._func_start
+        if self._in_solve:
+            self._record["forward_nfe"] += 1
+            self._record["forward_func_time"] += elapsed
+        else:
+            self._record["backward_nfe"] += 1
+            self._record["backward_func_time"] += elapsed
+
+    def flush(self):
+        """Completes current record, passing it to hooks and writing it to the
+        JSONL file."""
+        record = self._record
+        if record is None or self._in_solve:
+            return
+        self._record = None
+        self.records.append(record)
+        if self.jsonl_path is not None:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        for hook in self.hooks:
+            hook(record)
+
+    def summary(self):
+        """Returns mean of numerical entries over all records."""
+        keys = ["forward_nfe", "backward_nfe", "accepted_steps",
+                "rejected_steps", "solve_time", "forward_func_time",
+                "backward_func_time", "saved_tensor_bytes"]
+        summary = {}
+        for key in keys:
+            values = [record[key] for record in self.records
+                      if record[key] is not None]
+            summary[key] = float(np.mean(values)) if len(values) else None
+        return summary
@@ -1,6 +1,13 @@
-import json
+import copy
+import os
+import time
+import torch
 import torch.nn as nn
+import anode.distributed as distributed_utils
+from anode.metrics import MetricsWriter
+from anode.models import REGULARIZERS
 from numpy import mean
+from torch.utils.data import DataLoader, DistributedSampler
 
 
 class Trainer():
@@ -9,6 +16,10 @@ class Trainer():
     Parameters
     ----------
     model : one of models.ODENet, conv_models.ConvODENet, discrete_models.ResNet
+        or ensemble.EnsembleODENet
+        For an EnsembleODENet, the loss of every replica is recorded, so
+        losses in histories are lists with one entry per replica (see
+        replica_histories).
 
     optimizer : torch.optim.Optimizer instance
 
@@ -28,14 +39,69 @@ class Trainer():
         If True prints information (loss, nfes etc) during training.
 
     save_dir : None or tuple of string and string
-        If not None, saves losses and nfes (for ode models) to directory
-        specified by the first string with id specified by the second string.
-        This is useful for training models when underflow in the time step or
-        excessively large NFEs may occur.
+        If not None, appends losses and nfes (for ode models) of every record
+        interval and epoch to the file metrics<id>.jsonl in the directory
+        specified by the first string, where id is the second string (read it
+        with anode.metrics.read_metrics). This is useful for training models
+        when underflow in the time step or excessively large NFEs may occur.
+
+    regularization : None or dict
+        If not None, maps regularizers of the dynamics (one of
+        'kinetic_energy' and 'jacobian_frobenius', see
+        anode.models.RegularizedDynamics) to their weight in the loss. They
+        penalize stiff dynamics, which keeps NFEs from growing during training.
+        Only ODE models can be regularized.
+
+    checkpoint_freq : int
+        If positive, saves a checkpoint of the model, optimizer and histories
+        every checkpoint_freq epochs (and before the first epoch). Checkpoints
+        are written atomically to checkpoint<id>_<epoch>.pt in the directory
+        of save_dir, or kept in memory if save_dir is None.
+
+    checkpoint_keep : int
+        Number of most recent checkpoints to keep.
+
+    max_retries : int
+        Number of times training rolls back to the last checkpoint when the
+        ODE solver fails (exceeds the maximum number of steps or underflows),
+        instead of raising the AssertionError. Requires checkpoint_freq > 0.
+
+    retry_tol_factor : float
+        Factor by which the solver tolerances are multiplied at every retry.
+        For example 10. relaxes rtol and atol from 1e-3 to 1e-2.
+
+    retry_lr_factor : float
+        Factor by which the learning rate is multiplied at every retry.
+
+    stopping : None or list of anode.stopping.StoppingPolicy instances
+        Policies checked after every batch and epoch, which stop training
+        early (e.g. when the loss plateaus or NFEs blow up). Once stopped,
+        train returns immediately. The reason for stopping and an estimate of
+        the compute saved are recorded in histories['stop'].
+
+    planned_epochs : None or int
+        Total number of epochs training was planned for, used to estimate the
+        compute saved by stopping early. If None, uses the number of epochs of
+        the call to train which stopped.
+
+    distributed : bool
+        If True, trains with data parallelism over the processes of the
+        initialized default process group (see anode.distributed, e.g. with
+        the gloo backend on CPU). Every process trains a replica of the model
+        on its shard of the data (use a DistributedSampler, which is advanced
+        every epoch), gradients are averaged over processes after every
+        backward pass, and recorded losses and NFEs are averaged over
+        processes. Only the main process (rank 0) prints, writes metrics and
+        saves checkpoints, and stopping policies are evaluated on the main
+        process. Rolling back after solver failures is not supported, as a
+        failure on one process cannot be recovered by the others.
     """
 
     def __init__(self, model, optimizer, device, classification=False,
-                 print_freq=10, record_freq=10, verbose=True, save_dir=None):
+                 print_freq=10, record_freq=10, verbose=True, save_dir=None,
+                 regularization=None, checkpoint_freq=0, checkpoint_keep=2,
+                 max_retries=0, retry_tol_factor=1., retry_lr_factor=1.,
+                 stopping=None, planned_epochs=None, distributed=False):
         self.model = model
         self.optimizer = optimizer
         self.classification = classification
@@ -48,16 +114,72 @@ class Trainer():
         self.record_freq = record_freq
         self.steps = 0
         self.save_dir = save_dir
-        self.verbose = verbose
+        self.distributed = distributed
+        self.is_main_process = not distributed or distributed_utils.is_main_process()
+        self.verbose = verbose and self.is_main_process
+        self._metrics_writer = None
+        self.epochs = 0  # Number of epochs trained
+        self.checkpoint_freq = checkpoint_freq
+        self.checkpoint_keep = checkpoint_keep
+        self.max_retries = max_retries
+        self.retry_tol_factor = retry_tol_factor
+        self.retry_lr_factor = retry_lr_factor
+        self.retries = 0
+        # Paths of (or, without save_dir, in memory) checkpoints, oldest first
+        self.checkpoints = []
+
+        self.stopping = [] if stopping is None else list(stopping)
+        self.planned_epochs = planned_epochs
+        self.stop_reason = None
+        # Compute spent on training, including epochs rolled back, which is
+        # what budgets of stopping policies limit
+        self.total_nfes = 0
+        self.train_time = 0.
+        self.last_batch_nfes = 0
+
+        if max_retries > 0 and checkpoint_freq <= 0:
+            raise ValueError("Retrying after solver failures requires "
+                             "checkpoint_freq > 0")
+        if distributed and max_retries > 0:
+            raise ValueError("Retrying after solver failures is not supported "
+                             "in distributed training")
 
         self.histories = {'loss_history': [], 'nfe_history': [],
                           'bnfe_history': [], 'total_nfe_history': [],
                           'epoch_loss_history': [], 'epoch_nfe_history': [],
-                          'epoch_bnfe_history': [], 'epoch_total_nfe_history': []}
+                          'epoch_bnfe_history': [], 'epoch_total_nfe_history': [],
+                          'epoch_time_history': [], 'epoch_data_time_history': []}
         self.buffer = {'loss': [], 'nfe': [], 'bnfe': [], 'total_nfe': []}
 
         # Only resnets have a number of layers attribute
         self.is_resnet = hasattr(self.model, 'num_layers')
+        # Only ensembles have a number of replicas attribute
+        self.is_ensemble = hasattr(self.model, 'num_replicas')
+
+        # Weights of regularizers added to the loss
+        self.regularization = {}
+        if regularization is not None:
+            for regularizer in regularization:
+                if regularizer not in REGULARIZERS:
+                    raise ValueError("Unknown regularizer {}, use one of {}".format(
+                        regularizer, REGULARIZERS))
+            self.regularization = {regularizer: weight for regularizer, weight
+                                   in regularization.items() if weight > 0}
+        if len(self.regularization):
+            if self.is_resnet or self.is_ensemble:
+                raise ValueError("Only ODE models (not ensembles) can be "
+                                 "regularized")
+            # Make ODEBlock integrate regularizers alongside the state
+            self._get_odeblock().regularizers = tuple(self.regularization)
+            self.histories['regularization_history'] = []
+            self.histories['epoch_regularization_history'] = []
+            self.buffer['regularization'] = []
+
+        if distributed:
+            if self.is_ensemble:
+                raise ValueError("Ensembles cannot be trained distributed")
+            # All replicas start from the weights of the main process
+            distributed_utils.broadcast_module(self.model)
 
     def train(self, data_loader, num_epochs):
         """Trains model on data in data_loader for num_epochs.
@@ -69,12 +191,338 @@ class Trainer():
         num_epochs : int
         """
         avg_loss = None
-        for epoch in range(num_epochs):
-            avg_loss = self._train_epoch(data_loader)
+        if self.stop_reason is not None:
+            return avg_loss
+        if self.checkpoint_freq > 0 and not len(self.checkpoints):
+            self.save_checkpoint()
+        # Epochs rolled back after a solver failure are trained again
+        final_epoch = self.epochs + num_epochs
+        while self.epochs < final_epoch:
+            try:
+                avg_loss = self._train_epoch(data_loader)
+            except AssertionError as e:
+                if not self._is_solver_failure(e) or \
+                        self.retries >= self.max_retries:
+                    raise
+                self.retries += 1
+                if self.verbose:
+                    print("\nSolver failed ({}), rolling back to last "
+                          "checkpoint (retry {}/{})".format(
+                              e.args[0], self.retries, self.max_retries))
+                self.load_checkpoint()
+                self._write_metrics({"type": "rollback", "step": self.steps,
+                                     "epoch": self.epochs})
+                continue
+            self.epochs += 1
+            if self.checkpoint_freq > 0 and self.epochs % self.checkpoint_freq == 0:
+                self.save_checkpoint()
+            if self.stop_reason is None:
+                self.stop_reason = self._check_stopping(end_of_epoch=True)
+            if self.stop_reason is not None:
+                self._record_stop(final_epoch)
+                break
             # if self.verbose:
             #     print("Epoch {}: {:.3f}".format(epoch + 1, avg_loss))
         return avg_loss
 
+    def evaluate(self, data_loader, batch_size=None, tol=None):
+        """Evaluates model on data in data_loader without tracking gradients
+        and returns a dict with the following entries:
+
+        loss : mean loss over all points (a list with the loss of every
+            replica for ensembles).
+        accuracy : fraction of points classified correctly (a list for
+            ensembles), None unless classification is True.
+        nfe, max_nfe : mean and maximum number of function evaluations of a
+            batch, None for ResNets.
+        num_points : number of points evaluated.
+        time : wall time of the evaluation in seconds.
+
+        As no graph is stored for a backward pass, batches can be much larger
+        than during training. In distributed training, every process evaluates
+        every world_size-th point and results are reduced over processes.
+
+        Parameters
+        ----------
+        data_loader : torch.utils.data.DataLoader or
+            experiments.dataloaders.DeviceDataLoader
+
+        batch_size : None or int
+            If not None, data is evaluated in (unshuffled) batches of this
+            size instead of the batches of data_loader.
+
+        tol : None or float
+            If not None, solver tolerances (rtol and atol) used during
+            evaluation, e.g. looser tolerances than during training to reduce
+            the NFEs of evaluation.
+        """
+        if self.distributed:
+            data_loader = self._shard(data_loader, batch_size)
+        elif batch_size is not None:
+            data_loader = self._rebatch(data_loader, batch_size)
+        odeblock = None if self.is_resnet else self._get_odeblock()
+        if tol is not None:
+            tolerances = (odeblock.solver.rtol, odeblock.solver.atol)
+            odeblock.solver.rtol = tol
+            odeblock.solver.atol = tol
+        was_training = self.model.training
+        self.model.eval()
+
+        start = time.time()
+        # Losses and number of correct predictions are accumulated on device
+        total_loss = 0.
+        total_correct = 0
+        num_points = 0
+        nfes = []
+        failure = None
+        try:
+            with torch.inference_mode():
+                for x_batch, y_batch in data_loader:
+                    x_batch = x_batch.to(self.device)
+                    y_batch = y_batch.to(self.device)
+                    try:
+                        y_pred = self.model(x_batch)
+                    except AssertionError as e:
+                        if not self.distributed or not self._is_solver_failure(e):
+                            raise
+                        # Raised once the other processes know about it
+                        failure = e
+                        break
+                    if not self.is_resnet:
+                        nfes.append(self._get_and_reset_nfes())
+                        self._flush_telemetry()
+                    # Losses are means over the batch, so weight them by the
+                    # size of the batch
+                    total_loss += self._loss(y_pred, y_batch) * len(y_batch)
+                    if self.classification:
+                        total_correct += (y_pred.argmax(-1) == y_batch).sum(-1)
+                    num_points += len(y_batch)
+        finally:
+            self.model.train(was_training)
+            if tol is not None:
+                odeblock.solver.rtol, odeblock.solver.atol = tolerances
+
+        max_nfe = max(nfes) if len(nfes) else None
+        if self.distributed:
+            totals = distributed_utils.all_reduce_sum(
+                [float(total_loss), float(total_correct), num_points,
+                 float(sum(nfes)), len(nfes)] + self._failure_flags(failure))
+            self._raise_failure(failure, totals[5:])
+            total_loss, total_correct, num_points, nfe_sum, num_batches = totals[:5]
+            num_points = int(num_points)
+            nfes = [nfe_sum / num_batches] if not self.is_resnet and num_batches else []
+            if not self.is_resnet:
+                max_nfe = int(distributed_utils.all_reduce_max([max_nfe or 0])[0])
+
+        return {
+            "loss": self._to_host(total_loss / num_points),
+            "accuracy": self._to_host(total_correct / num_points) if self.classification else None,
+            "nfe": float(mean(nfes)) if len(nfes) else None,
+            "max_nfe": max_nfe,
+            "num_points": num_points,
+            "time": time.time() - start
+        }
+
+    @staticmethod
+    def _rebatch(data_loader, batch_size):
+        """Returns unshuffled loader of the data of data_loader with batches
+        of size batch_size."""
+        if isinstance(data_loader, DataLoader):
+            return DataLoader(data_loader.dataset, batch_size=batch_size,
+                              num_workers=data_loader.num_workers,
+                              pin_memory=data_loader.pin_memory,
+                              collate_fn=data_loader.collate_fn)
+        # Loaders which keep data on device, such as
+        # experiments.dataloaders.DeviceDataLoader
+        data_loader = copy.copy(data_loader)
+        data_loader.batch_size = batch_size
+        data_loader.shuffle = False
+        return data_loader
+
+    @staticmethod
+    def _shard(data_loader, batch_size=None):
+        """Returns unshuffled loader of every world_size-th point of the data
+        of data_loader, starting at the rank of this process, with batches of
+        size batch_size (or of the batch size of data_loader)."""
+        rank = distributed_utils.get_rank()
+        world_size = distributed_utils.get_world_size()
+        if batch_size is None:
+            batch_size = data_loader.batch_size
+        if isinstance(data_loader, DataLoader):
+            return DataLoader(data_loader.dataset, batch_size=batch_size,
+                              sampler=range(rank, len(data_loader.dataset), world_size),
+                              num_workers=data_loader.num_workers,
+                              pin_memory=data_loader.pin_memory,
+                              collate_fn=data_loader.collate_fn)
+        if not hasattr(data_loader, 'sampler'):
+            raise ValueError("{} cannot be sharded for distributed "
+                             "evaluation".format(type(data_loader).__name__))
+        # Loaders which take a sampler, such as
+        # experiments.dataloaders.TensorImageLoader
+        data_loader = copy.copy(data_loader)
+        data_loader.batch_size = batch_size
+        data_loader.shuffle = False
+        data_loader.sampler = range(rank, data_loader.num_images, world_size)
+        return data_loader
+
+    def save_checkpoint(self):
+        """Saves a checkpoint of model, optimizer, solver tolerances and
+        histories, and deletes checkpoints exceeding checkpoint_keep."""
+        if not self.is_main_process:
+            # Replicas of all processes have the same weights
+            return
+        checkpoint = {
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "histories": self.histories,
+            "steps": self.steps,
+            "epochs": self.epochs,
+            # Learning rate and tolerances saved already include the factors
+            # of these retries
+            "retries": self.retries
+        }
+        if not self.is_resnet:
+            solver = self._get_odeblock().solver
+            checkpoint["solver_tolerances"] = (solver.rtol, solver.atol)
+
+        if self.save_dir is None:
+            self.checkpoints.append(copy.deepcopy(checkpoint))
+        else:
+            dir, id = self.save_dir
+            path = '{}/checkpoint{}_{}.pt'.format(dir, id, self.epochs)
+            # Write to temporary file and rename, so that a crash while saving
+            # never leaves a corrupted checkpoint
+            torch.save(checkpoint, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            if path in self.checkpoints:
+                self.checkpoints.remove(path)
+            self.checkpoints.append(path)
+
+        while len(self.checkpoints) > max(self.checkpoint_keep, 1):
+            oldest = self.checkpoints.pop(0)
+            if self.save_dir is not None:
+                os.remove(oldest)
+
+    def load_checkpoint(self):
+        """Restores model, optimizer and histories from the last checkpoint.
+        Solver tolerances and learning rate are then those without retries
+        multiplied by retry_tol_factor ** retries and retry_lr_factor **
+        retries, where retries is the number of retries so far."""
+        if self.save_dir is None:
+            checkpoint = copy.deepcopy(self.checkpoints[-1])
+        else:
+            checkpoint = torch.load(self.checkpoints[-1],
+                                    map_location=self.device)
+        self.model.load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        self.histories = checkpoint["histories"]
+        self.steps = checkpoint["steps"]
+        self.epochs = checkpoint["epochs"]
+        for key in self.buffer:
+            self.buffer[key] = []
+
+        # Only apply the factors of retries since the checkpoint was saved
+        new_retries = self.retries - checkpoint.get("retries", 0)
+        for group in self.optimizer.param_groups:
+            group['lr'] *= self.retry_lr_factor ** new_retries
+        if not self.is_resnet:
+            rtol, atol = checkpoint["solver_tolerances"]
+            solver = self._get_odeblock().solver
+            solver.rtol = rtol * self.retry_tol_factor ** new_retries
+            solver.atol = atol * self.retry_tol_factor ** new_retries
+
+    def _all_reduce_gradients(self, failure=None):
+        """Averages gradients over processes in distributed training. If the
+        ODE solver failed on any process (failure is the AssertionError of
+        this process, if any), raises an AssertionError on every process, so
+        that no process waits for the others forever."""
+        flags = self._failure_flags(failure)
+        flags = distributed_utils.all_reduce_gradients(self.model.parameters(),
+                                                       flags)
+        self._raise_failure(failure, flags)
+
+    @staticmethod
+    def _failure_flags(failure):
+        """Returns flags of a solver failure, [max_num_steps, underflow]."""
+        if failure is None:
+            return [0., 0.]
+        if failure.args[0].startswith("max_num_steps"):
+            return [1., 0.]
+        return [0., 1.]
+
+    @staticmethod
+    def _raise_failure(failure, flags):
+        """Raises failure, or an AssertionError if flags (summed over
+        processes) show that the solver failed on another process."""
+        if failure is not None:
+            raise failure
+        # Messages start as those of torchdiffeq, so they are recognized as
+        # solver failures
+        if flags[0] > 0:
+            raise AssertionError("max_num_steps exceeded on another process")
+        if flags[1] > 0:
+            raise AssertionError("underflow in dt on another process")
+
+    def _check_stopping(self, end_of_epoch):
+        """Returns reason of first stopping policy which stops training, or
+        None. In distributed training, the decision of the main process is
+        used by all processes."""
+        if not len(self.stopping):
+            return None
+        reason = None
+        if self.is_main_process:
+            for policy in self.stopping:
+                reason = policy.check(self, end_of_epoch)
+                if reason is not None:
+                    break
+        if self.distributed:
+            reason = distributed_utils.broadcast_object(reason)
+        return reason
+
+    def _reduce_record(self, record):
+        """Returns record with numerical entries averaged over processes in
+        distributed training."""
+        if not self.distributed:
+            return record
+        keys = [key for key, value in record.items()
+                if key not in ('type', 'step', 'epoch') and
+                isinstance(value, (int, float))]
+        values = distributed_utils.all_reduce_mean([record[key] for key in keys])
+        record = dict(record)
+        record.update(zip(keys, values))
+        return record
+
+    def _record_stop(self, final_epoch):
+        """Records reason for stopping and estimates of the epochs, time and
+        NFEs saved compared to training for the planned number of epochs."""
+        planned_epochs = self.planned_epochs
+        if planned_epochs is None:
+            planned_epochs = final_epoch
+        epochs_saved = max(planned_epochs - self.epochs, 0)
+        epoch_times = self.histories['epoch_time_history']
+        stop = {
+            "reason": self.stop_reason,
+            "epoch": self.epochs,
+            "planned_epochs": planned_epochs,
+            "epochs_saved": epochs_saved,
+            "estimated_time_saved": epochs_saved * float(mean(epoch_times)) if len(epoch_times) else 0.,
+            "estimated_nfes_saved": epochs_saved * self.total_nfes / max(self.epochs, 1)
+        }
+        self.histories['stop'] = stop
+        record = {"type": "stop"}
+        record.update(stop)
+        self._write_metrics(record)
+        if self.verbose:
+            print("\nStopping early: {}".format(self.stop_reason))
+
+    @staticmethod
+    def _is_solver_failure(error):
+        """Returns True if error was raised by ODE solver exceeding the maximum
+        number of steps or underflowing."""
+        message = error.args[0] if len(error.args) else ''
+        return isinstance(message, str) and \
+            (message.startswith("max_num_steps") or message.startswith("underflow"))
+
     def _train_epoch(self, data_loader):
         """Trains model for an epoch.
 
@@ -82,42 +530,79 @@ class Trainer():
         ----------
         data_loader : torch.utils.data.DataLoader
         """
+        # Losses are accumulated on device and only copied to host once per
+        # record interval and epoch
         epoch_loss = 0.
+        epoch_regularization = 0.
         epoch_nfes = 0
         epoch_backward_nfes = 0
+        # Time spent fetching batches and moving them to device (which is
+        # negligible for experiments.dataloaders.DeviceDataLoader)
+        epoch_data_time = 0.
+        sampler = getattr(data_loader, 'sampler', None)
+        if isinstance(sampler, DistributedSampler):
+            # Shuffle shards of the processes differently every epoch
+            sampler.set_epoch(self.epochs)
+        epoch_start = time.time()
+        train_time = self.train_time
+        data_start = epoch_start
+        num_batches = 0
         for i, (x_batch, y_batch) in enumerate(data_loader):
             self.optimizer.zero_grad()
 
             x_batch = x_batch.to(self.device)
             y_batch = y_batch.to(self.device)
+            epoch_data_time += time.time() - data_start
 
-            y_pred = self.model(x_batch)
-
-            # ResNets do not have an NFE attribute
-            if not self.is_resnet:
-                iteration_nfes = self._get_and_reset_nfes()
-                epoch_nfes += iteration_nfes
+            failure = None
+            try:
+                y_pred = self.model(x_batch)
 
-            loss = self.loss_func(y_pred, y_batch)
-            loss.backward()
+                # ResNets do not have an NFE attribute
+                if not self.is_resnet:
+                    iteration_nfes = self._get_and_reset_nfes()
+                    epoch_nfes += iteration_nfes
+
+                loss = self._loss(y_pred, y_batch)
+                if len(self.regularization):
+                    regularization = self._regularization_loss()
+                    (loss + regularization).backward()
+                else:
+                    # Replicas of an ensemble have independent weights, so the
+                    # gradient of the sum is the gradient of each replica
+                    loss.sum().backward()
+            except AssertionError as e:
+                if not self.distributed or not self._is_solver_failure(e):
+                    raise
+                # The other processes wait for the gradients of this one, so
+                # only raise once they know about the failure
+                failure = e
+            if self.distributed:
+                self._all_reduce_gradients(failure)
+            if len(self.regularization):
+                epoch_regularization += regularization.detach()
+                self.buffer['regularization'].append(regularization.detach())
             self.optimizer.step()
-            epoch_loss += loss.item()
+            epoch_loss += loss.detach()
 
             if not self.is_resnet:
                 iteration_backward_nfes = self._get_and_reset_nfes()
                 epoch_backward_nfes += iteration_backward_nfes
+                self._flush_telemetry()
 
             if i % self.print_freq == 0:
                 if self.verbose:
                     print("\nIteration {}/{}".format(i, len(data_loader)))
-                    print("Loss: {:.3f}".format(loss.item()))
+                    print("Loss: {:.3f}".format(loss.mean().item()))
+                    if len(self.regularization):
+                        print("Regularization: {:.3f}".format(regularization.item()))
                     if not self.is_resnet:
                         print("NFE: {}".format(iteration_nfes))
                         print("BNFE: {}".format(iteration_backward_nfes))
                         print("Total NFE: {}".format(iteration_nfes + iteration_backward_nfes))
 
             # Record information in buffer at every iteration
-            self.buffer['loss'].append(loss.item())
+            self.buffer['loss'].append(loss.detach())
             if not self.is_resnet:
                 self.buffer['nfe'].append(iteration_nfes)
                 self.buffer['bnfe'].append(iteration_backward_nfes)
@@ -126,42 +611,145 @@ class Trainer():
             # At every record_freq iteration, record mean loss, nfes, bnfes and
             # so on and clear buffer
             if self.steps % self.record_freq == 0:
-                self.histories['loss_history'].append(mean(self.buffer['loss']))
-
-                if not self.is_resnet:
-                    self.histories['nfe_history'].append(mean(self.buffer['nfe']))
-                    self.histories['bnfe_history'].append(mean(self.buffer['bnfe']))
-                    self.histories['total_nfe_history'].append(mean(self.buffer['total_nfe']))
-
-                # Clear buffer
-                self.buffer['loss'] = []
-                self.buffer['nfe'] = []
-                self.buffer['bnfe'] = []
-                self.buffer['total_nfe'] = []
-
-                # Save information in directory
-                if self.save_dir is not None:
-                    dir, id = self.save_dir
-                    with open('{}/losses{}.json'.format(dir, id), 'w') as f:
-                        json.dump(self.histories['loss_history'], f)
-                    if not self.is_resnet:
-                        with open('{}/nfes{}.json'.format(dir, id), 'w') as f:
-                            json.dump(self.histories['nfe_history'], f)
-                        with open('{}/bnfes{}.json'.format(dir, id), 'w') as f:
-                            json.dump(self.histories['bnfe_history'], f)
-                        with open('{}/total_nfes{}.json'.format(dir, id), 'w') as f:
-                            json.dump(self.histories['total_nfe_history'], f)
+                record = {"type": "step", "step": self.steps}
+                for key in self.buffer:
+                    if len(self.buffer[key]):
+                        record[key] = self.buffer_mean(key)
+                    # Clear buffer
+                    self.buffer[key] = []
+                record = self._reduce_record(record)
+                for key, value in record.items():
+                    if key not in ('type', 'step'):
+                        self.histories[key + '_history'].append(value)
+                self._write_metrics(record)
 
             self.steps += 1
+            num_batches += 1
+            if not self.is_resnet:
+                self.last_batch_nfes = iteration_nfes + iteration_backward_nfes
+                self.total_nfes += self.last_batch_nfes
+            self.train_time = train_time + time.time() - epoch_start
+            # Stop in the middle of the epoch, e.g. as soon as the NFE budget
+            # is exhausted
+            self.stop_reason = self._check_stopping(end_of_epoch=False)
+            if self.stop_reason is not None:
+                break
+            data_start = time.time()
+
+        epoch_time = time.time() - epoch_start
+        if self.verbose:
+            print("\nEpoch time: {:.2f}s (data {:.2f}s, training {:.2f}s)".format(
+                epoch_time, epoch_data_time, epoch_time - epoch_data_time))
 
         # Record epoch mean information
-        self.histories['epoch_loss_history'].append(epoch_loss / len(data_loader))
+        record = {"type": "epoch",
+                  "epoch": self.epochs,
+                  "epoch_loss": self._to_host(epoch_loss / num_batches),
+                  "epoch_time": epoch_time,
+                  "epoch_data_time": epoch_data_time}
         if not self.is_resnet:
-            self.histories['epoch_nfe_history'].append(float(epoch_nfes) / len(data_loader))
-            self.histories['epoch_bnfe_history'].append(float(epoch_backward_nfes) / len(data_loader))
-            self.histories['epoch_total_nfe_history'].append(float(epoch_backward_nfes + epoch_nfes) / len(data_loader))
+            record["epoch_nfe"] = float(epoch_nfes) / num_batches
+            record["epoch_bnfe"] = float(epoch_backward_nfes) / num_batches
+            record["epoch_total_nfe"] = float(epoch_backward_nfes + epoch_nfes) / num_batches
+        if len(self.regularization):
+            record["epoch_regularization"] = float(epoch_regularization) / num_batches
+        record = self._reduce_record(record)
+        for key, value in record.items():
+            if key.startswith('epoch_'):
+                self.histories[key + '_history'].append(value)
+        self._write_metrics(record)
+        if self._metrics_writer is not None:
+            # Make sure metrics are on disk at the end of every epoch
+            self._metrics_writer.flush()
+
+        return record["epoch_loss"]
+
+    def buffer_mean(self, key):
+        """Returns mean of values of key (e.g. 'loss' or 'nfe') recorded since
+        the last record interval, or None if there are none.
 
-        return epoch_loss / len(data_loader)
+        Parameters
+        ----------
+        key : string
+        """
+        values = self.buffer[key]
+        if not len(values):
+            return None
+        if torch.is_tensor(values[0]):
+            # Single device to host copy for the whole interval
+            return self._to_host(torch.stack(values).float().mean(0))
+        return float(mean(values))
+
+    def replica_histories(self, index):
+        """Returns histories of a replica of an ensemble.EnsembleODENet, in
+        the same format as the histories of a single model.
+
+        Parameters
+        ----------
+        index : int
+            Index of replica.
+        """
+        return {key: [value[index] if isinstance(value, list) else value
+                      for value in history]
+                if isinstance(history, list) else history
+                for key, history in self.histories.items()}
+
+    def _loss(self, y_pred, y_batch):
+        """Returns loss, or losses of every replica if model is an ensemble.
+
+        Parameters
+        ----------
+        y_pred : torch.Tensor
+            Predictions, of shape (num_replicas,) + y_batch.shape for
+            ensembles.
+
+        y_batch : torch.Tensor
+        """
+        if self.is_ensemble:
+            return torch.stack([self.loss_func(y_pred_replica, y_batch)
+                                for y_pred_replica in y_pred])
+        return self.loss_func(y_pred, y_batch)
+
+    @staticmethod
+    def _to_host(value):
+        """Copies a (per replica) tensor to a float (or list of floats)."""
+        if torch.is_tensor(value):
+            return value.tolist()
+        return float(value)
+
+    def close(self):
+        """Writes remaining metrics and stops the metrics writer thread."""
+        if self._metrics_writer is not None:
+            self._metrics_writer.close()
+            self._metrics_writer = None
+
+    def _write_metrics(self, record):
+        """Appends record to the metrics file of save_dir, if any."""
+        if self.save_dir is None or not self.is_main_process:
+            return
+        if self._metrics_writer is None:
+            dir, id = self.save_dir
+            self._metrics_writer = MetricsWriter('{}/metrics{}.jsonl'.format(dir, id))
+        self._metrics_writer.write(record)
+
+    def _get_odeblock(self):
+        """Returns ODEBlock of model."""
+        if hasattr(self.model, 'odeblock'):  # If we are using ODENet
+            return self.model.odeblock
+        return self.model  # If we are using ODEBlock
+
+    def _regularization_loss(self):
+        """Returns weighted sum of the regularizers of the last forward pass."""
+        regularization = self._get_odeblock().regularization
+        return sum(weight * regularization[regularizer]
+                   for regularizer, weight in self.regularization.items())
+
+    def _flush_telemetry(self):
+        """Completes the solver telemetry record of the iteration, if
+        telemetry is attached to the model."""
+        telemetry = self._get_odeblock().telemetry
+        if telemetry is not None:
+            telemetry.flush()
 
     def _get_and_reset_nfes(self):
         """Returns and resets the number of function evaluations for model."""
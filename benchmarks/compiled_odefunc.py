@@ -0,0 +1,108 @@
+"""Benchmarks number of function evaluations per second of the eager and
+compiled ODEFunc on the toy datasets of a config file.
+
+Usage:
+
+    python -m benchmarks.compiled_odefunc config.json
+"""
+import json
+import sys
+import time
+import torch
+from anode.models import ODENet
+from experiments.experiments import dataset_from_config
+from torch.utils.data import DataLoader
+
+
+def nfes_per_second(model, data_loader, num_batches, device):
+    """Returns number of function evaluations (forward and backward) per second
+    when training model on num_batches batches of data_loader.
+
+    Parameters
+    ----------
+    model : anode.models.ODENet instance
+
+    data_loader : torch.utils.data.DataLoader
+
+    num_batches : int
+
+    device : torch.device
+    """
+    loss_func = torch.nn.SmoothL1Loss()
+    total_nfes = 0
+    elapsed = 0.
+    batch = 0
+    while batch < num_batches:
+        for x_batch, y_batch in data_loader:
+            if batch == num_batches:
+                break
+            x_batch = x_batch.to(device)
+            y_batch = y_batch.to(device)
+            model.odefunc.nfe = 0
+            start = time.time()
+            loss = loss_func(model(x_batch), y_batch)
+            loss.backward()
+            elapsed += time.time() - start
+            total_nfes += model.odefunc.nfe
+            model.zero_grad()
+            batch += 1
+    return total_nfes / elapsed
+
+
+def run_benchmark(device, path_to_config, num_batches=50, num_warmup=5):
+    """Prints NFE/s of eager and compiled ODENets for every dataset and ODE
+    model configuration in a config file.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    path_to_config : string
+
+    num_batches : int
+        Number of batches on which to time each model.
+
+    num_warmup : int
+        Number of batches run before timing (includes compilation time).
+    """
+    with open(path_to_config) as config_file:
+        config = json.load(config_file)
+    data_dim = config["data_dim"]
+
+    for dataset in config["datasets"]:
+        data_object = dataset_from_config(data_dim, dataset)
+        data_loader = DataLoader(data_object,
+                                 batch_size=config["training_config"]["batch_size"],
+                                 shuffle=True)
+        for model_config in config["model_configs"]:
+            if model_config["type"] not in ("odenet", "anode"):
+                continue
+            augment_dim = model_config.get("augment_dim", 0) \
+                if model_config["type"] == "anode" else 0
+
+            results = {}
+            state_dict = None
+            for compiled in (False, True):
+                model = ODENet(device, data_dim, model_config["hidden_dim"],
+                               augment_dim=augment_dim,
+                               time_dependent=model_config["time_dependent"],
+                               compiled=compiled).to(device)
+                # Use the same weights for both models
+                if state_dict is None:
+                    state_dict = model.state_dict()
+                else:
+                    model.load_state_dict(state_dict)
+                nfes_per_second(model, data_loader, num_warmup, device)
+                results[compiled] = nfes_per_second(model, data_loader,
+                                                    num_batches, device)
+
+            print("{} / {}: eager {:.0f} NFE/s, compiled {:.0f} NFE/s ({:.2f}x)".format(
+                dataset["type"], model_config["type"], results[False],
+                results[True], results[True] / results[False]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.compiled_odefunc <path_to_config>"))
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    run_benchmark(device, sys.argv[1])
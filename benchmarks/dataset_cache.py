@@ -0,0 +1,55 @@
+"""Benchmarks generating a ConcentricSphere dataset against loading it from
+experiments.dataset_cache.DatasetCache, and checks that the loaded dataset is
+identical.
+
+Usage:
+
+    python -m benchmarks.dataset_cache [num_points]
+"""
+import sys
+import tempfile
+import time
+import torch
+from experiments.dataloaders import ConcentricSphere
+from experiments.dataset_cache import DatasetCache
+
+
+def run_benchmark(num_points=1000000, dim=2, seed=0):
+    """Prints time of generating (and storing) a dataset, of loading it from
+    the cache and of a first pass over the loaded data.
+
+    Parameters
+    ----------
+    num_points : int
+
+    dim : int
+
+    seed : int
+    """
+    params = {"dim": dim, "inner_range": (0., .5), "outer_range": (1., 1.5),
+              "num_points_inner": num_points // 2,
+              "num_points_outer": num_points // 2}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DatasetCache(cache_dir)
+
+        start = time.time()
+        generated = cache.get(ConcentricSphere, seed, **params)
+        miss_time = time.time() - start
+
+        start = time.time()
+        loaded = cache.get(ConcentricSphere, seed, **params)
+        hit_time = time.time() - start
+
+        start = time.time()
+        identical = torch.equal(generated.data, loaded.data) and \
+            torch.equal(generated.targets, loaded.targets)
+        read_time = time.time() - start
+
+        print("{} points ({:.1f}MB): generate and store {:.3f}s, load {:.4f}s "
+              "({:.0f}x), first read {:.3f}s, identical {}".format(
+                  num_points, cache.size() / 2 ** 20, miss_time, hit_time,
+                  miss_time / hit_time, read_time, identical))
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,117 @@
+"""Benchmarks strong scaling of distributed data parallel training of a
+ConvODENet on CPU with the gloo backend (see anode.training.Trainer), by
+training on the same synthetic images with a fixed global batch size on 1, 2
+and 4 processes.
+
+A fixed grid solver is used, so every step costs the same number of function
+evaluations and the timings only reflect the parallelism.
+
+Usage:
+
+    python -m benchmarks.distributed_scaling [dataset] [num_processes ...]
+
+where dataset is one of mnist, cifar10 or imagenet (default cifar10).
+"""
+import os
+import sys
+import time
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from anode.conv_models import ConvODENet
+from anode.training import Trainer
+from torch.utils.data import DataLoader, DistributedSampler, TensorDataset
+
+IMG_SIZES = {"mnist": (1, 28, 28), "cifar10": (3, 32, 32),
+             "imagenet": (3, 64, 64)}
+OUTPUT_DIMS = {"mnist": 10, "cifar10": 10, "imagenet": 200}
+
+
+def train_process(rank, world_size, dataset, num_points, batch_size,
+                  num_epochs, port, results):
+    """Trains on rank of world_size processes and puts the mean epoch time of
+    the main process in results."""
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    # Same data and initialization on every process and for every world size
+    generator = torch.Generator().manual_seed(0)
+    img_size = IMG_SIZES[dataset]
+    inputs = torch.rand((num_points,) + img_size, generator=generator)
+    targets = torch.randint(OUTPUT_DIMS[dataset], (num_points,),
+                            generator=generator)
+    data = TensorDataset(inputs, targets)
+    data_loader = DataLoader(data, batch_size=batch_size // world_size,
+                             sampler=DistributedSampler(data))
+
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+    model = ConvODENet(device, img_size, num_filters=32,
+                       output_dim=OUTPUT_DIMS[dataset], augment_dim=1,
+                       adjoint=False,
+                       solver={"method": "rk4", "num_steps": 4})
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    trainer = Trainer(model, optimizer, device, classification=True,
+                      verbose=False, distributed=True)
+
+    # First epoch includes warm up (e.g. allocations), so is not timed
+    trainer.train(data_loader, 1)
+    dist.barrier()
+    start = time.time()
+    trainer.train(data_loader, num_epochs)
+    dist.barrier()
+    if rank == 0:
+        results.put(((time.time() - start) / num_epochs,
+                     trainer.histories['epoch_loss_history'][-1]))
+    dist.destroy_process_group()
+
+
+def run_benchmark(dataset='cifar10', world_sizes=(1, 2, 4), num_points=2048,
+                  batch_size=128, num_epochs=2, port=29511):
+    """Prints epoch time, speedup and parallel efficiency for every number of
+    processes.
+
+    Parameters
+    ----------
+    dataset : string
+        One of 'mnist', 'cifar10' or 'imagenet', sets the image size.
+
+    world_sizes : tuple of ints
+        Numbers of processes to benchmark.
+
+    num_points : int
+        Number of synthetic images.
+
+    batch_size : int
+        Global batch size, split between processes.
+
+    num_epochs : int
+        Number of timed epochs.
+
+    port : int
+        Port of the process group rendezvous.
+    """
+    context = mp.get_context('spawn')
+    epoch_times = {}
+    for world_size in world_sizes:
+        results = context.SimpleQueue()
+        mp.spawn(train_process, nprocs=world_size,
+                 args=(world_size, dataset, num_points, batch_size, num_epochs,
+                       port, results))
+        epoch_times[world_size], final_loss = results.get()
+        print("{} process(es): {:.2f}s per epoch, final epoch loss {:.4f}".format(
+            world_size, epoch_times[world_size], final_loss))
+
+    baseline = epoch_times[world_sizes[0]] * world_sizes[0]
+    for world_size in world_sizes:
+        speedup = baseline / epoch_times[world_size]
+        print("{} process(es): {:.2f}x speedup, {:.0f}% efficiency".format(
+            world_size, speedup, 100 * speedup / world_size))
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else 'cifar10'
+    world_sizes = tuple(int(arg) for arg in sys.argv[2:]) or (1, 2, 4)
+    run_benchmark(dataset, world_sizes)
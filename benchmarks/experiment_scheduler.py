@@ -0,0 +1,65 @@
+"""Benchmarks wall-clock time of running the experiments of a config file with
+the sequential loop of experiments.experiments.run_experiments and with the
+process pool of experiments.scheduler.run_experiments_parallel, and checks
+that both give the same final losses.
+
+Usage:
+
+    python -m benchmarks.experiment_scheduler config.json [num_workers]
+"""
+import json
+import sys
+import time
+import torch
+from experiments.experiments import run_experiments
+from experiments.scheduler import run_experiments_parallel
+
+
+def final_losses(results):
+    """Returns final epoch loss of every rep of every model and dataset."""
+    return [history[-1] for dataset_results in results
+            for model_info in dataset_results["model_info"]
+            for history in model_info["epoch_loss_history"]]
+
+
+def run_benchmark(path_to_config, num_workers=None, seed=0):
+    """Prints wall-clock time of sequential and parallel experiments.
+
+    Parameters
+    ----------
+    path_to_config : string
+
+    num_workers : None or int
+        Number of worker processes. If None, uses the number of CPUs.
+
+    seed : int
+    """
+    with open(path_to_config) as config_file:
+        config = json.load(config_file)
+    kwargs = {"data_dim": config["data_dim"],
+              "viz_batch_size": config["viz_batch_size"],
+              "num_reps": config["num_reps"],
+              "datasets": config["datasets"],
+              "model_configs": config["model_configs"],
+              "training_config": config["training_config"],
+              "seed": seed}
+
+    start = time.time()
+    sequential_results = run_experiments(torch.device('cpu'), **kwargs)
+    sequential_time = time.time() - start
+
+    start = time.time()
+    parallel_results = run_experiments_parallel(num_workers=num_workers, **kwargs)
+    parallel_time = time.time() - start
+
+    max_diff = max(abs(a - b) for a, b in zip(final_losses(sequential_results),
+                                              final_losses(parallel_results)))
+    print("Sequential {:.1f}s, parallel {:.1f}s ({:.2f}x), max final loss "
+          "difference {:.1e}".format(sequential_time, parallel_time,
+                                     sequential_time / parallel_time, max_diff))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.experiment_scheduler <path_to_config> [<num_workers>]"))
+    run_benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else None)
@@ -0,0 +1,112 @@
+"""Benchmarks throughput and memory of ConvODEFuncs with fused and
+concatenated time channels (see anode.conv_models.Conv2dTime) on the image
+sizes of MNIST, CIFAR10 and TinyImageNet, for the ODE model configurations of
+a config file.
+
+Usage:
+
+    python -m benchmarks.fused_conv_time config_img.json
+"""
+import json
+import sys
+import time
+import torch
+from anode.conv_models import ConvODEFunc
+
+IMG_SIZES = {"mnist": (1, 28, 28), "cifar10": (3, 32, 32),
+             "imagenet": (3, 64, 64)}
+
+
+def time_odefunc(odefunc, x, num_evals, device):
+    """Returns function evaluations (forward and backward) per second and peak
+    memory allocated in bytes (None on CPU) when evaluating odefunc on x.
+
+    Parameters
+    ----------
+    odefunc : anode.conv_models.ConvODEFunc instance
+
+    x : torch.Tensor
+
+    num_evals : int
+
+    device : torch.device
+    """
+    t = torch.tensor(0.5, device=device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.time()
+    for _ in range(num_evals):
+        odefunc(t, x).sum().backward()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        peak_memory = torch.cuda.max_memory_allocated(device)
+    else:
+        peak_memory = None
+    odefunc.zero_grad()
+    return num_evals / (time.time() - start), peak_memory
+
+
+def run_benchmark(device, path_to_config, num_evals=50, num_warmup=5):
+    """Prints throughput, peak memory and largest output difference of fused
+    and concatenated time channels for every image size and ODE model
+    configuration in a config file.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    path_to_config : string
+
+    num_evals : int
+        Number of function evaluations on which to time each model.
+
+    num_warmup : int
+        Number of function evaluations run before timing.
+    """
+    with open(path_to_config) as config_file:
+        config = json.load(config_file)
+    batch_size = config["training_config"]["batch_size"]
+
+    for dataset, img_size in IMG_SIZES.items():
+        for model_config in config["model_configs"]:
+            if model_config["type"] not in ("odenet", "anode"):
+                continue
+            augment_dim = model_config["augment_dim"] \
+                if model_config["type"] == "anode" else 0
+            odefuncs = {fused: ConvODEFunc(device, img_size, model_config["num_filters"],
+                                           augment_dim, time_dependent=True,
+                                           non_linearity=model_config["non_linearity"],
+                                           fused=fused).to(device)
+                        for fused in (False, True)}
+            # Same weights for both
+            odefuncs[True].load_state_dict(odefuncs[False].state_dict())
+            x = torch.randn(batch_size, img_size[0] + augment_dim,
+                            img_size[1], img_size[2], device=device)
+            t = torch.tensor(0.5, device=device)
+
+            results = {}
+            outputs = {}
+            for fused, odefunc in odefuncs.items():
+                with torch.no_grad():
+                    outputs[fused] = odefunc(t, x)
+                time_odefunc(odefunc, x, num_warmup, device)
+                results[fused] = time_odefunc(odefunc, x, num_evals, device)
+
+            max_diff = (outputs[True] - outputs[False]).abs().max().item()
+            line = "{} / {}: concat {:.1f} NFE/s, fused {:.1f} NFE/s ({:.2f}x), " \
+                   "max output difference {:.1e}".format(
+                       dataset, model_config["type"], results[False][0],
+                       results[True][0], results[True][0] / results[False][0],
+                       max_diff)
+            if device.type == 'cuda':
+                line += ", peak memory {:.1f}MB vs {:.1f}MB".format(
+                    results[False][1] / 2 ** 20, results[True][1] / 2 ** 20)
+            print(line)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.fused_conv_time <path_to_config>"))
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    run_benchmark(device, sys.argv[1])
@@ -0,0 +1,78 @@
+"""Benchmarks loading MNIST and CIFAR10 batches through torchvision
+transforms (experiments.dataloaders.mnist and cifar10) against loading them
+from uint8 tensors held in memory (experiments.dataloaders.TensorImageLoader,
+with in_memory=True), and checks that both give the same images and labels.
+
+Usage:
+
+    python -m benchmarks.image_loading [dataset] [size]
+
+where dataset is one of mnist or cifar10 (default mnist) and size is the size
+of the returned images (default the size of the dataset images).
+"""
+import sys
+import time
+import torch
+from experiments.dataloaders import cifar10, mnist, TensorImageLoader
+from torch.utils.data import DataLoader
+
+PATHS_TO_DATA = {"mnist": '../../mnist_data', "cifar10": '../../cifar10_data'}
+IMG_SIZES = {"mnist": 28, "cifar10": 32}
+
+
+def samples_per_second(data_loader, num_epochs=1):
+    """Returns samples per second of iterating num_epochs times over
+    data_loader."""
+    num_samples = 0
+    start = time.time()
+    for _ in range(num_epochs):
+        for images, _ in data_loader:
+            num_samples += len(images)
+    return num_samples / (time.time() - start)
+
+
+def run_benchmark(dataset='mnist', size=None, batch_size=256):
+    """Prints samples per second of both loaders over the training set and
+    the maximum difference between their batches.
+
+    Parameters
+    ----------
+    dataset : string
+        One of 'mnist' or 'cifar10'.
+
+    size : None or int
+        Size of returned images. If None, uses the size of dataset images.
+
+    batch_size : int
+    """
+    loaders = {"mnist": mnist, "cifar10": cifar10}[dataset]
+    size = IMG_SIZES[dataset] if size is None else size
+    path_to_data = PATHS_TO_DATA[dataset]
+    transform_loader, _ = loaders(batch_size, size=size, path_to_data=path_to_data)
+    tensor_loader, _ = loaders(batch_size, size=size, path_to_data=path_to_data,
+                               in_memory=True)
+
+    # Compare batches in dataset order
+    ordered_transform_loader = DataLoader(transform_loader.dataset,
+                                          batch_size=batch_size, shuffle=False)
+    ordered_tensor_loader = TensorImageLoader.from_dataset(transform_loader.dataset,
+                                                           batch_size, size=size)
+    max_diff = 0.
+    for (images, labels), (tensor_images, tensor_labels) in \
+            zip(ordered_transform_loader, ordered_tensor_loader):
+        assert torch.equal(labels, tensor_labels)
+        max_diff = max(max_diff, (images - tensor_images).abs().max().item())
+    print("Max difference between transformed and in memory images: "
+          "{:.1e}".format(max_diff))
+
+    transform_rate = samples_per_second(transform_loader)
+    tensor_rate = samples_per_second(tensor_loader)
+    print("{} ({}x{}): transforms {:.0f} samples/s, in memory {:.0f} samples/s "
+          "({:.1f}x)".format(dataset, size, size, transform_rate, tensor_rate,
+                             tensor_rate / transform_rate))
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else 'mnist'
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    run_benchmark(dataset, size)
@@ -0,0 +1,126 @@
+"""Benchmarks training step time and memory of augmented ConvODENets with
+explicit augmentation (zero channels concatenated to every batch) and implicit
+augmentation (see anode.models.ODEBlock) on the image dataset of a config
+file.
+
+Usage:
+
+    python -m benchmarks.implicit_augmentation config_img.json
+"""
+import json
+import sys
+import time
+import torch
+from anode.conv_models import ConvODENet
+from experiments.dataloaders import mnist, cifar10
+
+
+def step_time_and_memory(model, data_loader, num_batches, device):
+    """Returns mean time of a training step (forward and backward), mean NFEs
+    per step and peak memory allocated in bytes (None on CPU) when training
+    model on num_batches batches of data_loader.
+
+    Parameters
+    ----------
+    model : anode.conv_models.ConvODENet instance
+
+    data_loader : torch.utils.data.DataLoader
+
+    num_batches : int
+
+    device : torch.device
+    """
+    loss_func = torch.nn.CrossEntropyLoss()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    elapsed = 0.
+    total_nfes = 0
+    batch = 0
+    for x_batch, y_batch in data_loader:
+        if batch == num_batches:
+            break
+        x_batch = x_batch.to(device)
+        y_batch = y_batch.to(device)
+        start = time.time()
+        loss = loss_func(model(x_batch), y_batch)
+        nfes = model.odeblock.odefunc.nfe
+        loss.backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        elapsed += time.time() - start
+        total_nfes += nfes + model.odeblock.odefunc.nfe
+        model.zero_grad()
+        batch += 1
+    peak_memory = torch.cuda.max_memory_allocated(device) \
+        if device.type == 'cuda' else None
+    return elapsed / batch, total_nfes / batch, peak_memory
+
+
+def run_benchmark(device, path_to_config, num_batches=20, num_warmup=2):
+    """Prints step time, NFEs and peak memory of explicit and implicit
+    augmentation for every anode configuration in an image config file.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    path_to_config : string
+
+    num_batches : int
+        Number of batches on which to time each model.
+
+    num_warmup : int
+        Number of batches run before timing.
+    """
+    with open(path_to_config) as config_file:
+        config = json.load(config_file)
+    batch_size = config["training_config"]["batch_size"]
+
+    if config["dataset"] == 'mnist':
+        data_loader, _ = mnist(batch_size)
+        img_size = (1, 28, 28)
+    elif config["dataset"] == 'cifar10':
+        data_loader, _ = cifar10(batch_size)
+        img_size = (3, 32, 32)
+    else:
+        raise ValueError("Benchmark supports mnist and cifar10 datasets")
+
+    for model_config in config["model_configs"]:
+        if model_config["type"] != "anode":
+            continue
+        results = {}
+        state_dict = None
+        for implicit_augment in (False, True):
+            model = ConvODENet(device, img_size, model_config["num_filters"],
+                               output_dim=10,
+                               augment_dim=model_config["augment_dim"],
+                               time_dependent=model_config["time_dependent"],
+                               non_linearity=model_config["non_linearity"],
+                               solver=model_config.get("solver"),
+                               implicit_augment=implicit_augment).to(device)
+            # Use the same weights for both models
+            if state_dict is None:
+                state_dict = model.state_dict()
+            else:
+                model.load_state_dict(state_dict)
+            step_time_and_memory(model, data_loader, num_warmup, device)
+            results[implicit_augment] = step_time_and_memory(
+                model, data_loader, num_batches, device)
+
+        explicit, implicit = results[False], results[True]
+        line = "{} / anode (augment_dim {}): explicit {:.3f}s/step ({:.1f} NFE), " \
+               "implicit {:.3f}s/step ({:.1f} NFE), {:.2f}x".format(
+                   config["dataset"], model_config["augment_dim"], explicit[0],
+                   explicit[1], implicit[0], implicit[1],
+                   explicit[0] / implicit[0])
+        if device.type == 'cuda':
+            line += ", peak memory {:.1f}MB vs {:.1f}MB".format(
+                explicit[2] / 2 ** 20, implicit[2] / 2 ** 20)
+        print(line)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.implicit_augmentation <path_to_config>"))
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    run_benchmark(device, sys.argv[1])
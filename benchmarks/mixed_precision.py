@@ -0,0 +1,134 @@
+"""Benchmarks training throughput and loss curves of ConvODENets with dynamics
+evaluated in full precision and under autocast (bf16 on CPU, fp16 on GPU) on
+the image dataset of a config file.
+
+Usage:
+
+    python -m benchmarks.mixed_precision config_img.json
+"""
+import json
+import sys
+import time
+import torch
+from anode.conv_models import ConvODENet
+from experiments.dataloaders import mnist, cifar10
+
+
+def train_and_time(model, data_loader, num_batches, device, lr):
+    """Trains model on num_batches batches of data_loader and returns images
+    per second, mean NFEs (forward and backward) per batch and loss of every
+    batch.
+
+    Parameters
+    ----------
+    model : anode.conv_models.ConvODENet instance
+
+    data_loader : torch.utils.data.DataLoader
+
+    num_batches : int
+
+    device : torch.device
+
+    lr : float
+        Learning rate of Adam optimizer.
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_func = torch.nn.CrossEntropyLoss()
+    losses = []
+    total_nfes = 0
+    num_images = 0
+    elapsed = 0.
+    for x_batch, y_batch in data_loader:
+        if len(losses) == num_batches:
+            break
+        x_batch = x_batch.to(device)
+        y_batch = y_batch.to(device)
+        start = time.time()
+        optimizer.zero_grad()
+        loss = loss_func(model(x_batch), y_batch)
+        nfes = model.odeblock.odefunc.nfe
+        loss.backward()
+        optimizer.step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        elapsed += time.time() - start
+        total_nfes += nfes + model.odeblock.odefunc.nfe
+        num_images += len(x_batch)
+        losses.append(loss.item())
+    return num_images / elapsed, total_nfes / len(losses), losses
+
+
+def run_benchmark(device, path_to_config, num_batches=50):
+    """Prints throughput and NFEs, and saves loss curves, of every ODE model
+    configuration in an image config file with dynamics in full and reduced
+    precision.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    path_to_config : string
+
+    num_batches : int
+        Number of batches on which to train each model.
+    """
+    with open(path_to_config) as config_file:
+        config = json.load(config_file)
+    batch_size = config["training_config"]["batch_size"]
+
+    if config["dataset"] == 'mnist':
+        data_loader, _ = mnist(batch_size)
+        img_size = (1, 28, 28)
+    elif config["dataset"] == 'cifar10':
+        data_loader, _ = cifar10(batch_size)
+        img_size = (3, 32, 32)
+    else:
+        raise ValueError("Benchmark supports mnist and cifar10 datasets")
+
+    # CPU autocast only supports bfloat16
+    reduced_precision = 'fp16' if device.type == 'cuda' else 'bf16'
+    loss_curves = []
+    for model_config in config["model_configs"]:
+        if model_config["type"] not in ("odenet", "anode"):
+            continue
+        augment_dim = model_config["augment_dim"] \
+            if model_config["type"] == "anode" else 0
+
+        torch.manual_seed(0)
+        state_dict = None
+        results = {}
+        for precision in (None, reduced_precision):
+            model = ConvODENet(device, img_size, model_config["num_filters"],
+                               output_dim=10, augment_dim=augment_dim,
+                               time_dependent=model_config["time_dependent"],
+                               non_linearity=model_config["non_linearity"],
+                               solver=model_config.get("solver"),
+                               precision=precision).to(device)
+            # Start both models from the same weights
+            if state_dict is None:
+                state_dict = model.state_dict()
+            else:
+                model.load_state_dict(state_dict)
+            results[precision] = train_and_time(model, data_loader,
+                                                num_batches, device,
+                                                model_config["lr"])
+            loss_curves.append({"type": model_config["type"],
+                                "precision": precision,
+                                "losses": results[precision][2]})
+
+        full, reduced = results[None], results[reduced_precision]
+        print("{} / {}: fp32 {:.0f} img/s ({:.1f} NFE), {} {:.0f} img/s "
+              "({:.1f} NFE), {:.2f}x, final loss {:.3f} vs {:.3f}".format(
+                  config["dataset"], model_config["type"], full[0], full[1],
+                  reduced_precision, reduced[0], reduced[1],
+                  reduced[0] / full[0], full[2][-1], reduced[2][-1]))
+
+    with open('mixed_precision_{}.json'.format(config["id"]), 'w') as f:
+        json.dump(loss_curves, f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.mixed_precision <path_to_config>"))
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    run_benchmark(device, sys.argv[1])
@@ -0,0 +1,158 @@
+"""Benchmarks generation of the toy datasets of experiments.dataloaders
+(Data1D, ConcentricSphere and ShiftedSines) against the previous per point
+loops, checks that both sample from the same distributions (with two sample
+Kolmogorov-Smirnov tests on every coordinate and on the radius), and compares
+loading batches through __getitem__ and __getitems__.
+
+Usage:
+
+    python -m benchmarks.synthetic_datasets [num_points]
+"""
+import sys
+import time
+import torch
+from math import pi
+from random import random
+from scipy.stats import ks_2samp
+from experiments.dataloaders import ConcentricSphere, Data1D, ShiftedSines
+from torch.utils.data import DataLoader, Dataset
+
+
+def loop_data1d(num_points, target_flip=False, noise_scale=1e-6):
+    """Data and targets of Data1D, generated one point at a time."""
+    data, targets = [], []
+    for _ in range(num_points):
+        value = 1.0 if random() > 0.5 else -1.0
+        target = -value if target_flip else value
+        data.append(torch.Tensor([value + noise_scale * torch.randn(1).item()]))
+        targets.append(torch.Tensor([target]))
+    return torch.stack(data), torch.stack(targets)
+
+
+def loop_point_in_sphere(dim, min_radius, max_radius):
+    """Point sampled as by the previous random_point_in_sphere."""
+    distance = (max_radius - min_radius) * (random() ** (1. / dim)) + min_radius
+    direction = torch.randn(dim)
+    return distance * direction / torch.norm(direction, 2)
+
+
+def loop_concentric_sphere(dim, inner_range, outer_range, num_points_inner,
+                           num_points_outer):
+    """Data and targets of ConcentricSphere, generated one point at a time."""
+    data, targets = [], []
+    for _ in range(num_points_inner):
+        data.append(loop_point_in_sphere(dim, *inner_range))
+        targets.append(torch.Tensor([-1]))
+    for _ in range(num_points_outer):
+        data.append(loop_point_in_sphere(dim, *outer_range))
+        targets.append(torch.Tensor([1]))
+    return torch.stack(data), torch.stack(targets)
+
+
+def loop_shifted_sines(dim, shift, num_points_upper, num_points_lower,
+                       noise_scale):
+    """Data and targets of ShiftedSines, generated one point at a time."""
+    data, targets = [], []
+    for i in range(num_points_upper + num_points_lower):
+        label = 1 if i < num_points_upper else -1
+        x = 2 * torch.rand(1) - 1
+        y = torch.sin(pi * x) + noise_scale * torch.randn(1) + label * shift / 2.
+        point = [x, y] if dim >= 2 else [y]
+        if dim > 2:
+            point.append(2 * torch.rand(dim - 2) - 1)
+        data.append(torch.cat(point))
+        targets.append(torch.Tensor([label]))
+    return torch.stack(data), torch.stack(targets)
+
+
+def min_p_value(data_a, data_b):
+    """Returns smallest p-value of two sample KS tests on every coordinate and
+    on the norm of the points."""
+    columns_a = list(data_a.T) + [data_a.norm(dim=1)]
+    columns_b = list(data_b.T) + [data_b.norm(dim=1)]
+    return min(ks_2samp(a.numpy(), b.numpy()).pvalue
+               for a, b in zip(columns_a, columns_b))
+
+
+class PointwiseDataset(Dataset):
+    """Wraps a dataset without exposing __getitems__, so a DataLoader fetches
+    it point by point."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        return self.dataset[index]
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def loader_throughput(dataset, batch_size, use_getitems):
+    """Returns points per second of iterating once over dataset with a
+    DataLoader, fetching batches with __getitems__ or point by point."""
+    if not use_getitems:
+        dataset = PointwiseDataset(dataset)
+    data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    start = time.time()
+    for _ in data_loader:
+        pass
+    return len(dataset) / (time.time() - start)
+
+
+def run_benchmark(num_points=100000, dim=2, batch_size=256, seed=0):
+    """Prints generation time of per point loops and vectorized datasets,
+    the smallest KS p-value between their samples and loader throughput.
+
+    Parameters
+    ----------
+    num_points : int
+        Number of points of every dataset.
+
+    dim : int
+        Dimension of ConcentricSphere and ShiftedSines.
+
+    batch_size : int
+
+    seed : int
+    """
+    half = num_points // 2
+    cases = [
+        ("Data1D",
+         lambda: loop_data1d(num_points),
+         lambda generator: Data1D(num_points, generator=generator)),
+        ("ConcentricSphere",
+         lambda: loop_concentric_sphere(dim, (0., .5), (1., 1.5), half, half),
+         lambda generator: ConcentricSphere(dim, (0., .5), (1., 1.5), half,
+                                            half, generator=generator)),
+        ("ShiftedSines",
+         lambda: loop_shifted_sines(dim, 1.4, half, half, .1),
+         lambda generator: ShiftedSines(dim, 1.4, half, half, .1,
+                                        generator=generator)),
+    ]
+    torch.manual_seed(seed)
+    for name, loop, vectorized in cases:
+        start = time.time()
+        loop_data, loop_targets = loop()
+        loop_time = time.time() - start
+
+        start = time.time()
+        dataset = vectorized(torch.Generator().manual_seed(seed))
+        vectorized_time = time.time() - start
+
+        # Compare points of each class separately, as classes have different
+        # distributions
+        p_value = min(min_p_value(loop_data[(loop_targets == label).squeeze(1)],
+                                  dataset.data[(dataset.targets == label).squeeze(1)])
+                      for label in (-1., 1.))
+        print("{}: loop {:.2f}s, vectorized {:.4f}s ({:.0f}x), min KS p-value "
+              "{:.3f}, contiguous {}".format(
+                  name, loop_time, vectorized_time, loop_time / vectorized_time,
+                  p_value, dataset.data.is_contiguous()))
+        print("    DataLoader: __getitem__ {:.0f} points/s, __getitems__ {:.0f} "
+              "points/s".format(loader_throughput(dataset, batch_size, False),
+                                loader_throughput(dataset, batch_size, True)))
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
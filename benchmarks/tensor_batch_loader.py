@@ -0,0 +1,86 @@
+"""Benchmarks the per epoch time of training a small model on the tensor
+datasets of phd_experiments.datasets when batches come from a
+torch.utils.data.DataLoader (one __getitem__ per sample and default collate)
+or from phd_experiments.datasets.tensor_batch_loader.TensorBatchLoader (one
+slice or index_select per batch), and checks that both give the same batches.
+
+Usage:
+
+    python -m benchmarks.tensor_batch_loader [num_points] [batch_size]
+"""
+import sys
+import time
+import torch
+from phd_experiments.datasets.tensor_batch_loader import TensorBatchLoader
+from phd_experiments.datasets.toy_linear import ToyLinearDataSet1
+from phd_experiments.datasets.toy_relu import ToyRelu
+from torch.utils.data import DataLoader, random_split
+
+
+def epoch_time(data_loader, model, optimizer, num_epochs):
+    """Returns mean time of training model for one epoch over data_loader
+    (after one warm up epoch)."""
+    loss_fn = torch.nn.MSELoss()
+    for epoch in range(num_epochs + 1):
+        if epoch == 1:
+            start = time.time()
+        for X, Y in data_loader:
+            optimizer.zero_grad()
+            loss = loss_fn(model(X), Y)
+            loss.backward()
+            optimizer.step()
+    return (time.time() - start) / num_epochs
+
+
+def run_benchmark(num_points=10000, batch_size=32, num_epochs=5, seed=0):
+    """Prints epoch times with both loaders and the overhead of the
+    DataLoader for every dataset.
+
+    Parameters
+    ----------
+    num_points : int
+        Number of samples of every dataset.
+
+    batch_size : int
+
+    num_epochs : int
+        Number of timed epochs.
+
+    seed : int
+    """
+    torch.manual_seed(seed)
+    datasets = {
+        "ToyRelu": ToyRelu(N=num_points, input_dim=4),
+        "ToyLinearDataSet1": ToyLinearDataSet1(N=num_points, A=torch.randn(4, 2), b=torch.randn(2),
+                                               dist=torch.distributions.Normal(0., 1.)),
+    }
+    for name, dataset in datasets.items():
+        # Train split, as in phd_experiments.ttode2.ttnode_driver
+        train_dataset = random_split(dataset, [0.8, 0.2])[0]
+
+        # Batches in dataset order are identical
+        for (X, Y), (X_fast, Y_fast) in zip(DataLoader(train_dataset, batch_size=batch_size),
+                                            TensorBatchLoader.from_dataset(train_dataset, batch_size)):
+            assert torch.equal(X, X_fast) and torch.equal(Y, Y_fast)
+
+        times = {}
+        loaders = {
+            "DataLoader": DataLoader(train_dataset, batch_size=batch_size, shuffle=True),
+            "TensorBatchLoader": TensorBatchLoader.from_dataset(train_dataset, batch_size,
+                                                                shuffle=True, seed=seed),
+        }
+        for loader_name, data_loader in loaders.items():
+            torch.manual_seed(seed)
+            model = torch.nn.Sequential(torch.nn.Linear(dataset.get_input_dim(), 16), torch.nn.Tanh(),
+                                        torch.nn.Linear(16, dataset.get_output_dim()))
+            optimizer = torch.optim.SGD(model.parameters(), lr=1e-2)
+            times[loader_name] = epoch_time(data_loader, model, optimizer, num_epochs)
+        print("{}: DataLoader {:.3f}s per epoch, TensorBatchLoader {:.3f}s per epoch "
+              "({:.1f}x)".format(name, times["DataLoader"], times["TensorBatchLoader"],
+                                 times["DataLoader"] / times["TensorBatchLoader"]))
+
+
+if __name__ == '__main__':
+    num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    run_benchmark(num_points, batch_size)
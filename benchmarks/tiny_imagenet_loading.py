@@ -0,0 +1,80 @@
+"""Benchmarks loading Tiny ImageNet batches by decoding JPEGs
+(experiments.dataloaders.TinyImageNet) against loading them from uint8 shards
+(experiments.dataloaders.TinyImageNetShards, written by
+experiments.tiny_imagenet_shards), and checks that both give the same images
+and labels.
+
+Usage:
+
+    python -m benchmarks.tiny_imagenet_loading <path_to_data> <shard_folder> [num_workers ...]
+"""
+import sys
+import time
+import torch
+from experiments.dataloaders import TinyImageNet, TinyImageNetShards
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+
+def images_per_second(data_loader, num_batches):
+    """Returns images per second of loading num_batches batches (after one
+    warm up batch, which starts the workers)."""
+    iterator = iter(data_loader)
+    next(iterator)
+    num_images = 0
+    start = time.time()
+    for _ in range(num_batches):
+        images, _ = next(iterator)
+        num_images += len(images)
+    return num_images / (time.time() - start)
+
+
+def run_benchmark(path_to_data, shard_folder, worker_counts=(0, 4),
+                  batch_size=256, num_batches=50):
+    """Prints images per second of both loaders for every number of workers.
+
+    Parameters
+    ----------
+    path_to_data : string
+        Root folder of Tiny ImageNet dataset.
+
+    shard_folder : string
+
+    worker_counts : tuple of ints
+        Numbers of DataLoader workers to benchmark.
+
+    batch_size : int
+
+    num_batches : int
+        Number of timed batches.
+    """
+    jpeg_data = TinyImageNet(path_to_data, transform=transforms.ToTensor())
+    shard_data = TinyImageNetShards(shard_folder)
+
+    # Images are ordered by class and file name in both datasets
+    max_diff = 0.
+    for idx in torch.randint(len(shard_data), (20,)).tolist():
+        jpeg_image, jpeg_label = jpeg_data[idx]
+        shard_image, shard_label = shard_data[idx]
+        assert jpeg_label == shard_label
+        max_diff = max(max_diff, (jpeg_image - shard_image).abs().max().item())
+    print("Max difference between JPEG and shard images: {:.1e}".format(max_diff))
+
+    for num_workers in worker_counts:
+        jpeg_loader = DataLoader(jpeg_data, batch_size=batch_size, shuffle=True,
+                                 num_workers=num_workers)
+        shard_loader = DataLoader(shard_data, batch_size=batch_size, shuffle=True,
+                                  num_workers=num_workers)
+        jpeg_rate = images_per_second(jpeg_loader, num_batches)
+        shard_rate = images_per_second(shard_loader, num_batches)
+        print("{} workers: JPEG {:.0f} images/s, shards {:.0f} images/s "
+              "({:.1f}x)".format(num_workers, jpeg_rate, shard_rate,
+                                 shard_rate / jpeg_rate))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise(RuntimeError("Wrong arguments, use python -m benchmarks.tiny_imagenet_loading "
+                           "<path_to_data> <shard_folder> [num_workers ...]"))
+    worker_counts = tuple(int(arg) for arg in sys.argv[3:]) or (0, 4)
+    run_benchmark(sys.argv[1], sys.argv[2], worker_counts)
@@ -1,17 +1,42 @@
 import glob
+import json
+import os
 from typing import Tuple
 
 import imageio
 import numpy as np
 import torch
+from anode.distributed import main_process_first
 from math import pi
-from random import random
-from torch.utils.data import Dataset, DataLoader
-from torch.distributions import Normal
+from torch.utils.data import Dataset, DataLoader, DistributedSampler
+from torch.utils.data.dataloader import default_collate
 from torchvision import datasets, transforms
 
 
-class Data1D(Dataset):
+class SyntheticDataset(Dataset):
+    """Base class of toy datasets whose points are stored in two contiguous
+    tensors, data of shape (num_points, dim) and targets of shape
+    (num_points, 1), which are generated at once by a subclass.
+
+    Batches can be fetched with a single indexing operation through
+    __getitems__, which torch.utils.data.DataLoader uses instead of calling
+    __getitem__ once for every point. Points are returned as a list of (data,
+    target) pairs, so DataLoader works with its default collate function.
+    """
+
+    def __getitem__(self, index):
+        return self.data[index], self.targets[index]
+
+    def __getitems__(self, indices):
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        # List of points, which is the format expected by collate functions
+        return list(zip(self.data[indices], self.targets[indices]))
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Data1D(SyntheticDataset):
     """1D dimensional data used to demonstrate there are functions ODE flows
     cannot represent. Corresponds to g_1d(x) in the paper if target_flip is
     True.
@@ -27,42 +52,28 @@ class Data1D(Dataset):
     noise_scale : float
         Defaults to 0.0 (i.e. no noise). Otherwise, corresponds to standard
         deviation of white noise added to each point.
+
+    generator : None or torch.Generator
+        Random number generator used to sample points. If None, uses the
+        global random number generator of torch.
     """
 
-    def __init__(self, num_points, target_flip=False, noise_scale=1e-6):
+    def __init__(self, num_points, target_flip=False, noise_scale=1e-6,
+                 generator=None):
         self.num_points = num_points
         self.target_flip = target_flip
         self.noise_scale = noise_scale
-        self.data = []
-        self.targets = []
-
-        noise = Normal(loc=0., scale=self.noise_scale)
 
-        for _ in range(num_points):
-            if random() > 0.5:
-                data_point = 1.0
-                target = 1.0
-            else:
-                data_point = -1.0
-                target = -1.0
+        # Points are -1 or 1 with equal probability
+        signs = 2. * (torch.rand(num_points, 1, generator=generator) > 0.5) - 1.
+        self.targets = -signs if self.target_flip else signs
+        self.data = signs
+        if self.noise_scale > 0.0:
+            self.data = signs + self.noise_scale * \
+                torch.randn(num_points, 1, generator=generator)
 
-            if self.target_flip:
-                target *= -1
 
-            if self.noise_scale > 0.0:
-                data_point += noise.sample()
-
-            self.data.append(torch.Tensor([data_point]))
-            self.targets.append(torch.Tensor([target]))
-
-    def __getitem__(self, index):
-        return self.data[index], self.targets[index]
-
-    def __len__(self):
-        return self.num_points
-
-
-class ConcentricSphere(Dataset):
+class ConcentricSphere(SyntheticDataset):
     """Dataset of concentric d-dimensional spheres. Points in the inner sphere
     are mapped to -1, while points in the outer sphere are mapped 1.
 
@@ -84,41 +95,32 @@ class ConcentricSphere(Dataset):
 
     num_points_outer : int
         Number of points in outer cluster
+
+    generator : None or torch.Generator
+        Random number generator used to sample points. If None, uses the
+        global random number generator of torch.
     """
 
     def __init__(self, dim: int, inner_range:Tuple, outer_range: Tuple, num_points_inner:int,
-                 num_points_outer: int):
+                 num_points_outer: int, generator=None):
         self.dim = dim
         self.inner_range = inner_range
         self.outer_range = outer_range
         self.num_points_inner = num_points_inner
         self.num_points_outer = num_points_outer
 
-        self.data = []
-        self.targets = []
-
-        # Generate data for inner sphere
-        for _ in range(self.num_points_inner):
-            self.data.append(
-                random_point_in_sphere(dim, inner_range[0], inner_range[1])
-            )
-            self.targets.append(torch.Tensor([-1]))
-
-        # Generate data for outer sphere
-        for _ in range(self.num_points_outer):
-            self.data.append(
-                random_point_in_sphere(dim, outer_range[0], outer_range[1])
-            )
-            self.targets.append(torch.Tensor([1]))
-
-    def __getitem__(self, index):
-        return self.data[index], self.targets[index]
-
-    def __len__(self):
-        return len(self.data)
+        # Points of inner sphere followed by points of outer sphere
+        self.data = torch.cat([
+            random_points_in_sphere(num_points_inner, dim, inner_range[0],
+                                    inner_range[1], generator),
+            random_points_in_sphere(num_points_outer, dim, outer_range[0],
+                                    outer_range[1], generator)
+        ])
+        self.targets = torch.cat([-torch.ones(num_points_inner, 1),
+                                  torch.ones(num_points_outer, 1)])
 
 
-class ShiftedSines(Dataset):
+class ShiftedSines(SyntheticDataset):
     """Dataset of two shifted sine curves. Points from the curve shifted upward
     are mapped to 1, while points from the curve shifted downward are mapped to
     1.
@@ -140,48 +142,68 @@ class ShiftedSines(Dataset):
     noise_scale : float
         Defaults to 0.0 (i.e. no noise). Otherwise, corresponds to standard
         deviation of white noise added to each point.
+
+    generator : None or torch.Generator
+        Random number generator used to sample points. If None, uses the
+        global random number generator of torch.
     """
 
     def __init__(self, dim, shift, num_points_upper, num_points_lower,
-                 noise_scale):
+                 noise_scale, generator=None):
         self.dim = dim
         self.shift = shift
         self.num_points_upper = num_points_upper
         self.num_points_lower = num_points_lower
         self.noise_scale = noise_scale
 
-        noise = Normal(loc=0., scale=self.noise_scale)
+        num_points = num_points_upper + num_points_lower
+        # Points of upper curve followed by points of lower curve
+        self.targets = torch.cat([torch.ones(num_points_upper, 1),
+                                  -torch.ones(num_points_lower, 1)])
+        y_shift = self.targets * shift / 2.
 
-        self.data = []
-        self.targets = []
+        x = 2 * torch.rand(num_points, 1, generator=generator) - 1  # Random points between -1 and 1
+        noise = self.noise_scale * torch.randn(num_points, 1, generator=generator)
+        y = torch.sin(pi * x) + noise + y_shift
 
-        # Generate data for upper curve and lower curve
-        for i in range(self.num_points_upper + self.num_points_lower):
-            if i < self.num_points_upper:
-                label = 1
-                y_shift = shift / 2.
-            else:
-                label = -1
-                y_shift = - shift / 2.
+        if self.dim == 1:
+            self.data = y
+        elif self.dim == 2:
+            self.data = torch.cat([x, y], 1)
+        else:
+            random_higher_dims = 2 * torch.rand(num_points, self.dim - 2,
+                                                generator=generator) - 1
+            self.data = torch.cat([x, y, random_higher_dims], 1)
 
-            x = 2 * torch.rand(1) - 1  # Random point between -1 and 1
-            y = torch.sin(pi * x) + noise.sample() + y_shift
 
-            if self.dim == 1:
-                self.data.append(torch.Tensor([y]))
-            elif self.dim == 2:
-                self.data.append(torch.cat([x, y]))
-            else:
-                random_higher_dims = 2 * torch.rand(self.dim - 2) - 1
-                self.data.append(torch.cat([x, y, random_higher_dims]))
+def random_points_in_sphere(num_points, dim, min_radius, max_radius,
+                            generator=None):
+    """Returns num_points points sampled uniformly at random from a sphere if
+    min_radius is 0, as a tensor of shape (num_points, dim). Else samples
+    points approximately uniformly on annulus.
 
-            self.targets.append(torch.Tensor([label]))
+    Parameters
+    ----------
+    num_points : int
 
-    def __getitem__(self, index):
-        return self.data[index], self.targets[index]
+    dim : int
+        Dimension of sphere
 
-    def __len__(self):
-        return len(self.data)
+    min_radius : float
+        Minimum distance of sampled point from origin.
+
+    max_radius : float
+        Maximum distance of sampled point from origin.
+
+    generator : None or torch.Generator
+    """
+    # Sample distance of points from origin
+    unif = torch.rand(num_points, 1, generator=generator)
+    distance = (max_radius - min_radius) * (unif ** (1. / dim)) + min_radius
+    # Sample direction of points away from origin
+    direction = torch.randn(num_points, dim, generator=generator)
+    unit_direction = direction / torch.norm(direction, 2, dim=1, keepdim=True)
+    return distance * unit_direction
 
 
 def random_point_in_sphere(dim, min_radius, max_radius):
@@ -199,13 +221,7 @@ def random_point_in_sphere(dim, min_radius, max_radius):
     max_radius : float
         Maximum distance of sampled point from origin.
     """
-    # Sample distance of point from origin
-    unif = random()
-    distance = (max_radius - min_radius) * (unif ** (1. / dim)) + min_radius
-    # Sample direction of point away from origin
-    direction = torch.randn(dim)
-    unit_direction = direction / torch.norm(direction, 2)
-    return distance * unit_direction
+    return random_points_in_sphere(1, dim, min_radius, max_radius)[0]
 
 
 def dataset_to_numpy(dataset):
@@ -215,16 +231,165 @@ def dataset_to_numpy(dataset):
     dataset : torch.utils.data.Dataset
         One of ConcentricSphere and ShiftedSines
     """
-    num_points = len(dataset)
-    X = np.zeros((num_points, dataset.dim))
-    y = np.zeros((num_points, 1))
-    for i in range(num_points):
-        X[i] = dataset.data[i].numpy()
-        y[i] = dataset.targets[i].item()
+    X = dataset.data.numpy()
+    y = dataset.targets.numpy()
     return X.astype('float32'), y.astype('float32')
 
 
-def mnist(batch_size=64, size=28, path_to_data='../../mnist_data'):
+class DeviceDataLoader():
+    """Drop-in replacement for torch.utils.data.DataLoader for small datasets
+    (e.g. ConcentricSphere, ShiftedSines and Data1D), which keeps the whole
+    dataset on device. Every epoch the dataset is shuffled with a single
+    permutation on device, and batches are slice views of the shuffled data, so
+    there are no per item __getitem__ and collate calls or host to device
+    transfers during training.
+
+    Parameters
+    ----------
+    dataset : torch.utils.data.Dataset
+
+    batch_size : int
+
+    device : torch.device
+
+    shuffle : bool
+        If True, shuffles data at every epoch.
+    """
+    def __init__(self, dataset, batch_size, device, shuffle=False):
+        self.batch_size = batch_size
+        self.device = device
+        self.shuffle = shuffle
+        if isinstance(dataset, SyntheticDataset):
+            tensors = (dataset.data, dataset.targets)
+        else:
+            # Collate the whole dataset once, so batches have the same format
+            # as batches of a DataLoader
+            tensors = default_collate([dataset[i] for i in range(len(dataset))])
+        self.tensors = tuple(tensor.to(device) for tensor in tensors)
+        self.num_points = len(self.tensors[0])
+
+    def __iter__(self):
+        if self.shuffle:
+            permutation = torch.randperm(self.num_points, device=self.device)
+            tensors = tuple(tensor[permutation] for tensor in self.tensors)
+        else:
+            tensors = self.tensors
+        for start in range(0, self.num_points, self.batch_size):
+            yield tuple(tensor[start:start + self.batch_size] for tensor in tensors)
+
+    def __len__(self):
+        return (self.num_points + self.batch_size - 1) // self.batch_size
+
+
+class TensorImageLoader():
+    """Replacement for a torch.utils.data.DataLoader over a torchvision image
+    dataset (e.g. MNIST or CIFAR10) whose images are held in memory as one
+    contiguous uint8 tensor of shape (num_images, channels, height, width).
+    Batches are gathered with a single indexing operation, and converted to
+    float, resized and normalized as a whole, instead of passing every image
+    through PIL transforms.
+
+    Batches are the same as with transforms.Resize(size) and
+    transforms.ToTensor() (followed by transforms.Normalize(mean, std) if
+    mean is not None) when size is the size of the images. Other sizes are
+    resized with antialiased bilinear interpolation on tensors, which differs
+    slightly from resizing with PIL.
+
+    Parameters
+    ----------
+    images : torch.Tensor
+        uint8 tensor of shape (num_images, channels, height, width).
+
+    targets : torch.Tensor
+        Labels of shape (num_images,).
+
+    batch_size : int
+
+    shuffle : bool
+        If True, shuffles data at every epoch with a random permutation of
+        the indices.
+
+    size : None or int
+        Size (height and width) of returned images. If None, images are not
+        resized.
+
+    mean, std : None or sequence of floats
+        If not None, mean and standard deviation of every channel used to
+        normalize images.
+
+    distributed : bool
+        If True, every process of distributed training loads its own shard of
+        the data through a DistributedSampler (the sampler attribute).
+
+    device : torch.device
+        Device on which images are held and batches are returned.
+    """
+    def __init__(self, images, targets, batch_size, shuffle=False, size=None,
+                 mean=None, std=None, distributed=False,
+                 device=torch.device('cpu')):
+        self.images = images.to(device).contiguous()
+        self.targets = targets.to(device)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.size = size
+        self.device = device
+        self.num_images = len(images)
+        self.mean = None if mean is None else \
+            torch.tensor(mean, device=device).view(1, -1, 1, 1)
+        self.std = None if std is None else \
+            torch.tensor(std, device=device).view(1, -1, 1, 1)
+        self.sampler = DistributedSampler(range(self.num_images), shuffle=shuffle) \
+            if distributed else None
+
+    def __iter__(self):
+        if self.sampler is not None:
+            indices = torch.tensor(list(self.sampler), device=self.device)
+        elif self.shuffle:
+            indices = torch.randperm(self.num_images, device=self.device)
+        else:
+            indices = None
+        num_indices = self.num_images if indices is None else len(indices)
+        for start in range(0, num_indices, self.batch_size):
+            if indices is None:
+                batch_indices = slice(start, start + self.batch_size)
+            else:
+                batch_indices = indices[start:start + self.batch_size]
+            yield self._transform(self.images[batch_indices]), \
+                self.targets[batch_indices]
+
+    def __len__(self):
+        num_indices = self.num_images if self.sampler is None else len(self.sampler)
+        return (num_indices + self.batch_size - 1) // self.batch_size
+
+    def _transform(self, images):
+        """Converts a batch of uint8 images to normalized float images."""
+        images = images.float().div_(255)
+        if self.size is not None and tuple(images.shape[2:]) != (self.size, self.size):
+            images = transforms.functional.resize(images, [self.size, self.size],
+                                                  antialias=True)
+        if self.mean is not None:
+            images = (images - self.mean) / self.std
+        return images
+
+    @classmethod
+    def from_dataset(cls, dataset, batch_size, **kwargs):
+        """Creates loader from the decoded images of a torchvision MNIST or
+        CIFAR10 dataset (its transform is not used). kwargs are passed to
+        TensorImageLoader."""
+        images = torch.as_tensor(dataset.data)
+        if images.dim() == 3:
+            # Shape (num_images, 1, height, width), e.g. MNIST
+            images = images.unsqueeze(1)
+        else:
+            # Shape (num_images, channels, height, width) from (num_images,
+            # height, width, channels), e.g. CIFAR10
+            images = images.permute(0, 3, 1, 2)
+        targets = torch.as_tensor(dataset.targets, dtype=torch.long)
+        return cls(images, targets, batch_size, **kwargs)
+
+
+def mnist(batch_size=64, size=28, path_to_data='../../mnist_data',
+          distributed=False, in_memory=False):
     """MNIST dataloader with (28, 28) images.
 
     Parameters
@@ -236,24 +401,43 @@ def mnist(batch_size=64, size=28, path_to_data='../../mnist_data'):
 
     path_to_data : string
         Path to MNIST data files.
+
+    distributed : bool
+        If True, every process of distributed training loads its own shard of
+        the training data (batch_size is the batch size of every process).
+
+    in_memory : bool
+        If True, returns TensorImageLoaders, which hold all images in memory
+        as uint8 tensors and transform whole batches (giving the same batches
+        much faster).
     """
     all_transforms = transforms.Compose([
         transforms.Resize(size),
         transforms.ToTensor()
     ])
 
-    train_data = datasets.MNIST(path_to_data, train=True, download=True,
-                                transform=all_transforms)
+    # Only download data once in distributed training
+    with main_process_first():
+        train_data = datasets.MNIST(path_to_data, train=True, download=True,
+                                    transform=all_transforms)
     test_data = datasets.MNIST(path_to_data, train=False,
                                transform=all_transforms)
 
-    train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True)
+    if in_memory:
+        train_loader = TensorImageLoader.from_dataset(train_data, batch_size, shuffle=True,
+                                                      size=size, distributed=distributed)
+        test_loader = TensorImageLoader.from_dataset(test_data, batch_size, shuffle=True,
+                                                     size=size)
+        return train_loader, test_loader
+
+    train_loader = _train_loader(train_data, batch_size, distributed)
     test_loader = DataLoader(test_data, batch_size=batch_size, shuffle=True)
 
     return train_loader, test_loader
 
 
-def cifar10(batch_size=64, size=32, path_to_data='../../cifar10_data'):
+def cifar10(batch_size=64, size=32, path_to_data='../../cifar10_data',
+            distributed=False, in_memory=False):
     """CIFAR10 dataloader.
 
     Parameters
@@ -265,24 +449,43 @@ def cifar10(batch_size=64, size=32, path_to_data='../../cifar10_data'):
 
     path_to_data : string
         Path to CIFAR10 data files.
+
+    distributed : bool
+        If True, every process of distributed training loads its own shard of
+        the training data (batch_size is the batch size of every process).
+
+    in_memory : bool
+        If True, returns TensorImageLoaders, which hold all images in memory
+        as uint8 tensors and transform whole batches (giving the same batches
+        much faster).
     """
     all_transforms = transforms.Compose([
         transforms.Resize(size),
         transforms.ToTensor()
     ])
 
-    train_data = datasets.CIFAR10(path_to_data, train=True, download=True,
-                                  transform=all_transforms)
+    # Only download data once in distributed training
+    with main_process_first():
+        train_data = datasets.CIFAR10(path_to_data, train=True, download=True,
+                                      transform=all_transforms)
     test_data = datasets.CIFAR10(path_to_data, train=False,
                                  transform=all_transforms)
 
-    train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True)
+    if in_memory:
+        train_loader = TensorImageLoader.from_dataset(train_data, batch_size, shuffle=True,
+                                                      size=size, distributed=distributed)
+        test_loader = TensorImageLoader.from_dataset(test_data, batch_size, shuffle=True,
+                                                     size=size)
+        return train_loader, test_loader
+
+    train_loader = _train_loader(train_data, batch_size, distributed)
     test_loader = DataLoader(test_data, batch_size=batch_size, shuffle=True)
 
     return train_loader, test_loader
 
 
-def tiny_imagenet(batch_size=64, path_to_data='../../tiny-imagenet-200/'):
+def tiny_imagenet(batch_size=64, path_to_data='../../tiny-imagenet-200/',
+                  distributed=False, path_to_shards=None, num_workers=0):
     """Tiny ImageNet dataloader.
 
     Parameters
@@ -291,12 +494,36 @@ def tiny_imagenet(batch_size=64, path_to_data='../../tiny-imagenet-200/'):
 
     path_to_data : string
         Path to Tiny ImageNet data files root folder.
+
+    distributed : bool
+        If True, every process of distributed training loads its own shard of
+        the data (batch_size is the batch size of every process).
+
+    path_to_shards : None or string
+        If not None, loads images from the uint8 shards in this folder (see
+        experiments.tiny_imagenet_shards) instead of decoding JPEGs.
+
+    num_workers : int
+        Number of DataLoader worker processes.
     """
+    if path_to_shards is not None:
+        imagenet_data = TinyImageNetShards(path_to_shards)
+        return _train_loader(imagenet_data, batch_size, distributed,
+                             num_workers=num_workers)
     imagenet_data = TinyImageNet(root_folder=path_to_data,
                                  transform=transforms.ToTensor())
-    imagenet_loader = DataLoader(imagenet_data, batch_size=batch_size,
-                                 shuffle=True)
-    return imagenet_loader
+    return _train_loader(imagenet_data, batch_size, distributed,
+                         num_workers=num_workers)
+
+
+def _train_loader(dataset, batch_size, distributed, **kwargs):
+    """Returns loader of training data, which is shuffled every epoch. In
+    distributed training, the data is split into equally sized shards, one for
+    every process. kwargs are passed to DataLoader."""
+    if distributed:
+        return DataLoader(dataset, batch_size=batch_size,
+                          sampler=DistributedSampler(dataset), **kwargs)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=True, **kwargs)
 
 
 class TinyImageNet(Dataset):
@@ -317,10 +544,12 @@ class TinyImageNet(Dataset):
         self.imgs_and_classes = []  # Paths to images and their classes
 
         train_folder = root_folder + 'train/'
-        class_folders = glob.glob(train_folder + '*')  # One folder for each image class
+        # One folder for each image class, sorted so labels do not depend on
+        # the order of the file system
+        class_folders = sorted(glob.glob(train_folder + '*'))
 
         for i, class_folder in enumerate(class_folders):
-            image_paths = glob.glob(class_folder + '/images/*.JPEG')
+            image_paths = sorted(glob.glob(class_folder + '/images/*.JPEG'))
             for image_path in image_paths:
                 self.imgs_and_classes.append((image_path, i))
 
@@ -341,3 +570,76 @@ class TinyImageNet(Dataset):
             img = img.repeat(3, 1, 1)
 
         return img, label
+
+
+class TinyImageNetShards(Dataset):
+    """Tiny ImageNet images preprocessed by experiments.tiny_imagenet_shards
+    into memory mapped uint8 shards, which avoids decoding a JPEG for every
+    image. Images are float tensors of shape (3, 64, 64) with values in [0, 1]
+    (as with TinyImageNet and transforms.ToTensor), optionally normalized.
+
+    Batches are fetched through __getitems__ with one indexing operation per
+    shard and converted to float at once, and returned as a list of (image,
+    label) samples, so the default collate_fn of a DataLoader can be used.
+    Shards are opened lazily in every process, so the dataset can be used with
+    multiple DataLoader workers.
+
+    Parameters
+    ----------
+    shard_folder : string
+        Folder written by experiments.tiny_imagenet_shards.pack_tiny_imagenet.
+
+    split : string
+        One of 'train' and 'val'.
+
+    mean, std : None or sequence of 3 floats
+        If not None, images are normalized with the mean and standard
+        deviation of every channel.
+    """
+
+    def __init__(self, shard_folder, split='train', mean=None, std=None):
+        self.shard_folder = shard_folder
+        self.split = split
+        with open(os.path.join(shard_folder, 'index.json')) as f:
+            index = json.load(f)
+        self.classes = index["classes"]
+        self.shard_files = [shard["file"] for shard in index["splits"][split]["shards"]]
+        # Index of first image of every shard, and total number of images
+        self.shard_starts = np.cumsum([0] + [shard["num_images"] for shard in
+                                             index["splits"][split]["shards"]])
+        self.labels = torch.from_numpy(np.load(os.path.join(
+            shard_folder, index["splits"][split]["labels"])))
+        self.mean = None if mean is None else torch.tensor(mean).view(1, 3, 1, 1)
+        self.std = None if std is None else torch.tensor(std).view(1, 3, 1, 1)
+        self._shards = None
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def __getitem__(self, idx):
+        return self.__getitems__([idx])[0]
+
+    def __getitems__(self, indices):
+        if self._shards is None:
+            self._shards = [np.load(os.path.join(self.shard_folder, file), mmap_mode='r')
+                            for file in self.shard_files]
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_ids = np.searchsorted(self.shard_starts, indices, side='right') - 1
+        # Shape (batch_size, 64, 64, 3)
+        images = np.empty((len(indices),) + self._shards[0].shape[1:], dtype=np.uint8)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            images[mask] = self._shards[shard_id][indices[mask] - self.shard_starts[shard_id]]
+        # Shape (batch_size, 3, 64, 64)
+        images = torch.from_numpy(images).permute(0, 3, 1, 2).float().div_(255)
+        if self.mean is not None:
+            images = (images - self.mean) / self.std
+        # List of samples, which is the format expected by collate functions
+        return list(zip(images.contiguous(),
+                        self.labels[torch.from_numpy(indices)].tolist()))
+
+    def __getstate__(self):
+        # Memory maps are opened again in every worker process
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
@@ -0,0 +1,262 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import numpy as np
+import torch
+from contextlib import contextmanager
+
+# Default cache directory, can be overridden with the ANODE_DATASET_CACHE
+# environment variable
+DEFAULT_CACHE_DIR = os.environ.get(
+    'ANODE_DATASET_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'anode_datasets'))
+
+
+class DatasetCache():
+    """On disk cache of generated datasets (e.g.
+    experiments.dataloaders.ConcentricSphere), addressed by a hash of the
+    dataset class (its name, the source code of the module defining it and of
+    the modules of the same package it imports from, and its optional
+    cache_version attribute), its parameters and the seed used to generate it.
+    Datasets depending on other code (e.g. of another package) should
+    increment cache_version when that code changes the data.
+
+    The tensor attributes of a dataset are stored as .npy files and the
+    remaining attributes are pickled. On a hit, tensors are memory mapped
+    (copy on write), so loading takes milliseconds regardless of the size of
+    the dataset and pages are only read when accessed.
+
+    Every entry records the size and SHA-256 hash of its files. Sizes are
+    checked on every load and hashes if verify is True; corrupted entries are
+    deleted and generated again. When the cache exceeds max_bytes, the least
+    recently used entries are evicted.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Directory of the cache, created if it does not exist.
+
+    max_bytes : int
+        Maximum total size of the cache in bytes.
+
+    verify : bool
+        If True, checks the hashes of the files of an entry on every load.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2 ** 32,
+                 verify=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.verify = verify
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, cls, seed, **params):
+        """Returns cls(**params) generated with the random number generators
+        of torch, numpy and python seeded with seed, from the cache if
+        possible. The global random number generators are left untouched.
+
+        Parameters
+        ----------
+        cls : class
+            Dataset class, whose tensors are attributes of its instances.
+
+        seed : int
+
+        params : dict
+            Arguments of cls.
+        """
+        key = self.key(cls, seed, params)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            dataset = self._load(cls, entry_dir)
+            if dataset is not None:
+                return dataset
+            # Corrupted entry
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+        with seeded(seed):
+            dataset = cls(**params)
+        self._save(dataset, entry_dir, {"class": _class_name(cls),
+                                        "params": _to_json(params),
+                                        "seed": seed})
+        self.evict(keep=key)
+        return dataset
+
+    @staticmethod
+    def key(cls, seed, params):
+        """Returns hash identifying the dataset generated by cls with params
+        and seed. Changes to the module defining cls (e.g. to the functions
+        generating its data), to the modules of the same package it imports
+        from (e.g. an ODE solver generating the data) or to cls.cache_version
+        give new keys."""
+        sha256 = hashlib.sha256()
+        for name, module in sorted(_source_modules(cls).items()):
+            try:
+                source = inspect.getsource(module)
+            except (OSError, TypeError):
+                source = ''
+            sha256.update(name.encode())
+            sha256.update(source.encode())
+        description = json.dumps({"class": _class_name(cls),
+                                  "source": sha256.hexdigest(),
+                                  "version": getattr(cls, 'cache_version', None),
+                                  "params": _to_json(params), "seed": seed},
+                                 sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def size(self):
+        """Returns total size of the cache in bytes."""
+        return sum(_entry_bytes(os.path.join(self.cache_dir, key))
+                   for key in self._keys())
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries (except keep) until the cache is
+        at most max_bytes."""
+        entries = []
+        for key in self._keys():
+            entry_dir = os.path.join(self.cache_dir, key)
+            meta_path = os.path.join(entry_dir, 'meta.json')
+            last_used = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0.
+            entries.append((last_used, key, _entry_bytes(entry_dir)))
+        total = sum(num_bytes for _, _, num_bytes in entries)
+        for _, key, num_bytes in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= num_bytes
+
+    def clear(self):
+        """Deletes all entries."""
+        for key in self._keys():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _keys(self):
+        # Temporary directories of entries being written start with a dot
+        return [name for name in os.listdir(self.cache_dir)
+                if not name.startswith('.') and
+                os.path.isdir(os.path.join(self.cache_dir, name))]
+
+    def _save(self, dataset, entry_dir, description):
+        """Writes dataset to entry_dir. Files are written to a temporary
+        directory which is then renamed, so concurrent runs never see partial
+        entries."""
+        tmp_dir = tempfile.mkdtemp(prefix='.', dir=self.cache_dir)
+        files = {}
+        state = {}
+        for name, value in vars(dataset).items():
+            if torch.is_tensor(value):
+                file_name = name + '.npy'
+                np.save(os.path.join(tmp_dir, file_name),
+                        value.detach().cpu().numpy())
+                files[file_name] = name
+            else:
+                state[name] = value
+        with open(os.path.join(tmp_dir, 'state.pkl'), 'wb') as f:
+            pickle.dump(state, f)
+        description["tensors"] = files
+        description["files"] = {
+            file_name: {"bytes": os.path.getsize(os.path.join(tmp_dir, file_name)),
+                        "sha256": _file_hash(os.path.join(tmp_dir, file_name))}
+            for file_name in list(files) + ['state.pkl']
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(description, f)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process wrote the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load(self, cls, entry_dir):
+        """Returns dataset stored in entry_dir, or None if the entry is
+        corrupted."""
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            for file_name, info in meta["files"].items():
+                path = os.path.join(entry_dir, file_name)
+                if os.path.getsize(path) != info["bytes"]:
+                    return None
+                if self.verify and _file_hash(path) != info["sha256"]:
+                    return None
+            with open(os.path.join(entry_dir, 'state.pkl'), 'rb') as f:
+                state = pickle.load(f)
+            for file_name, name in meta["tensors"].items():
+                # Copy on write memory map, so tensors are writable without
+                # modifying the cache
+                array = np.load(os.path.join(entry_dir, file_name), mmap_mode='c')
+                state[name] = torch.from_numpy(array)
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            return None
+        # Mark entry as recently used
+        os.utime(meta_path)
+        dataset = cls.__new__(cls)
+        dataset.__dict__.update(state)
+        return dataset
+
+
+@contextmanager
+def seeded(seed):
+    """Context manager seeding the random number generators of torch (on
+    CPU), numpy and python with seed, and restoring their states on exit."""
+    random_state = random.getstate()
+    numpy_state = np.random.get_state()
+    try:
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed)
+            np.random.seed(seed % 2 ** 32)
+            random.seed(seed)
+            yield
+    finally:
+        random.setstate(random_state)
+        np.random.set_state(numpy_state)
+
+
+def _source_modules(cls):
+    """Returns the module defining cls and the modules of the same top level
+    package whose modules, classes or functions it imports, by name."""
+    module = inspect.getmodule(cls)
+    if module is None:
+        return {}
+    package = module.__name__.split('.')[0]
+    modules = {module.__name__: module}
+    for value in vars(module).values():
+        dependency = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if dependency is not None and dependency.__name__.split('.')[0] == package:
+            modules[dependency.__name__] = dependency
+    return modules
+
+
+def _class_name(cls):
+    return cls.__module__ + '.' + cls.__qualname__
+
+
+def _to_json(params):
+    """Returns JSON serializable version of params, with tensors as lists."""
+    return json.loads(json.dumps(params, sort_keys=True,
+                                 default=lambda value: value.tolist() if torch.is_tensor(value) else repr(value)))
+
+
+def _file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _entry_bytes(entry_dir):
+    try:
+        return sum(os.path.getsize(os.path.join(entry_dir, name))
+                   for name in os.listdir(entry_dir))
+    except OSError:
+        # Entry evicted by another process
+        return 0
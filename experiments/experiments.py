@@ -2,20 +2,27 @@ import json
 import matplotlib
 
 matplotlib.use('Agg')  # This is hacky (useful for running on VMs)
+import hashlib
 import numpy as np
 import os
+import random
 import time
 import torch
 from anode.discrete_models import ResNet
+from anode.ensemble import EnsembleODENet
 from anode.models import ODENet
+from anode.stopping import stopping_policies_from_config
 from anode.training import Trainer
-from experiments.dataloaders import ConcentricSphere, ShiftedSines
+from experiments.dataloaders import (ConcentricSphere, DeviceDataLoader,
+                                     ShiftedSines)
+from experiments.dataset_cache import DEFAULT_CACHE_DIR, DatasetCache, seeded
 from torch.utils.data import DataLoader
 from viz.plots import histories_plt, multi_feature_plt
 
 
 def run_experiments(device, data_dim=2, viz_batch_size=512, num_reps=5,
-                    datasets=[], model_configs=[], training_config={}):
+                    datasets=[], model_configs=[], training_config={},
+                    seed=None, dataset_cache=None):
     """Runs experiments for various model configurations on various datasets.
 
     Parameters
@@ -43,122 +50,351 @@ def run_experiments(device, data_dim=2, viz_batch_size=512, num_reps=5,
     training_config : dict
         Specifies training configurations
 
+    seed : None or int
+        If not None, seeds the generation of every dataset and the training of
+        every rep with a seed derived from seed (see cell_seed), so that
+        results do not depend on the order in which reps are run (e.g. by
+        experiments.scheduler.run_experiments_parallel).
+
+    dataset_cache : None or experiments.dataset_cache.DatasetCache
+        If not None (and seed is not None), datasets generated before with the
+        same specification and seed are loaded from this cache.
+
     Note
     ----
     For an example of the structure of the config files, see the config.json
     file.
     """
     results = []
-    for dataset in datasets:
-        if dataset["type"] == "sphere":
-            data_object = ConcentricSphere(data_dim,
-                                           dataset["inner_range"],
-                                           dataset["outer_range"],
-                                           dataset["num_points_inner"],
-                                           dataset["num_points_outer"])
-        elif dataset["type"] == "sine":
-            data_object = ShiftedSines(data_dim,
-                                       dataset["shift"],
-                                       dataset["num_points_lower"],
-                                       dataset["num_points_upper"],
-                                       dataset["noise_scale"])
-
-        data_loader = DataLoader(data_object,
-                                 batch_size=training_config["batch_size"],
-                                 shuffle=True)
+    for d, dataset in enumerate(datasets):
+        if seed is not None:
+            seed_everything(cell_seed(seed, d))
+        data_object = dataset_from_config(data_dim, dataset,
+                                          seed=None if seed is None else cell_seed(seed, d),
+                                          cache=dataset_cache)
+
+        # Datasets are small, so keep them on device during training
+        data_loader = DeviceDataLoader(data_object,
+                                       batch_size=training_config["batch_size"],
+                                       device=device, shuffle=True)
 
         results.append({"dataset": dataset, "model_info": [], "tensors": [],
                         "models": []})
 
-        # Retrieve inputs and targets which will be used to visualize how models
-        # transform inputs to features
-        data_loader_viz = DataLoader(data_object,
-                                     batch_size=viz_batch_size,
-                                     shuffle=True)
-        for batch in data_loader_viz:
-            break
-        inputs, targets = batch
+        inputs, targets = viz_batch(data_object, viz_batch_size)
 
         for i, model_config in enumerate(model_configs):
             # Check whether model is ODE based or a ResNet
             is_ode = model_config["type"] == "odenet" or model_config["type"] == "anode"
 
-            # Initialize histories
-            loss_histories = []
-            epoch_loss_histories = []
-            epoch_nfe_histories = []
-            features = []
-            predictions = []
-            models = []
+            reps = []
             start = time.time()
 
-            for j in range(num_reps):
-                print("{}/{} model, {}/{} rep".format(i + 1, len(model_configs), j + 1, num_reps))
-
-                if is_ode:
-                    if model_config["type"] == "odenet":
-                        augment_dim = 0
-                    else:
-                        augment_dim = model_config["augment_dim"]
-
-                    model = ODENet(device, data_dim, model_config["hidden_dim"],
-                                   augment_dim=augment_dim,
-                                   time_dependent=model_config["time_dependent"])
-                else:
-                    model = ResNet(data_dim, model_config["hidden_dim"],
-                                   model_config["num_layers"])
-
-                model.to(device)
-
-                optimizer = torch.optim.Adam(model.parameters(),
-                                             lr=model_config["lr"])
-
-                trainer = Trainer(model, optimizer, device,
-                                  print_freq=training_config["print_freq"],
-                                  record_freq=training_config["record_freq"],
-                                  verbose=False)
-
-                trainer.train(data_loader, training_config["epochs"])
-
-                loss_histories.append(trainer.histories["loss_history"])
-                epoch_loss_histories.append(trainer.histories["epoch_loss_history"])
-                if is_ode:
-                    epoch_nfe_histories.append(trainer.histories["epoch_nfe_history"])
-
-                # Add trained model
-                models.append(model)
-
-                # Record how model transforms inputs to features (this should
-                # only happen when data_dim = 2)
-                if data_dim == 2:
-                    feats, preds = model(inputs, True)
-                    features.append(feats.detach().cpu())
-                    predictions.append(preds.detach().cpu())
-
-            results[-1]["model_info"].append({
-                "type": model_config["type"],
-                "loss_history": loss_histories,
-                "epoch_loss_history": epoch_loss_histories,
-                "avg_time": (time.time() - start) / num_reps
-            })
-
-            if is_ode:
-                results[-1]["model_info"][-1]["epoch_nfe_history"] = epoch_nfe_histories
-
-            if data_dim == 2:
-                results[-1]["tensors"].append({
-                    "inputs": inputs.cpu(),
-                    "targets": targets.cpu(),
-                    "features": features,
-                    "predictions": predictions
-                })
-
-            results[-1]["models"].append(models)
+            # Train all reps of an ODE model at once as an ensemble
+            ensemble = is_ode and model_config.get("ensemble", False)
+            if ensemble:
+                print("{}/{} model, {} reps as ensemble".format(i + 1, len(model_configs), num_reps))
+                if seed is not None:
+                    seed_everything(cell_seed(seed, d, i))
+                reps = train_ensemble(device, data_dim, model_config,
+                                      training_config, data_loader, num_reps)
+            else:
+                for j in range(num_reps):
+                    print("{}/{} model, {}/{} rep".format(i + 1, len(model_configs), j + 1, num_reps))
+                    if seed is not None:
+                        seed_everything(cell_seed(seed, d, i, j))
+                    reps.append(train_rep(device, data_dim, model_config,
+                                          training_config, data_loader))
+
+            add_model_results(results[-1], model_config, reps, data_dim,
+                              inputs, targets,
+                              avg_time=(time.time() - start) / num_reps,
+                              shared_nfe=ensemble)
 
     return results
 
 
-def run_experiments_from_config(device, path_to_config):
+# Options of ODE model configs and of the training config which ensembles
+# (anode.ensemble.EnsembleODENet) do not support
+ENSEMBLE_UNSUPPORTED_OPTIONS = ('adjoint', 'compiled', 'checkpoint',
+                                'warm_start', 'partition', 'precision',
+                                'implicit_augment')
+
+
+def check_ensemble_config(model_config, training_config):
+    """Raises ValueError if model_config, trained as an ensemble, sets options
+    which ensembles do not support (instead of silently ignoring them)."""
+    options = [option for option in ENSEMBLE_UNSUPPORTED_OPTIONS
+               if model_config.get(option)]
+    regularization = training_config.get("regularization") or {}
+    if any(weight > 0 for weight in regularization.values()):
+        options.append("regularization")
+    if len(options):
+        raise ValueError("Options {} are not supported by ensembles, set "
+                         "\"ensemble\" to false to use them".format(options))
+
+
+def train_rep(device, data_dim, model_config, training_config, data_loader):
+    """Trains a single rep of a model configuration and returns the trained
+    model and the histories of its trainer.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    data_dim : int
+        Dimension of data.
+
+    model_config : dict
+
+    training_config : dict
+
+    data_loader : torch.utils.data.DataLoader or
+        experiments.dataloaders.DeviceDataLoader
+    """
+    is_ode = model_config["type"] == "odenet" or model_config["type"] == "anode"
+    if is_ode:
+        model = ode_model_from_config(device, data_dim, model_config)
+    else:
+        model = ResNet(data_dim, model_config["hidden_dim"],
+                       model_config["num_layers"])
+
+    model.to(device)
+
+    optimizer = torch.optim.Adam(model.parameters(), lr=model_config["lr"])
+
+    trainer = Trainer(model, optimizer, device,
+                      print_freq=training_config["print_freq"],
+                      record_freq=training_config["record_freq"],
+                      verbose=False,
+                      regularization=training_config.get("regularization") if is_ode else None,
+                      stopping=stopping_policies_from_config(training_config.get("stopping")))
+
+    trainer.train(data_loader, training_config["epochs"])
+    return model, trainer.histories
+
+
+def train_ensemble(device, data_dim, model_config, training_config,
+                   data_loader, num_reps):
+    """Trains the num_reps reps of an ODE model configuration at once as an
+    anode.ensemble.EnsembleODENet and returns a list with the trained model
+    and histories of every rep (see train_rep).
+
+    Parameters
+    ----------
+    device : torch.device
+
+    data_dim : int
+        Dimension of data.
+
+    model_config : dict
+
+    training_config : dict
+
+    data_loader : torch.utils.data.DataLoader or
+        experiments.dataloaders.DeviceDataLoader
+
+    num_reps : int
+    """
+    check_ensemble_config(model_config, training_config)
+    replicas = [ode_model_from_config(device, data_dim, model_config).to(device)
+                for _ in range(num_reps)]
+    model = EnsembleODENet(replicas).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=model_config["lr"])
+    trainer = Trainer(model, optimizer, device,
+                      print_freq=training_config["print_freq"],
+                      record_freq=training_config["record_freq"],
+                      verbose=False,
+                      stopping=stopping_policies_from_config(training_config.get("stopping")))
+    trainer.train(data_loader, training_config["epochs"])
+    replicas = model.unstack()
+    return [(replicas[j], trainer.replica_histories(j)) for j in range(num_reps)]
+
+
+def add_model_results(dataset_results, model_config, reps, data_dim, inputs,
+                      targets, avg_time, shared_nfe=False):
+    """Appends histories, models and (if data_dim is 2) learned features of
+    the reps of a model configuration to the results of a dataset.
+
+    Parameters
+    ----------
+    dataset_results : dict
+        Entry of the list returned by run_experiments.
+
+    model_config : dict
+
+    reps : list of tuples of model and dict
+        Trained model and histories of its trainer for every rep.
+
+    data_dim : int
+        Dimension of data.
+
+    inputs, targets : torch.Tensor
+        Batch used to visualize how models transform inputs to features.
+
+    avg_time : float
+        Average training time of a rep in seconds.
+
+    shared_nfe : bool
+        If True, reps were trained as an ensemble, so NFEs are those of the
+        solves shared by all reps rather than of every rep.
+    """
+    is_ode = model_config["type"] == "odenet" or model_config["type"] == "anode"
+    models = [model for model, _ in reps]
+    model_info = {
+        "type": model_config["type"],
+        "loss_history": [histories["loss_history"] for _, histories in reps],
+        "epoch_loss_history": [histories["epoch_loss_history"] for _, histories in reps],
+        "epoch_time_history": [histories["epoch_time_history"] for _, histories in reps],
+        "epoch_data_time_history": [histories["epoch_data_time_history"] for _, histories in reps],
+        "avg_time": avg_time,
+        # Reason for stopping and estimated savings of reps stopped early
+        "stop": [histories.get("stop") for _, histories in reps]
+    }
+
+    if is_ode:
+        model_info["epoch_nfe_history"] = [histories["epoch_nfe_history"] for _, histories in reps]
+        model_info["shared_nfe"] = shared_nfe
+        # Record solver so that wall-clock time can be compared across
+        # solvers
+        model_info["solver"] = models[-1].odeblock.solver.to_config()
+    dataset_results["model_info"].append(model_info)
+
+    # Record how models transform inputs to features (this should only
+    # happen when data_dim = 2)
+    if data_dim == 2:
+        features = []
+        predictions = []
+        for model in models:
+            device = next(model.parameters()).device
+            feats, preds = model(inputs.to(device), True)
+            features.append(feats.detach().cpu())
+            predictions.append(preds.detach().cpu())
+        dataset_results["tensors"].append({
+            "inputs": inputs.cpu(),
+            "targets": targets.cpu(),
+            "features": features,
+            "predictions": predictions
+        })
+
+    dataset_results["models"].append(models)
+
+
+def viz_batch(data_object, viz_batch_size):
+    """Returns a random batch of inputs and targets which will be used to
+    visualize how models transform inputs to features.
+
+    Parameters
+    ----------
+    data_object : torch.utils.data.Dataset
+
+    viz_batch_size : int
+    """
+    data_loader_viz = DataLoader(data_object, batch_size=viz_batch_size,
+                                 shuffle=True)
+    for batch in data_loader_viz:
+        break
+    inputs, targets = batch
+    return inputs, targets
+
+
+def cell_seed(seed, *indices):
+    """Returns a seed for a cell of the experiment grid (e.g. dataset index,
+    model index and rep), which only depends on seed and the indices.
+
+    Parameters
+    ----------
+    seed : int
+
+    indices : ints
+    """
+    key = '-'.join(str(index) for index in (seed,) + indices)
+    return int(hashlib.sha256(key.encode()).hexdigest()[:8], 16)
+
+
+def seed_everything(seed):
+    """Seeds the random number generators of python, numpy and torch."""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def ode_model_from_config(device, data_dim, model_config):
+    """Creates an ODENet from its specification in a config file.
+
+    Parameters
+    ----------
+    device : torch.device
+
+    data_dim : int
+        Dimension of data.
+
+    model_config : dict
+        Model configuration of type "odenet" or "anode".
+    """
+    if model_config["type"] == "odenet":
+        augment_dim = 0
+    else:
+        augment_dim = model_config["augment_dim"]
+
+    return ODENet(device, data_dim, model_config["hidden_dim"],
+                  augment_dim=augment_dim,
+                  time_dependent=model_config["time_dependent"],
+                  compiled=model_config.get("compiled", False),
+                  solver=model_config.get("solver"),
+                  checkpoint=model_config.get("checkpoint", False),
+                  warm_start=model_config.get("warm_start", False),
+                  partition=model_config.get("partition", False),
+                  precision=model_config.get("precision"),
+                  implicit_augment=model_config.get("implicit_augment", False))
+
+
+def dataset_from_config(data_dim, dataset, seed=None, cache=None):
+    """Creates a dataset from its specification in a config file.
+
+    Parameters
+    ----------
+    data_dim : int
+        Dimension of data.
+
+    dataset : dict
+        Specification of dataset. See the "datasets" entry of config.json.
+
+    seed : None or int
+        If not None, generates dataset from this seed (leaving the global
+        random number generators untouched), otherwise from the global random
+        number generator of torch.
+
+    cache : None or experiments.dataset_cache.DatasetCache
+        If not None (and seed is not None), loads dataset from cache if it
+        was generated before.
+    """
+    if dataset["type"] == "sphere":
+        cls = ConcentricSphere
+        params = {"dim": data_dim,
+                  "inner_range": dataset["inner_range"],
+                  "outer_range": dataset["outer_range"],
+                  "num_points_inner": dataset["num_points_inner"],
+                  "num_points_outer": dataset["num_points_outer"]}
+    elif dataset["type"] == "sine":
+        cls = ShiftedSines
+        params = {"dim": data_dim,
+                  "shift": dataset["shift"],
+                  "num_points_upper": dataset["num_points_lower"],
+                  "num_points_lower": dataset["num_points_upper"],
+                  "noise_scale": dataset["noise_scale"]}
+    else:
+        raise ValueError("Unknown dataset type {}".format(dataset["type"]))
+
+    if seed is None:
+        return cls(**params)
+    if cache is not None:
+        return cache.get(cls, seed, **params)
+    with seeded(seed):
+        return cls(**params)
+
+
+def run_experiments_from_config(device, path_to_config, num_workers=1):
     """Runs an experiment from a config file.
 
     Parameters
@@ -166,22 +402,51 @@ def run_experiments_from_config(device, path_to_config):
     device : torch.device
 
     path_to_config : string
+
+    num_workers : int
+        If larger than 1, trains the reps of the experiment in parallel on
+        num_workers CPU processes with experiments.scheduler (device is then
+        ignored).
     """
     with open(path_to_config, 'r') as f:
         config = json.load(f)
 
+    # Generated datasets are cached on disk if "dataset_cache" is true, or a
+    # dict specifying the "dir" and "max_bytes" of the cache
+    cache_config = config.get("dataset_cache", False)
+    dataset_cache = None
+    if cache_config:
+        cache_config = {} if cache_config is True else cache_config
+        dataset_cache = DatasetCache(cache_config.get("dir", DEFAULT_CACHE_DIR),
+                                     cache_config.get("max_bytes", 2 ** 32))
+
+    if num_workers > 1:
+        # Imported here as the scheduler itself imports this module
+        from experiments.scheduler import run_experiments_parallel
+        return run_experiments_parallel(data_dim=config["data_dim"],
+                                        viz_batch_size=config["viz_batch_size"],
+                                        num_reps=config["num_reps"],
+                                        datasets=config["datasets"],
+                                        model_configs=config["model_configs"],
+                                        training_config=config["training_config"],
+                                        num_workers=num_workers,
+                                        seed=config.get("seed", 0),
+                                        dataset_cache=dataset_cache)
+
     results = run_experiments(device, data_dim=config["data_dim"],
                               viz_batch_size=config["viz_batch_size"],
                               num_reps=config["num_reps"],
                               datasets=config["datasets"],
                               model_configs=config["model_configs"],
-                              training_config=config["training_config"])
+                              training_config=config["training_config"],
+                              seed=config.get("seed", 0),
+                              dataset_cache=dataset_cache)
 
     return results
 
 
 def run_and_save_experiments(device, path_to_config, save_models=False,
-                             save_tensors=False):
+                             save_tensors=False, num_workers=1):
     """Runs an experiment from a config file, saves logs and generates various
     plots of results.
 
@@ -197,6 +462,10 @@ def run_and_save_experiments(device, path_to_config, save_models=False,
 
     save_tensors : bool
         If True saves input and feature tensors used to produce figures.
+
+    num_workers : int
+        Number of CPU processes on which to train the reps of the experiment.
+        See run_experiments_from_config.
     """
     # Create a folder to store experiment results
     timestamp = time.strftime("%Y-%m-%d_%H-%M")
@@ -213,7 +482,7 @@ def run_and_save_experiments(device, path_to_config, save_models=False,
         json.dump(config, config_file)
 
     # Run experiments
-    results = run_experiments_from_config(device, path_to_config)
+    results = run_experiments_from_config(device, path_to_config, num_workers)
 
     # Create figures and save experiments
     for i in range(len(results)):
@@ -1,19 +1,21 @@
 import json
 import matplotlib
 matplotlib.use('Agg')  # This is hacky (useful for running on VMs)
-import numpy as np
 import os
 import time
 import torch
+from anode.distributed import broadcast_object, get_world_size, is_main_process
 from anode.models import ODENet
 from anode.conv_models import ConvODENet
 from anode.discrete_models import ResNet
+from anode.stopping import stopping_policies_from_config
+from anode.telemetry import SolverTelemetry
 from anode.training import Trainer
 from experiments.dataloaders import mnist, cifar10, tiny_imagenet
-from viz.plots import histories_plt
+from viz.plots import histories_plt, history_info_from_metrics
 
 
-def run_and_save_experiments_img(device, path_to_config):
+def run_and_save_experiments_img(device, path_to_config, distributed=False):
     """Runs and saves experiments as they are produced (so results are still
     saved even if NFEs become excessively large or underflow occurs).
 
@@ -23,6 +25,12 @@ def run_and_save_experiments_img(device, path_to_config):
 
     path_to_config : string
         Path to config json file.
+
+    distributed : bool
+        If True, every rep is trained with data parallelism over the processes
+        of the initialized process group (e.g. launched with torchrun, see
+        main_experiment_img.py). The batch size of the config is split between
+        processes, and only the main process saves results.
     """
     # Open config file
     with open(path_to_config) as config_file:
@@ -31,12 +39,17 @@ def run_and_save_experiments_img(device, path_to_config):
     # Create a folder to store experiment results
     timestamp = time.strftime("%Y-%m-%d_%H-%M")
     directory = "img_results_{}_{}".format(timestamp, config["id"])
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    # Save config file in experiment directory
-    with open(directory + '/config.json', 'w') as config_file:
-        json.dump(config, config_file)
+    is_main = is_main_process()
+    if distributed:
+        # Timestamps of processes can differ
+        directory = broadcast_object(directory)
+    if is_main:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Save config file in experiment directory
+        with open(directory + '/config.json', 'w') as config_file:
+            json.dump(config, config_file)
 
     num_reps = config["num_reps"]
     dataset = config["dataset"]
@@ -45,18 +58,28 @@ def run_and_save_experiments_img(device, path_to_config):
 
     results = {"dataset": dataset, "model_info": []}
 
+    # Batch size of every process, so that the batch size of a step is the
+    # same as without distributed training
+    batch_size = training_config["batch_size"] // get_world_size()
+
     if dataset == 'mnist':
-        data_loader, test_loader = mnist(training_config["batch_size"])
+        data_loader, test_loader = mnist(batch_size, distributed=distributed,
+                                         in_memory=training_config.get("in_memory", False))
         img_size = (1, 28, 28)
         output_dim = 10
 
     if dataset == 'cifar10':
-        data_loader, test_loader = cifar10(training_config["batch_size"])
+        data_loader, test_loader = cifar10(batch_size, distributed=distributed,
+                                           in_memory=training_config.get("in_memory", False))
         img_size = (3, 32, 32)
         output_dim = 10
 
     if dataset == 'imagenet':
-        data_loader = tiny_imagenet(training_config["batch_size"])
+        # Decoding JPEGs is slow, use preprocessed shards if available (see
+        # experiments.tiny_imagenet_shards)
+        data_loader = tiny_imagenet(batch_size, distributed=distributed,
+                                    path_to_shards=training_config.get("imagenet_shards"),
+                                    num_workers=training_config.get("num_workers", 0))
         img_size = (3, 64, 64)
         output_dim = 200
 
@@ -73,6 +96,11 @@ def run_and_save_experiments_img(device, path_to_config):
         epoch_nfe_histories = []
         epoch_bnfe_histories = []
         epoch_total_nfe_histories = []
+        # Keep track of wall-clock training time of each rep
+        train_times = []
+        # Keep track of rollbacks to checkpoints after solver failures
+        retries = []
+        stops = []
         # Keep track of models potentially failing
         model_stats = {
             "exceeded": {"count": 0, "final_losses": [], "final_nfes": [],
@@ -85,11 +113,15 @@ def run_and_save_experiments_img(device, path_to_config):
 
         if model_config["validation"]:
             epoch_loss_val_histories = []
+            epoch_accuracy_val_histories = []
 
         is_ode = model_config["type"] == "odenet" or model_config["type"] == "anode"
+        # One of "adjoint", "checkpoint" or "direct"
+        gradient = model_config.get("gradient", "adjoint")
 
         for j in range(num_reps):
-            print("{}/{} model, {}/{} rep".format(i + 1, len(model_configs), j + 1, num_reps))
+            if is_main:
+                print("{}/{} model, {}/{} rep".format(i + 1, len(model_configs), j + 1, num_reps))
 
             if is_ode:
                 if model_config["type"] == "odenet":
@@ -102,7 +134,14 @@ def run_and_save_experiments_img(device, path_to_config):
                                    augment_dim=augment_dim,
                                    time_dependent=model_config["time_dependent"],
                                    non_linearity=model_config["non_linearity"],
-                                   adjoint=True)
+                                   adjoint=gradient == "adjoint",
+                                   solver=model_config.get("solver"),
+                                   checkpoint=gradient == "checkpoint",
+                                   warm_start=model_config.get("warm_start", False),
+                                   partition=model_config.get("partition", False),
+                                   precision=model_config.get("precision"),
+                                   implicit_augment=model_config.get("implicit_augment", False),
+                                   fused=model_config.get("fused", False))
             else:
                 model = ResNet(data_dim, model_config["hidden_dim"],
                                model_config["num_layers"],
@@ -111,6 +150,15 @@ def run_and_save_experiments_img(device, path_to_config):
 
             model.to(device)
 
+            # Stream solver statistics of every iteration, to diagnose NFE
+            # blow ups without rerunning. "steps" also records solver steps,
+            # by solving with RungeKuttaSolver
+            telemetry = model_config.get("telemetry", False)
+            if is_ode and telemetry and is_main:
+                model.odeblock.attach_telemetry(SolverTelemetry(
+                    jsonl_path=directory + '/telemetry_{}_{}.jsonl'.format(i, j),
+                    solver_steps=telemetry == "steps"))
+
             optimizer = torch.optim.Adam(model.parameters(),
                                          lr=model_config["lr"],
                                          weight_decay=model_config["weight_decay"])
@@ -120,7 +168,16 @@ def run_and_save_experiments_img(device, path_to_config):
                               print_freq=training_config["print_freq"],
                               record_freq=training_config["record_freq"],
                               verbose=True,
-                              save_dir=(directory, '{}_{}'.format(i, j)))
+                              save_dir=(directory, '{}_{}'.format(i, j)),
+                              regularization=training_config.get("regularization") if is_ode else None,
+                              checkpoint_freq=training_config.get("checkpoint_freq", 0),
+                              checkpoint_keep=training_config.get("checkpoint_keep", 2),
+                              max_retries=training_config.get("max_retries", 0),
+                              retry_tol_factor=training_config.get("retry_tol_factor", 1.),
+                              retry_lr_factor=training_config.get("retry_lr_factor", 1.),
+                              stopping=stopping_policies_from_config(training_config.get("stopping")),
+                              planned_epochs=training_config["epochs"],
+                              distributed=distributed)
 
             loss_histories.append([])
             epoch_loss_histories.append([])
@@ -130,18 +187,26 @@ def run_and_save_experiments_img(device, path_to_config):
             epoch_bnfe_histories.append([])
             total_nfe_histories.append([])
             epoch_total_nfe_histories.append([])
+            train_times.append(0.)
+            retries.append(0)
+            stops.append(None)
 
             if model_config["validation"]:
                 epoch_loss_val_histories.append([])
+                epoch_accuracy_val_histories.append([])
 
             # Train one epoch at a time, as NODEs can underflow or exceed the
             # maximum NFEs
             for epoch in range(training_config["epochs"]):
-                print("\nEpoch {}".format(epoch + 1))
+                if is_main:
+                    print("\nEpoch {}".format(epoch + 1))
+                start = time.time()
                 try:
                     trainer.train(data_loader, 1)
                     end_training = False
                 except AssertionError as e:
+                    # In distributed training, every process raises if the
+                    # solver failed on any of them
                     only_success = False
                     # Assertion error means we either underflowed or exceeded
                     # the maximum number of steps
@@ -160,30 +225,26 @@ def run_and_save_experiments_img(device, path_to_config):
 
                     model_stats[file_name_root]["count"] += 1
 
-                    if len(trainer.buffer['loss']):
-                        final_loss = np.mean(trainer.buffer['loss'])
-                    else:
-                        final_loss = None
+                    final_loss = trainer.buffer_mean('loss')
                     model_stats[file_name_root]["final_losses"].append(final_loss)
 
-                    if len(trainer.buffer['nfe']):
-                        final_nfes = np.mean(trainer.buffer['nfe'])
-                    else:
-                        final_nfes = None
+                    final_nfes = trainer.buffer_mean('nfe')
                     model_stats[file_name_root]["final_nfes"].append(final_nfes)
 
-                    if len(trainer.buffer['bnfe']):
-                        final_bnfes = np.mean(trainer.buffer['bnfe'])
-                    else:
-                        final_bnfes = None
+                    final_bnfes = trainer.buffer_mean('bnfe')
                     model_stats[file_name_root]["final_bnfes"].append(final_bnfes)
 
                     # Save final NFEs before error happened
-                    with open(directory + '/{}_{}_{}.json'.format(file_name_root, i, j), 'w') as f:
-                        json.dump({"forward": trainer.nfe_buffer, "backward": trainer.bnfe_buffer}, f)
+                    if is_main:
+                        with open(directory + '/{}_{}_{}.json'.format(file_name_root, i, j), 'w') as f:
+                            json.dump({"forward": trainer.buffer['nfe'], "backward": trainer.buffer['bnfe']}, f)
 
                     end_training = True
 
+                train_times[-1] += time.time() - start
+                retries[-1] = trainer.retries
+                stops[-1] = trainer.histories.get('stop')
+
                 # Save info at every epoch
                 loss_histories[-1] = trainer.histories['loss_history']
                 epoch_loss_histories[-1] = trainer.histories['epoch_loss_history']
@@ -196,17 +257,23 @@ def run_and_save_experiments_img(device, path_to_config):
                     epoch_total_nfe_histories[-1] = trainer.histories['epoch_total_nfe_history']
 
                 if model_config["validation"]:
-                    epoch_loss_val = dataset_mean_loss(trainer, test_loader, device)
-                    if epoch == 0:
-                        epoch_loss_val_histories[-1] = [epoch_loss_val]
-                    else:
-                        epoch_loss_val_histories[-1].append(epoch_loss_val)
+                    # Validation is gradient free, so uses larger batches
+                    # (and optionally looser tolerances) than training
+                    evaluation = trainer.evaluate(test_loader,
+                                                  batch_size=training_config.get("eval_batch_size"),
+                                                  tol=training_config.get("eval_tol"))
+                    epoch_loss_val_histories[-1].append(evaluation["loss"])
+                    epoch_accuracy_val_histories[-1].append(evaluation["accuracy"])
 
                 results["model_info"][-1]["type"] = model_config["type"]
                 results["model_info"][-1]["loss_history"] = loss_histories
                 results["model_info"][-1]["epoch_loss_history"] = epoch_loss_histories
+                results["model_info"][-1]["train_time"] = train_times
+                results["model_info"][-1]["retries"] = retries
+                results["model_info"][-1]["stop"] = stops
                 if model_config["validation"]:
                     results["model_info"][-1]["epoch_loss_val_history"] = epoch_loss_val_histories
+                    results["model_info"][-1]["epoch_accuracy_val_history"] = epoch_accuracy_val_histories
 
                 if is_ode:
                     results["model_info"][-1]["epoch_nfe_history"] = epoch_nfe_histories
@@ -215,42 +282,55 @@ def run_and_save_experiments_img(device, path_to_config):
                     results["model_info"][-1]["bnfe_history"] = bnfe_histories
                     results["model_info"][-1]["epoch_total_nfe_history"] = epoch_total_nfe_histories
                     results["model_info"][-1]["total_nfe_history"] = total_nfe_histories
+                    results["model_info"][-1]["solver"] = model.odeblock.solver.to_config()
 
                 # Save losses and nfes at every epoch
-                with open(directory + '/losses_and_nfes.json', 'w') as f:
-                    json.dump(results['model_info'], f)
+                if is_main:
+                    with open(directory + '/losses_and_nfes.json', 'w') as f:
+                        json.dump(results['model_info'], f)
 
                 # If training failed, move on to next rep
                 if end_training:
                     break
 
+                stopped = trainer.stop_reason is not None
+                if stopped:
+                    # Histories of reps stopped early are shorter, so their
+                    # mean cannot be plotted
+                    only_success = False
+
                 # If we reached end of training, increment success counter
-                if epoch == training_config["epochs"] - 1:
+                if epoch == training_config["epochs"] - 1 or stopped:
                     model_stats["success"]["count"] += 1
 
-                    if len(trainer.buffer['loss']):
-                        final_loss = np.mean(trainer.buffer['loss'])
-                    else:
-                        final_loss = None
+                    final_loss = trainer.buffer_mean('loss')
                     model_stats["success"]["final_losses"].append(final_loss)
 
-                    if len(trainer.buffer['nfe']):
-                        final_nfes = np.mean(trainer.buffer['nfe'])
-                    else:
-                        final_nfes = None
+                    final_nfes = trainer.buffer_mean('nfe')
                     model_stats["success"]["final_nfes"].append(final_nfes)
 
-                    if len(trainer.buffer['bnfe']):
-                        final_bnfes = np.mean(trainer.buffer['bnfe'])
-                    else:
-                        final_bnfes = None
+                    final_bnfes = trainer.buffer_mean('bnfe')
                     model_stats["success"]["final_bnfes"].append(final_bnfes)
 
+                if stopped:
+                    break
+
+            # Write remaining metrics of rep
+            trainer.close()
+
         # Save model stats
-        with open(directory + '/model_stats{}.json'.format(i), 'w') as f:
-            json.dump(model_stats, f)
+        if is_main:
+            with open(directory + '/model_stats{}.json'.format(i), 'w') as f:
+                json.dump(model_stats, f)
+
+    if not is_main:
+        return
 
-    # Create plots
+    # Create plots from the metrics files written by the trainer of every rep
+    all_history_info = [
+        history_info_from_metrics(model_config["type"],
+                                  [directory + '/metrics{}_{}.jsonl'.format(i, j) for j in range(num_reps)])
+        for i, model_config in enumerate(model_configs)]
 
     # Extract size of augmented dims
     augment_labels = ['p = 0' if model_config['type'] == 'odenet' else 'p = {}'.format(model_config['augment_dim'])
@@ -258,9 +338,9 @@ def run_and_save_experiments_img(device, path_to_config):
     # Create losses figure
     # Note that we can only calculate mean loss if all models trained to
     # completion. Therefore we only include mean if only_success is True
-    histories_plt(results["model_info"], plot_type='loss', labels=augment_labels,
+    histories_plt(all_history_info, plot_type='loss', labels=augment_labels,
                   include_mean=only_success, save_fig=directory + '/losses.png')
-    histories_plt(results["model_info"], plot_type='loss', labels=augment_labels,
+    histories_plt(all_history_info, plot_type='loss', labels=augment_labels,
                   include_mean=only_success, shaded_err=True, save_fig=directory + '/losses_shaded.png')
 
     # Create NFE plots if ODE model is included
@@ -271,20 +351,21 @@ def run_and_save_experiments_img(device, path_to_config):
             break
 
     if contains_ode:
-        # If adjoint method was used, plot forwards, backwards and total nfes
-        if trainer.model.odeblock.adjoint:
+        # If adjoint method or checkpointing was used, plot forwards, backwards
+        # and total nfes
+        if trainer.model.odeblock.adjoint or trainer.model.odeblock.checkpoint:
             nfe_types = ['nfe', 'bnfe', 'total_nfe']
         else:
             nfe_types = ['nfe']
 
         for nfe_type in nfe_types:
-            histories_plt(results["model_info"], plot_type='nfe', labels=augment_labels,
+            histories_plt(all_history_info, plot_type='nfe', labels=augment_labels,
                           include_mean=only_success, nfe_type=nfe_type,
                           save_fig=directory + '/{}s.png'.format(nfe_type))
-            histories_plt(results["model_info"], plot_type='nfe', labels=augment_labels,
+            histories_plt(all_history_info, plot_type='nfe', labels=augment_labels,
                           include_mean=only_success, shaded_err=True, nfe_type=nfe_type,
                           save_fig=directory + '/{}s_shaded.png'.format(nfe_type))
-            histories_plt(results["model_info"], plot_type='nfe_vs_loss', labels=augment_labels,
+            histories_plt(all_history_info, plot_type='nfe_vs_loss', labels=augment_labels,
                           include_mean=only_success, nfe_type=nfe_type,
                           save_fig=directory + '/{}_vs_loss.png'.format(nfe_type))
 
@@ -301,12 +382,6 @@ def dataset_mean_loss(trainer, data_loader, device):
     data_loader : torch.utils.data.DataLoader
 
     device : torch.device
+        Unused, data is moved to the device of trainer.
     """
-    epoch_loss = 0.
-    for x_batch, y_batch in data_loader:
-        x_batch = x_batch.to(device)
-        y_batch = y_batch.to(device)
-        y_pred = trainer.model(x_batch)
-        loss = trainer._loss(y_pred, y_batch)
-        epoch_loss += loss.item()
-    return epoch_loss / len(data_loader)
+    return trainer.evaluate(data_loader)["loss"]
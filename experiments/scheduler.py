@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import time
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from experiments.dataloaders import DeviceDataLoader
+from experiments.experiments import (add_model_results, cell_seed,
+                                     dataset_from_config, seed_everything,
+                                     train_ensemble, train_rep, viz_batch)
+
+# Datasets and configurations of the experiment, set in every worker process
+_worker_state = {}
+
+
+def run_experiments_parallel(data_dim=2, viz_batch_size=512, num_reps=5,
+                             datasets=[], model_configs=[], training_config={},
+                             num_workers=None, threads_per_worker=None, seed=0,
+                             dataset_cache=None):
+    """Runs the same experiments as experiments.experiments.run_experiments on
+    CPU, but trains every cell of the grid (dataset, model configuration, rep)
+    as a separate job on a pool of worker processes, and returns results in
+    the same format.
+
+    Every cell is seeded with experiments.experiments.cell_seed, so results do
+    not depend on the number of workers and match run_experiments with the
+    same seed. Datasets are generated once in the main process and sent to the
+    workers. All reps of an ensemble model configuration are trained together
+    as a single job, as in run_experiments.
+
+    Parameters
+    ----------
+    data_dim, viz_batch_size, num_reps, datasets, model_configs,
+    training_config :
+        See experiments.experiments.run_experiments.
+
+    num_workers : None or int
+        Number of worker processes. If None, uses the number of CPUs.
+
+    threads_per_worker : None or int
+        Number of intra-op threads of torch in every worker. If None, divides
+        the CPUs evenly between workers, so workers do not oversubscribe the
+        CPU.
+
+    seed : int
+        Seed from which the seed of every dataset and cell is derived.
+
+    dataset_cache : None or experiments.dataset_cache.DatasetCache
+        If not None, datasets generated before with the same specification and
+        seed are loaded from this cache.
+    """
+    num_cpus = os.cpu_count() or 1
+    if num_workers is None:
+        num_workers = num_cpus
+    if threads_per_worker is None:
+        threads_per_worker = max(1, num_cpus // num_workers)
+
+    data_objects = []
+    viz_batches = []
+    for d, dataset in enumerate(datasets):
+        seed_everything(cell_seed(seed, d))
+        data_objects.append(dataset_from_config(data_dim, dataset,
+                                                seed=cell_seed(seed, d),
+                                                cache=dataset_cache))
+        viz_batches.append(viz_batch(data_objects[-1], viz_batch_size))
+
+    # Cells of ensemble model configurations train all reps (rep None)
+    cells = []
+    for d in range(len(datasets)):
+        for i, model_config in enumerate(model_configs):
+            if _is_ensemble(model_config):
+                cells.append((d, i, None))
+            else:
+                cells.extend((d, i, j) for j in range(num_reps))
+
+    start = time.time()
+    # Spawn (rather than fork) workers, as forking a process which already
+    # uses torch threads is unsafe
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(data_objects, data_dim, model_configs,
+                                       training_config, num_reps, seed,
+                                       threads_per_worker)) as executor:
+        cell_results = dict(zip(cells, executor.map(_run_cell, cells)))
+    wall_time = time.time() - start
+
+    results = []
+    for d, dataset in enumerate(datasets):
+        results.append({"dataset": dataset, "model_info": [], "tensors": [],
+                        "models": []})
+        inputs, targets = viz_batches[d]
+        for i, model_config in enumerate(model_configs):
+            if _is_ensemble(model_config):
+                reps, cell_time = cell_results[(d, i, None)]
+            else:
+                reps = [cell_results[(d, i, j)][0][0] for j in range(num_reps)]
+                cell_time = sum(cell_results[(d, i, j)][1] for j in range(num_reps))
+            add_model_results(results[-1], model_config, reps, data_dim,
+                              inputs, targets, avg_time=cell_time / num_reps,
+                              shared_nfe=_is_ensemble(model_config))
+
+    # Cells sharing the CPU run slower than alone, so this overestimates the
+    # speedup (benchmarks.experiment_scheduler measures it)
+    total_cell_time = sum(cell_time for _, cell_time in cell_results.values())
+    print("Trained {} cells on {} workers ({} threads each) in {:.1f}s, "
+          "{:.1f}s of training in total (estimated {:.2f}x speedup, see "
+          "benchmarks.experiment_scheduler for a measurement)".format(
+              len(cells), num_workers, threads_per_worker, wall_time,
+              total_cell_time, total_cell_time / wall_time))
+    return results
+
+
+def _is_ensemble(model_config):
+    return model_config["type"] in ("odenet", "anode") and \
+        model_config.get("ensemble", False)
+
+
+def _init_worker(data_objects, data_dim, model_configs, training_config,
+                 num_reps, seed, threads_per_worker):
+    """Initializes a worker process of run_experiments_parallel."""
+    torch.set_num_threads(threads_per_worker)
+    _worker_state.update({"data_objects": data_objects, "data_dim": data_dim,
+                          "model_configs": model_configs,
+                          "training_config": training_config,
+                          "num_reps": num_reps, "seed": seed})
+
+
+def _run_cell(cell):
+    """Trains rep j of model configuration i on dataset d (all reps as an
+    ensemble if j is None) and returns a list with the trained model and the
+    histories of its trainer for every rep trained, and the training time."""
+    d, i, j = cell
+    device = torch.device('cpu')
+    training_config = _worker_state["training_config"]
+    model_config = _worker_state["model_configs"][i]
+    indices = (d, i) if j is None else (d, i, j)
+    seed_everything(cell_seed(_worker_state["seed"], *indices))
+    data_loader = DeviceDataLoader(_worker_state["data_objects"][d],
+                                   batch_size=training_config["batch_size"],
+                                   device=device, shuffle=True)
+    start = time.time()
+    if j is None:
+        reps = train_ensemble(device, _worker_state["data_dim"], model_config,
+                              training_config, data_loader,
+                              _worker_state["num_reps"])
+    else:
+        reps = [train_rep(device, _worker_state["data_dim"], model_config,
+                          training_config, data_loader)]
+    return reps, time.time() - start
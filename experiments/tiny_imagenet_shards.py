@@ -0,0 +1,120 @@
+"""Packs the Tiny ImageNet train and val sets into memory mapped uint8 shards
+of shape (num_images, 64, 64, 3), read by
+experiments.dataloaders.TinyImageNetShards. JPEGs are decoded once, in
+parallel, instead of at every epoch.
+
+Usage:
+
+    python -m experiments.tiny_imagenet_shards <path_to_data> <shard_folder> [num_workers]
+
+The shard folder contains, for every split, the shards <split>_<k>.npy, the
+labels <split>_labels.npy (int64) and an index.json describing the shards and
+class names (WordNet ids, sorted as by experiments.dataloaders.TinyImageNet).
+"""
+import glob
+import json
+import os
+import sys
+import imageio
+import numpy as np
+from multiprocessing import Pool
+
+IMG_SHAPE = (64, 64, 3)
+
+
+def image_paths_and_labels(root_folder, split):
+    """Returns class names and lists of image paths and labels of a split.
+
+    Parameters
+    ----------
+    root_folder : string
+        Root folder of Tiny ImageNet dataset.
+
+    split : string
+        One of 'train' and 'val'.
+    """
+    class_folders = sorted(glob.glob(os.path.join(root_folder, 'train', '*')))
+    classes = [os.path.basename(class_folder) for class_folder in class_folders]
+    class_ids = {name: i for i, name in enumerate(classes)}
+    paths, labels = [], []
+    if split == 'train':
+        for i, class_folder in enumerate(class_folders):
+            class_paths = sorted(glob.glob(os.path.join(class_folder, 'images', '*.JPEG')))
+            paths.extend(class_paths)
+            labels.extend([i] * len(class_paths))
+    else:
+        # Classes of validation images are listed in val_annotations.txt
+        with open(os.path.join(root_folder, split, split + '_annotations.txt')) as f:
+            for line in f:
+                file_name, wnid = line.split('\t')[:2]
+                paths.append(os.path.join(root_folder, split, 'images', file_name))
+                labels.append(class_ids[wnid])
+    return classes, paths, labels
+
+
+def decode_image(path):
+    """Returns image as uint8 array of shape (64, 64, 3)."""
+    img = np.asarray(imageio.imread(path), dtype=np.uint8)
+    # Some images are grayscale, convert to RGB
+    if img.ndim == 2:
+        img = np.repeat(img[:, :, None], 3, axis=2)
+    return img
+
+
+def pack_tiny_imagenet(root_folder, shard_folder, splits=('train', 'val'),
+                       shard_size=20000, num_workers=None):
+    """Decodes the images of splits and writes them to shards.
+
+    Parameters
+    ----------
+    root_folder : string
+        Root folder of Tiny ImageNet dataset.
+
+    shard_folder : string
+        Output folder, created if it does not exist.
+
+    splits : tuple of strings
+
+    shard_size : int
+        Maximum number of images of a shard.
+
+    num_workers : None or int
+        Number of processes decoding JPEGs. If None, uses the number of CPUs.
+    """
+    os.makedirs(shard_folder, exist_ok=True)
+    index = {"image_shape": list(IMG_SHAPE), "splits": {}}
+    with Pool(num_workers) as pool:
+        for split in splits:
+            classes, paths, labels = image_paths_and_labels(root_folder, split)
+            index["classes"] = classes
+            shards = []
+            for k, start in enumerate(range(0, len(paths), shard_size)):
+                shard_paths = paths[start:start + shard_size]
+                file_name = '{}_{}.npy'.format(split, k)
+                # Write to temporary file and rename, so that an interrupted
+                # run never leaves a partial shard
+                tmp_path = os.path.join(shard_folder, file_name + '.tmp')
+                shard = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                                  shape=(len(shard_paths),) + IMG_SHAPE)
+                for i, img in enumerate(pool.imap(decode_image, shard_paths, chunksize=64)):
+                    shard[i] = img
+                shard.flush()
+                del shard
+                os.replace(tmp_path, os.path.join(shard_folder, file_name))
+                shards.append({"file": file_name, "num_images": len(shard_paths)})
+                print("{}: packed {}/{} images".format(split, start + len(shard_paths), len(paths)))
+            labels_file = '{}_labels.npy'.format(split)
+            np.save(os.path.join(shard_folder, labels_file), np.array(labels, dtype=np.int64))
+            index["splits"][split] = {"shards": shards, "labels": labels_file,
+                                      "num_images": len(paths)}
+    # Index is written last, so it only exists once all shards are complete
+    with open(os.path.join(shard_folder, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        raise(RuntimeError("Wrong arguments, use python -m experiments.tiny_imagenet_shards "
+                           "<path_to_data> <shard_folder> [num_workers]"))
+    pack_tiny_imagenet(sys.argv[1], sys.argv[2],
+                       num_workers=int(sys.argv[3]) if len(sys.argv) == 4 else None)
@@ -4,9 +4,12 @@ from experiments.experiments import run_and_save_experiments
 
 device = torch.device('cpu')
 
-# Get config file from command line arguments
-if len(sys.argv) != 2:
-    raise(RuntimeError("Wrong arguments, use python main_experiment.py <path_to_config>"))
+# Get config file (and optionally number of worker processes) from command
+# line arguments
+if len(sys.argv) not in (2, 3):
+    raise(RuntimeError("Wrong arguments, use python main_experiment.py <path_to_config> [<num_workers>]"))
 config_path = sys.argv[1]
+num_workers = int(sys.argv[2]) if len(sys.argv) == 3 else 1
 
-run_and_save_experiments(device, config_path)
+if __name__ == '__main__':
+    run_and_save_experiments(device, config_path, num_workers=num_workers)
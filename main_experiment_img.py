@@ -1,12 +1,25 @@
+import os
 import sys
 import torch
+from anode.distributed import init_distributed
 from experiments.experiments_img import run_and_save_experiments_img
 
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
 # Get config file from command line arguments
 if len(sys.argv) != 2:
-    raise(RuntimeError("Wrong arguments, use python main_experiment.py <path_to_config>"))
+    raise(RuntimeError("Wrong arguments, use python main_experiment_img.py <path_to_config>"))
 config_path = sys.argv[1]
 
-run_and_save_experiments_img(device, config_path)
+# When launched with torchrun (e.g. torchrun --nproc_per_node=4
+# main_experiment_img.py config_img.json), train with data parallelism over
+# processes on CPU
+distributed = "WORLD_SIZE" in os.environ and int(os.environ["WORLD_SIZE"]) > 1
+if distributed:
+    init_distributed('gloo')
+    device = torch.device('cpu')
+    # Divide the CPUs of the machine between the local processes
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+else:
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+run_and_save_experiments_img(device, config_path, distributed=distributed)
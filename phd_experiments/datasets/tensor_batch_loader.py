@@ -0,0 +1,58 @@
+from typing import Optional, Tuple
+
+import torch
+from torch.utils.data import Dataset, Subset
+
+
+class TensorBatchLoader:
+    """
+    Drop-in replacement for torch.utils.data.DataLoader over datasets whose samples are rows of X/Y tensors
+    (e.g. ToyODE, TorchBostonHousingPrices, ToyRelu, ToyLinearDataSet1, TorchDiabetesDataset).
+    Every batch is one slice view (no shuffle) or one index_select gather (shuffle) of the X/Y tensors,
+    instead of one __getitem__ call per sample followed by default collate.
+    If shuffle is True, the permutation of every epoch is drawn from a torch.Generator seeded with seed,
+    or from the global torch RNG if seed is None (as DataLoader does).
+    """
+
+    def __init__(self, X: torch.Tensor, Y: torch.Tensor, batch_size: int = 1, shuffle: bool = False,
+                 drop_last: bool = False, seed: Optional[int] = None):
+        assert X.size()[0] == Y.size()[0], f"X and Y must have the same number of samples, " \
+                                           f"got {X.size()[0]} and {Y.size()[0]}"
+        self.X = X
+        self.Y = Y
+        self.N = X.size()[0]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = None if seed is None else torch.Generator().manual_seed(seed)
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset, batch_size: int = 1, shuffle: bool = False, drop_last: bool = False,
+                     seed: Optional[int] = None) -> "TensorBatchLoader":
+        """
+        Gathers the X/Y tensors of dataset (or of a Subset, e.g. from random_split) once, with a single
+        vectorized dataset[indices] call, so any dataset whose __getitem__ is X[idx], Y[idx] is supported
+        """
+        X, Y = cls._gather(dataset, torch.arange(len(dataset)))
+        return cls(X=X, Y=Y, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+
+    @staticmethod
+    def _gather(dataset: Dataset, indices: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        if isinstance(dataset, Subset):
+            return TensorBatchLoader._gather(dataset.dataset, torch.as_tensor(dataset.indices)[indices])
+        return dataset[indices]
+
+    def __iter__(self):
+        if self.shuffle:
+            perm = torch.randperm(self.N, generator=self.generator).to(self.X.device)
+            for start in range(0, len(self) * self.batch_size, self.batch_size):
+                idx = perm[start:start + self.batch_size]
+                yield self.X.index_select(0, idx), self.Y.index_select(0, idx)
+        else:
+            for start in range(0, len(self) * self.batch_size, self.batch_size):
+                yield self.X[start:start + self.batch_size], self.Y[start:start + self.batch_size]
+
+    def __len__(self):
+        if self.drop_last:
+            return self.N // self.batch_size
+        return (self.N + self.batch_size - 1) // self.batch_size
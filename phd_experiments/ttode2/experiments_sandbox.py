@@ -92,6 +92,8 @@ from torchviz import make_dot
 from tqdm import tqdm
 import random
 from phd_experiments.ttode2.models import TensorTrainFixedRank
+from experiments.dataset_cache import DatasetCache
+from phd_experiments.datasets.tensor_batch_loader import TensorBatchLoader
 
 
 class FVDP_Trajectory_Model(torch.nn.Module):
@@ -767,9 +769,20 @@ def tt_opt_block(model, X_train, Y_train, optim, loss_func):
     # return loss.item()
 
 
+def get_data_set(dataset_cache, cls, seed: int, **params):
+    """
+    Returns cls(**params), from dataset_cache (generated with seed) if dataset_cache is not None
+    """
+    if dataset_cache is None:
+        return cls(**params)
+    return dataset_cache.get(cls, seed=seed, **params)
+
+
 LOG_FORMAT = "[%(filename)s:%(lineno)s - %(funcName)10s()] %(asctime)s %(levelname)s %(message)s"
 DATE_TIME_FORMAT = "%Y-%m-%d:%H:%M:%S"
 SEEDS = [42, 18819191, 71623183, 71623183, 12345, 54321, 987654321]
+# cache generated datasets on disk (keyed by class, params and seed)
+USE_DATASET_CACHE = False
 if __name__ == '__main__':
     ### set logging configs
     pd.set_option('display.max_rows', None)
@@ -889,12 +902,15 @@ if __name__ == '__main__':
     ### data #####
     # data_set = ToyData1(input_dim=input_dim,N=N_samples_data)
     # train_data_set = SimplePolynomial(N=N_train, A_true=true_A, x_gen_norm=x_gen_norm_mean, x_gen_std=x_gen_norm_std)
-    # train_data_set = FVDP(mio=vdp_mio, a=vdp_a, omega=vdp_omega, N=N_train,
-    #                       x_gen_norm_mean=x_gen_norm_mean,
-    #                       x_gen_norm_std=x_gen_norm_std,
-    #                       train_or_test="train")
-    train_data_set = LorenzSystem(N=N_train, rho=rho, sigma=sigma, beta=beta, x_gen_norm_mean=x_gen_norm_mean,
-                                  x_gen_norm_std=x_gen_norm_std, train_or_test="train")
+    # generated datasets can be cached on disk, keyed by class, params and seed (train and test use different seeds)
+    dataset_cache = DatasetCache() if USE_DATASET_CACHE else None
+    # train_data_set = get_data_set(dataset_cache, FVDP, seed=SEED, mio=vdp_mio, a=vdp_a, omega=vdp_omega, N=N_train,
+    #                                    x_gen_norm_mean=x_gen_norm_mean,
+    #                                    x_gen_norm_std=x_gen_norm_std,
+    #                                    train_or_test="train")
+    train_data_set = get_data_set(dataset_cache, LorenzSystem, seed=SEED, N=N_train, rho=rho, sigma=sigma, beta=beta,
+                                  x_gen_norm_mean=x_gen_norm_mean, x_gen_norm_std=x_gen_norm_std,
+                                  train_or_test="train")
     if isinstance(train_data_set, FVDP):
         assert input_dim == 3
         assert output_dim == 2
@@ -904,16 +920,17 @@ if __name__ == '__main__':
     elif isinstance(train_data_set, SimplePolynomial):
         assert input_dim == 2
         assert output_dim == 2
-    train_data_loader = DataLoader(dataset=train_data_set, batch_size=batch_size, shuffle=True)
+    train_data_loader = TensorBatchLoader.from_dataset(dataset=train_data_set, batch_size=batch_size, shuffle=True)
     #test_data_set = SimplePolynomial(N=N_test, A_true=true_A, x_gen_norm=x_gen_norm_mean, x_gen_std=x_gen_norm_std)
-    # test_data_set = FVDP(mio=vdp_mio, a=vdp_a, omega=vdp_omega, N=N_test,
-    #                      x_gen_norm_mean=x_gen_norm_mean,
-    #                      x_gen_norm_std=x_gen_norm_std,
-    #                      train_or_test="test")
-
-    test_data_set = LorenzSystem(N=N_test, rho=rho, sigma=sigma, beta=beta, x_gen_norm_mean=x_gen_norm_mean,
-                                 x_gen_norm_std=x_gen_norm_std, train_or_test="test")
-    test_data_loader = DataLoader(dataset=test_data_set, batch_size=batch_size, shuffle=True)
+    # test_data_set = get_data_set(dataset_cache, FVDP, seed=SEED + 1, mio=vdp_mio, a=vdp_a, omega=vdp_omega, N=N_test,
+    #                                   x_gen_norm_mean=x_gen_norm_mean,
+    #                                   x_gen_norm_std=x_gen_norm_std,
+    #                                   train_or_test="test")
+
+    test_data_set = get_data_set(dataset_cache, LorenzSystem, seed=SEED + 1, N=N_test, rho=rho, sigma=sigma, beta=beta,
+                                 x_gen_norm_mean=x_gen_norm_mean, x_gen_norm_std=x_gen_norm_std,
+                                 train_or_test="test")
+    test_data_loader = TensorBatchLoader.from_dataset(dataset=test_data_set, batch_size=batch_size, shuffle=True)
 
     logger.info(f'train-dataset = {train_data_set}')
     logger.info(f'test-dataset = {test_data_set}')
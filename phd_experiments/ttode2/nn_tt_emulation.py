@@ -54,8 +54,10 @@ if __name__ == '__main__':
     overall_dataset = get_dataset(config)
     input_dim = overall_dataset.get_input_dim()
     output_dim = overall_dataset.get_output_dim()
+    # split with its own generator, so splits do not depend on how the dataset was generated (e.g. from the cache)
     splits = random_split(dataset=overall_dataset,
-                          lengths=[config["train"]["ratio"], 1 - config["train"]["ratio"]])
+                          lengths=[config["train"]["ratio"], 1 - config["train"]["ratio"]],
+                          generator=torch.Generator().manual_seed(seed))
     train_dataset = splits[0]
     test_dataset = splits[1]
     train_loader = DataLoader(dataset=train_dataset, batch_size=config["train"]["batch_size"],
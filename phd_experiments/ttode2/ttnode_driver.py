@@ -7,6 +7,7 @@ import random
 import numpy as np
 import torch.nn
 from torch.utils.data import random_split, DataLoader
+from phd_experiments.datasets.tensor_batch_loader import TensorBatchLoader
 from phd_experiments.ttode2.models import LearnableOde, ProjectionModel, OutputModel, OdeSolverModel, NNodeFunc, \
     TensorTrainOdeFunc
 from phd_experiments.ttode2.utils import get_dataset, get_solver, get_ode_func, get_tensor_dtype, \
@@ -72,12 +73,15 @@ if __name__ == '__main__':
     overall_dataset = get_dataset(config)
     input_dim = overall_dataset.get_input_dim()
     output_dim = overall_dataset.get_output_dim()
+    # split with its own generator, so splits do not depend on how the dataset was generated (e.g. from the cache)
     splits = random_split(dataset=overall_dataset,
-                          lengths=[config["train"]["ratio"], 1 - config["train"]["ratio"]])
+                          lengths=[config["train"]["ratio"], 1 - config["train"]["ratio"]],
+                          generator=torch.Generator().manual_seed(seed))
     train_dataset = splits[0]
     test_dataset = splits[1]
-    train_loader = DataLoader(dataset=train_dataset, batch_size=config["train"]["batch_size"],
-                              shuffle=config["train"]["shuffle"])
+    # datasets are X/Y tensors, so batches are sliced / gathered directly instead of collated per sample
+    train_loader = TensorBatchLoader.from_dataset(dataset=train_dataset, batch_size=config["train"]["batch_size"],
+                                                  shuffle=config["train"]["shuffle"], seed=seed)
     # test_loader = DataLoader(dataset=test_dataset, batch_size=config["train"]["batch_size"],
     #                          shuffle=config["train"]["shuffle"])
 
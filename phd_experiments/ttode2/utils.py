@@ -7,6 +7,7 @@ from typing import List
 import torch
 from torch.nn import MSELoss
 
+from experiments.dataset_cache import DatasetCache
 from phd_experiments.datasets.custom_dataset import CustomDataSet
 from phd_experiments.datasets.torch_boston_housing import TorchBostonHousingPrices
 from phd_experiments.datasets.toy_ode import ToyODE
@@ -94,6 +95,9 @@ def get_dataset(config: dict) -> CustomDataSet:
     dataset_name = config["train"]["dataset"]
     N = config["train"]["N"]
     if dataset_name == "toy-ode":
+        # cache generated dataset on disk if train.dataset-cache is True
+        if config["train"].get("dataset-cache", False):
+            return DatasetCache().get(ToyODE, seed=config["train"]["seed"], N=N)
         return ToyODE(N)
     elif dataset_name == "toy-relu":
         return ToyRelu(N=N)
@@ -0,0 +1,156 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("imageio")
+
+import imageio
+import numpy as np
+from experiments.dataloaders import (ConcentricSphere, Data1D,
+                                     DeviceDataLoader, ShiftedSines,
+                                     TensorImageLoader, TinyImageNet,
+                                     TinyImageNetShards,
+                                     random_points_in_sphere)
+from experiments.tiny_imagenet_shards import pack_tiny_imagenet
+from torch.utils.data import DataLoader, DistributedSampler
+from torchvision import transforms
+
+
+def make_sphere(num_points=100):
+    return ConcentricSphere(2, (0., .5), (1., 1.5), num_points // 2,
+                            num_points // 2,
+                            generator=torch.Generator().manual_seed(0))
+
+
+def test_getitems_batches_match_pointwise_batches():
+    dataset = make_sphere()
+    batched = DataLoader(dataset, batch_size=16)
+    pointwise = DataLoader([dataset[i] for i in range(len(dataset))],
+                           batch_size=16)
+    for (data, targets), (point_data, point_targets) in zip(batched, pointwise):
+        assert torch.equal(data, point_data)
+        assert torch.equal(targets, point_targets)
+
+
+def test_default_collate_of_data_1d():
+    dataset = Data1D(num_points=20, generator=torch.Generator().manual_seed(0))
+    data, targets = next(iter(DataLoader(dataset, batch_size=8)))
+    assert data.shape == (8, 1) and targets.shape == (8, 1)
+
+
+def test_random_points_in_sphere_radii():
+    points = random_points_in_sphere(1000, 3, 1., 1.5,
+                                     generator=torch.Generator().manual_seed(0))
+    radii = points.norm(dim=1)
+    assert points.shape == (1000, 3)
+    assert radii.min() >= 1. - 1e-6 and radii.max() <= 1.5 + 1e-6
+
+
+def test_shifted_sines_shapes_and_labels():
+    dataset = ShiftedSines(3, 1.4, 20, 30, .1,
+                           generator=torch.Generator().manual_seed(0))
+    assert dataset.data.shape == (50, 3) and dataset.data.is_contiguous()
+    assert set(dataset.targets.squeeze(1).tolist()) == {-1., 1.}
+
+
+def test_device_data_loader_covers_dataset():
+    dataset = make_sphere()
+    data_loader = DeviceDataLoader(dataset, batch_size=16,
+                                   device=torch.device('cpu'), shuffle=True)
+    data = torch.cat([batch for batch, _ in data_loader])
+    assert len(data_loader) == 7
+    assert torch.equal(data.sort(0).values, dataset.data.sort(0).values)
+
+
+def make_image_dataset(num_images=10, grayscale=False):
+    """Returns images and labels stored as by torchvision MNIST (grayscale)
+    or CIFAR10 datasets."""
+    rng = np.random.RandomState(0)
+    if grayscale:
+        data = torch.from_numpy(rng.randint(0, 256, (num_images, 8, 8)).astype(np.uint8))
+    else:
+        data = rng.randint(0, 256, (num_images, 8, 8, 3)).astype(np.uint8)
+    return SimpleNamespace(data=data, targets=list(range(num_images)))
+
+
+@pytest.mark.parametrize("grayscale", [False, True])
+def test_tensor_image_loader_matches_to_tensor(grayscale):
+    dataset = make_image_dataset(grayscale=grayscale)
+    mean, std = ((.5,), (.25,)) if grayscale else ((.4, .5, .6), (.2, .3, .4))
+    loader = TensorImageLoader.from_dataset(dataset, 4, mean=mean, std=std)
+    transform = transforms.Compose([transforms.ToTensor(),
+                                    transforms.Normalize(mean, std)])
+    images, labels = zip(*loader)
+    assert len(loader) == 3 and [len(batch) for batch in labels] == [4, 4, 2]
+    expected = torch.stack([transform(np.asarray(image)) for image in dataset.data])
+    assert torch.allclose(torch.cat(images), expected, atol=1e-6)
+    assert torch.cat(labels).tolist() == dataset.targets
+
+
+def test_tensor_image_loader_shuffles_resizes_and_shards():
+    dataset = make_image_dataset()
+    torch.manual_seed(0)
+    loader = TensorImageLoader.from_dataset(dataset, 4, shuffle=True, size=16)
+    images, labels = zip(*loader)
+    assert images[0].shape == (4, 3, 16, 16)
+    assert sorted(torch.cat(labels).tolist()) == dataset.targets
+    # Shard of the first of two processes in distributed training
+    loader = TensorImageLoader.from_dataset(dataset, 4)
+    loader.sampler = DistributedSampler(range(10), num_replicas=2, rank=0,
+                                        shuffle=False)
+    assert len(loader) == 2
+    assert torch.cat([labels for _, labels in loader]).tolist() == [0, 2, 4, 6, 8]
+
+
+def make_tiny_imagenet(root_folder):
+    """Writes a Tiny ImageNet folder with 2 classes of 3 train images, one of
+    them grayscale, and 2 validation images."""
+    rng = np.random.RandomState(0)
+    for wnid in ('n02', 'n01'):
+        os.makedirs(os.path.join(root_folder, 'train', wnid, 'images'))
+        for k in range(3):
+            shape = (64, 64) if k == 1 else (64, 64, 3)
+            imageio.imwrite(os.path.join(root_folder, 'train', wnid, 'images',
+                                         '{}_{}.JPEG'.format(wnid, k)),
+                            rng.randint(0, 256, shape).astype(np.uint8))
+    os.makedirs(os.path.join(root_folder, 'val', 'images'))
+    with open(os.path.join(root_folder, 'val', 'val_annotations.txt'), 'w') as f:
+        for k, wnid in enumerate(('n02', 'n01')):
+            file_name = 'val_{}.JPEG'.format(k)
+            imageio.imwrite(os.path.join(root_folder, 'val', 'images', file_name),
+                            rng.randint(0, 256, (64, 64, 3)).astype(np.uint8))
+            f.write('{}\t{}\t0\t0\t63\t63\n'.format(file_name, wnid))
+
+
+def test_tiny_imagenet_shards_match_jpegs(tmp_path):
+    root_folder = str(tmp_path / 'tiny-imagenet') + '/'
+    make_tiny_imagenet(root_folder)
+    shard_folder = str(tmp_path / 'shards')
+    # Train images are split over two shards
+    pack_tiny_imagenet(root_folder, shard_folder, shard_size=4, num_workers=1)
+
+    jpeg_data = TinyImageNet(root_folder, transform=transforms.ToTensor())
+    shard_data = TinyImageNetShards(shard_folder)
+    assert shard_data.classes == ['n01', 'n02']
+    assert len(shard_data) == len(jpeg_data) == 6
+    for idx in range(len(jpeg_data)):
+        jpeg_image, jpeg_label = jpeg_data[idx]
+        shard_image, shard_label = shard_data[idx]
+        assert shard_label == jpeg_label == idx // 3
+        assert torch.allclose(shard_image, jpeg_image)
+
+    val_data = TinyImageNetShards(shard_folder, split='val')
+    assert [val_data[idx][1] for idx in range(len(val_data))] == [1, 0]
+
+    # Batches across shards with the default collate function
+    images, labels = next(iter(DataLoader(shard_data, batch_size=6)))
+    assert images.shape == (6, 3, 64, 64)
+    assert labels.tolist() == [0, 0, 0, 1, 1, 1]
+    mean, std = (.4, .5, .6), (.2, .3, .4)
+    normalized_data = TinyImageNetShards(shard_folder, mean=mean, std=std)
+    normalized, _ = next(iter(DataLoader(normalized_data, batch_size=6)))
+    expected = transforms.Normalize(mean, std)(images)
+    assert torch.allclose(normalized, expected, atol=1e-6)
@@ -0,0 +1,67 @@
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from experiments.dataset_cache import DatasetCache
+
+
+class NoisyDataset():
+    """Dataset drawing from the random number generators of torch, numpy and
+    python."""
+
+    def __init__(self, num_points):
+        self.num_points = num_points
+        self.data = torch.randn(num_points, 2) + torch.from_numpy(
+            np.random.randn(num_points, 2)).float() + random.random()
+
+
+class VersionedDataset(NoisyDataset):
+    cache_version = 2
+
+
+def test_keys_depend_on_class_params_seed_and_version():
+    key = DatasetCache.key(NoisyDataset, 0, {"num_points": 10})
+    assert key == DatasetCache.key(NoisyDataset, 0, {"num_points": 10})
+    assert key != DatasetCache.key(NoisyDataset, 1, {"num_points": 10})
+    assert key != DatasetCache.key(NoisyDataset, 0, {"num_points": 11})
+    assert key != DatasetCache.key(VersionedDataset, 0, {"num_points": 10})
+
+
+def test_get_is_reproducible_and_leaves_global_rngs_untouched(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    torch_state = torch.get_rng_state()
+    numpy_state = np.random.get_state()[1].copy()
+    random_state = random.getstate()
+
+    generated = cache.get(NoisyDataset, 0, num_points=10)
+    loaded = cache.get(NoisyDataset, 0, num_points=10)
+    # Also reproducible without the cache
+    regenerated = DatasetCache(str(tmp_path / 'other')).get(NoisyDataset, 0, num_points=10)
+
+    assert torch.equal(generated.data, loaded.data)
+    assert torch.equal(generated.data, regenerated.data)
+    assert loaded.num_points == 10
+    assert torch.equal(torch.get_rng_state(), torch_state)
+    assert np.array_equal(np.random.get_state()[1], numpy_state)
+    assert random.getstate() == random_state
+
+
+def test_corrupted_entry_is_regenerated(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    generated = cache.get(NoisyDataset, 0, num_points=10)
+    entry_dir = tmp_path / DatasetCache.key(NoisyDataset, 0, {"num_points": 10})
+    with open(entry_dir / 'data.npy', 'ab') as f:
+        f.write(b'0')
+    assert torch.equal(cache.get(NoisyDataset, 0, num_points=10).data, generated.data)
+
+
+def test_keys_include_modules_the_dataset_depends_on():
+    from experiments.dataset_cache import _source_modules
+    from phd_experiments.datasets.toy_ode import ToyODE
+    modules = _source_modules(ToyODE)
+    assert 'phd_experiments.datasets.toy_ode' in modules
+    # ToyODE is generated with this solver
+    assert 'phd_experiments.torch_ode_solvers.torch_euler' in modules
+    assert 'torch' not in modules
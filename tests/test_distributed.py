@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchdiffeq")
+
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from test_training import make_data_loader, make_trainer
+
+WORLD_SIZE = 2
+
+
+def _run(rank, init_file, fail_rank, results):
+    dist.init_process_group('gloo', init_method='file://' + init_file,
+                            rank=rank, world_size=WORLD_SIZE)
+    try:
+        trainer = make_trainer(distributed=True)
+        evaluation = trainer.evaluate(make_data_loader(num_points=30))
+        forward = trainer.model.forward
+
+        def failing_forward(x):
+            if rank == fail_rank:
+                raise AssertionError("max_num_steps exceeded (test)")
+            return forward(x)
+
+        trainer.model.forward = failing_forward
+        try:
+            trainer.train(make_data_loader(), 1)
+            error = None
+        except AssertionError as e:
+            error = e.args[0]
+        results[rank] = (evaluation["num_points"], evaluation["loss"], error)
+    finally:
+        dist.destroy_process_group()
+
+
+def test_failure_on_one_process_raises_on_all(tmp_path):
+    results = mp.Manager().dict()
+    mp.spawn(_run, args=(str(tmp_path / 'init'), 1, results),
+             nprocs=WORLD_SIZE)
+    # Evaluation is split between processes and reduced over them
+    expected = make_trainer().evaluate(make_data_loader(num_points=30))
+    for rank in range(WORLD_SIZE):
+        num_points, loss, error = results[rank]
+        assert num_points == 30
+        assert loss == pytest.approx(expected["loss"], rel=1e-4)
+        assert error.startswith("max_num_steps")
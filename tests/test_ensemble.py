@@ -0,0 +1,39 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchdiffeq")
+
+from anode.ensemble import EnsembleODENet, max_replica_norm
+from anode.models import ODENet
+
+
+def test_max_replica_norm_is_max_of_replica_rms_norms():
+    tensor = torch.zeros(4, 8, 2)
+    tensor[1] = 1.
+    # RMS norm over all replicas would be 1 / sqrt(4)
+    assert max_replica_norm(tensor).item() == pytest.approx(1.)
+
+
+def test_ensemble_predictions_and_unstack():
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+    models = [ODENet(device, 2, 16, augment_dim=1) for _ in range(3)]
+    ensemble = EnsembleODENet(models)
+    x = torch.randn(8, 2)
+    pred = ensemble(x)
+    assert pred.shape == (3, 8, 1)
+    with torch.no_grad():
+        ensemble.linear_bias.add_(1.)
+    for model, bias in zip(ensemble.unstack(), ensemble.linear_bias):
+        assert torch.equal(model.linear_layer.bias, bias)
+
+
+def test_unsupported_ensemble_options_raise():
+    pytest.importorskip("matplotlib")
+    from experiments.experiments import check_ensemble_config
+    model_config = {"type": "anode", "ensemble": True}
+    check_ensemble_config(model_config, {})
+    with pytest.raises(ValueError):
+        check_ensemble_config(dict(model_config, warm_start=True), {})
+    with pytest.raises(ValueError):
+        check_ensemble_config(model_config, {"regularization": {"kinetic_energy": .1}})
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from anode.metrics import MetricsWriter, read_metrics
+
+
+def write_records(path, records):
+    writer = MetricsWriter(path)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+
+def test_read_metrics_rebuilds_histories(tmp_path):
+    path = str(tmp_path / 'metrics0_0.jsonl')
+    write_records(path, [
+        {"type": "step", "step": 0, "loss": 1., "nfe": 20},
+        {"type": "step", "step": 10, "loss": .5, "nfe": 26},
+        {"type": "epoch", "epoch": 0, "epoch_loss": .75, "epoch_nfe": 23.},
+    ])
+    histories = read_metrics(path)
+    assert histories['loss_history'] == [1., .5]
+    assert histories['nfe_history'] == [20, 26]
+    assert histories['epoch_loss_history'] == [.75]
+    assert 'stop' not in histories
+
+
+def test_read_metrics_drops_rolled_back_records(tmp_path):
+    path = str(tmp_path / 'metrics0_0.jsonl')
+    write_records(path, [
+        {"type": "step", "step": 0, "loss": 1.},
+        {"type": "epoch", "epoch": 0, "epoch_loss": 1.},
+        {"type": "step", "step": 10, "loss": 9.},
+        # Solver failed during the second epoch
+        {"type": "rollback", "step": 10, "epoch": 1},
+        {"type": "step", "step": 10, "loss": .5},
+        {"type": "epoch", "epoch": 1, "epoch_loss": .5},
+        {"type": "stop", "reason": "plateau", "epoch": 2},
+    ])
+    histories = read_metrics(path)
+    assert histories['loss_history'] == [1., .5]
+    assert histories['epoch_loss_history'] == [1., .5]
+    assert histories['stop'] == {"reason": "plateau", "epoch": 2}
+
+
+def test_metrics_writer_appends(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    write_records(path, [{"type": "step", "step": 0, "loss": 1.}])
+    write_records(path, [{"type": "step", "step": 1, "loss": 2.}])
+    with open(path) as f:
+        assert [json.loads(line)["loss"] for line in f] == [1., 2.]
+
+
+def test_history_info_from_metrics(tmp_path):
+    pytest.importorskip("matplotlib")
+    pytest.importorskip("torch")
+    from viz.plots import history_info_from_metrics
+    paths = [str(tmp_path / 'metrics0_{}.jsonl'.format(j)) for j in range(3)]
+    for j in range(2):
+        write_records(paths[j], [{"type": "step", "step": 0, "loss": float(j)}])
+    # Third rep failed before writing any metrics
+    history_info = history_info_from_metrics('anode', paths)
+    assert history_info == {"type": "anode", "loss_history": [[0.], [1.]]}
@@ -0,0 +1,251 @@
+import warnings
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchdiffeq")
+
+from anode.models import ODENet
+
+
+def make_model(**kwargs):
+    torch.manual_seed(0)
+    return ODENet(torch.device('cpu'), data_dim=2, hidden_dim=16, output_dim=1,
+                  augment_dim=2, **kwargs)
+
+
+def test_implicit_augment_matches_explicit_augmentation():
+    x = torch.randn(8, 2)
+    explicit = make_model()
+    implicit = make_model(implicit_augment=True)
+    assert torch.allclose(explicit(x), implicit(x), atol=1e-5)
+
+
+def test_implicit_augment_reuses_buffer_only_without_grad():
+    odeblock = make_model(implicit_augment=True).odeblock
+    with torch.no_grad():
+        first = odeblock._augment(torch.randn(8, 2))
+        x = torch.randn(8, 2)
+        second = odeblock._augment(x)
+    assert first is second
+    assert torch.equal(second[:, :2], x)
+    assert torch.all(second[:, 2:] == 0)
+    # With gradients, a buffer could still be saved by a live graph
+    assert odeblock._augment(x) is not odeblock._augment(x)
+
+
+def test_implicit_augment_inference_mode_then_training():
+    model = make_model(implicit_augment=True)
+    x = torch.randn(8, 2)
+    with torch.inference_mode():
+        model(x)
+    with torch.no_grad():
+        model(x)
+    model(x).pow(2).sum().backward()
+    with torch.inference_mode():
+        model(x)
+    assert model.odefunc.fc1.weight.grad is not None
+
+
+def test_telemetry_does_not_change_solver():
+    from anode.telemetry import SolverTelemetry
+    x = torch.randn(8, 2)
+    model = make_model()
+    model(x)
+    nfe = model.get_nfe()
+
+    telemetry = model.odeblock.attach_telemetry(SolverTelemetry())
+    model(x)
+    telemetry.flush()
+    assert telemetry.records[-1]["forward_nfe"] == nfe
+    assert telemetry.records[-1]["accepted_steps"] is None
+
+    telemetry = model.odeblock.attach_telemetry(SolverTelemetry(solver_steps=True))
+    model(x)
+    telemetry.flush()
+    assert telemetry.records[-1]["accepted_steps"] > 0
+
+
+def test_fused_conv_odenet_matches_concatenation():
+    from anode.conv_models import ConvODENet
+    models = {}
+    for fused in (False, True):
+        torch.manual_seed(0)
+        models[fused] = ConvODENet(torch.device('cpu'), (1, 8, 8), 4,
+                                   augment_dim=1, time_dependent=True,
+                                   fused=fused)
+    assert models[True].odeblock.odefunc.conv2.fused
+    assert not models[False].odeblock.odefunc.conv2.fused
+    torch.manual_seed(0)
+    x = torch.randn(2, 1, 8, 8)
+    t = torch.tensor(.3)
+    x_aug = torch.cat([x, torch.zeros_like(x)], 1)
+    outputs = [models[fused].odeblock.odefunc(t, x_aug) for fused in (False, True)]
+    assert torch.allclose(outputs[0], outputs[1], atol=1e-5)
+    with torch.no_grad():
+        assert torch.allclose(models[False](x), models[True](x), atol=1e-3)
+
+
+@pytest.mark.parametrize("solver", [{"method": "dopri5"},
+                                    {"method": "rk4", "num_steps": 10}])
+def test_checkpoint_gradients_match_direct_backpropagation(solver):
+    from anode.models import ODEFunc
+    from anode.solvers import RungeKuttaSolver, SolverSpec, odeint_checkpoint
+    torch.manual_seed(0)
+    x = torch.randn(8, 2)
+    odefunc = ODEFunc(torch.device('cpu'), data_dim=2, hidden_dim=16)
+    spec = SolverSpec(**solver)
+    t = torch.tensor([0., 1.])
+    gradients = []
+    for checkpoint in (False, True):
+        # Both backpropagate through the same steps of RungeKuttaSolver
+        rk_solver = RungeKuttaSolver(odefunc, spec)
+        with warnings.catch_warnings():
+            # Step size control must not convert tensors requiring grad
+            warnings.simplefilter("error")
+            if checkpoint:
+                out = odeint_checkpoint(rk_solver, x, t)
+            else:
+                out = rk_solver.integrate(x, t)
+        loss = out[-1].pow(2).sum()
+        gradients.append(torch.autograd.grad(loss, list(odefunc.parameters())))
+    for direct, checkpointed in zip(*gradients):
+        assert torch.allclose(direct, checkpointed, atol=1e-6)
+
+
+def test_dense_trajectory_matches_solves_at_eval_times():
+    model = make_model(tol=1e-5)
+    x = torch.randn(8, 2)
+    times = torch.linspace(0., 1., 50)
+    with torch.no_grad():
+        solved = model.odeblock(x, eval_times=times)
+        dense = model.odeblock.dense_trajectory(x)
+        nfe = model.odeblock.odefunc.nfe
+        assert torch.allclose(dense(times), solved, atol=1e-3)
+        # Querying more times needs no further function evaluations
+        assert dense(torch.linspace(0., 1., 500)).shape == (500, 8, 4)
+    assert model.odeblock.odefunc.nfe == nfe
+
+
+def test_partitioned_solve_matches_single_solve():
+    torch.manual_seed(0)
+    x = torch.randn(16, 2)
+    x[8:] *= 10.
+    with torch.no_grad():
+        single = make_model(tol=1e-5)(x)
+        model = make_model(tol=1e-5, partition=True)
+        partitioned = model(x)
+    assert sum(model.odeblock.partition_stats["sizes"]) == 16
+    assert torch.allclose(single, partitioned, atol=1e-3)
+
+
+def test_partition_ignores_samples_with_zero_error(monkeypatch):
+    from anode.solvers import RungeKuttaSolver
+    error_ratios = torch.tensor([0., 0., 0., 0., 0., 1., 1., 100.])
+    monkeypatch.setattr(RungeKuttaSolver, 'sample_error_ratios',
+                        lambda self, t0, y0: error_ratios)
+    torch.manual_seed(0)
+    x = torch.randn(8, 2)
+    model = make_model(partition=True)
+    with torch.no_grad():
+        partitioned = model(x)
+        single = make_model()(x)
+    # Only the last sample is hard relative to the nonzero error ratios
+    assert model.odeblock.partition_stats["sizes"] == [7, 1]
+    assert torch.allclose(single, partitioned, atol=1e-2)
+
+
+def test_bf16_dynamics_on_cpu_match_fp32():
+    torch.manual_seed(0)
+    x = torch.randn(8, 2)
+    with torch.no_grad():
+        out = make_model()(x)
+        out_bf16 = make_model(precision='bf16')(x)
+    assert out_bf16.dtype == torch.float32
+    assert torch.allclose(out, out_bf16, atol=5e-2, rtol=5e-2)
+
+
+def test_fp16_requires_cuda():
+    with pytest.raises(ValueError):
+        make_model(precision='fp16')
+
+
+@pytest.mark.parametrize("time_dependent", [False, True])
+def test_compiled_odefunc_matches_eager(time_dependent):
+    from anode.models import ODEFunc
+    odefuncs = {}
+    for compiled in (False, True):
+        torch.manual_seed(0)
+        odefuncs[compiled] = ODEFunc(torch.device('cpu'), data_dim=2,
+                                     hidden_dim=16, augment_dim=1,
+                                     time_dependent=time_dependent,
+                                     compiled=compiled)
+    torch.manual_seed(0)
+    x = torch.randn(8, 3)
+    t = torch.tensor(.3)
+    eager = odefuncs[False](t, x)
+    assert torch.allclose(odefuncs[True](t, x), eager, atol=1e-6)
+    with torch.no_grad():
+        # Without gradients, activations are written into reused buffers
+        for _ in range(2):
+            assert torch.allclose(odefuncs[True](t, x), eager, atol=1e-6)
+    assert len(odefuncs[True]._activation_buffers) == 1
+
+
+def test_solver_spec_from_config():
+    from anode.solvers import SolverSpec
+    spec = SolverSpec.from_config({"method": "rk4", "num_steps": 10}, tol=1e-4)
+    assert spec.method == 'rk4' and not spec.is_adaptive
+    assert spec.to_config() == {"method": "rk4", "num_steps": 10}
+    spec = SolverSpec.from_config(None, tol=1e-4)
+    assert (spec.method, spec.rtol, spec.atol) == ('dopri5', 1e-4, 1e-4)
+    assert SolverSpec.from_config(spec) is spec
+    with pytest.raises(ValueError):
+        SolverSpec(method='rk4')
+    with pytest.raises(ValueError):
+        SolverSpec(method='rk4', step_size=.1, num_steps=10)
+    with pytest.raises(ValueError):
+        SolverSpec(method='dopri5', num_steps=10)
+    with pytest.raises(ValueError):
+        SolverSpec(method='rk5')
+
+
+@pytest.mark.parametrize("solver,nfe", [({"method": "rk4", "num_steps": 10}, 40),
+                                        ({"method": "euler", "step_size": .25}, 4)])
+def test_fixed_grid_solvers_match_dopri5(solver, nfe):
+    x = torch.randn(8, 2)
+    model = make_model(solver=solver)
+    out = model(x)
+    assert model.get_nfe() == nfe
+    expected = make_model(tol=1e-6)(x)
+    # Euler with 4 steps is only a coarse approximation
+    atol = 1e-3 if solver["method"] == 'rk4' else 1e-1
+    assert torch.allclose(out, expected, atol=atol)
+
+
+def test_warm_start_reuses_step_sizes_of_previous_solve():
+    x = torch.randn(8, 2)
+    model = make_model(tol=1e-6, warm_start=True)
+    cache = model.odeblock.step_size_cache
+    first = model(x)
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = model(x)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert torch.allclose(first, second, atol=1e-4)
+    assert torch.allclose(second, make_model(tol=1e-6)(x), atol=1e-4)
+    # Solves with other tolerances do not use the cache
+    model.odeblock.solver.rtol = 1e-3
+    model(x)
+    assert (cache.hits, cache.misses) == (1, 2)
+    # New weights need new step sizes
+    model.load_state_dict(make_model().state_dict())
+    assert cache.step_sizes == []
+    model(x)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_warm_start_requires_dopri5_without_adjoint():
+    with pytest.raises(ValueError):
+        make_model(warm_start=True, solver={"method": "rk4", "num_steps": 10})
+    with pytest.raises(ValueError):
+        make_model(warm_start=True, adjoint=True)
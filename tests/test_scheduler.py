@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchdiffeq")
+pytest.importorskip("matplotlib")
+
+from experiments.experiments import cell_seed, run_experiments
+from experiments.scheduler import run_experiments_parallel
+
+EXPERIMENT = {
+    "data_dim": 1,
+    "viz_batch_size": 16,
+    "num_reps": 2,
+    "datasets": [{"type": "sphere", "num_points_inner": 16,
+                  "num_points_outer": 16, "inner_range": [0., .5],
+                  "outer_range": [1., 1.5]}],
+    "model_configs": [{"type": "resnet", "hidden_dim": 8, "num_layers": 2,
+                       "lr": 1e-3},
+                      {"type": "anode", "hidden_dim": 8, "augment_dim": 1,
+                       "time_dependent": False,
+                       "lr": 1e-3, "ensemble": True}],
+    "training_config": {"batch_size": 8, "record_freq": 1, "print_freq": 1,
+                        "epochs": 1}
+}
+
+
+def test_cell_seeds_are_deterministic_and_distinct():
+    assert cell_seed(0, 1, 2) == cell_seed(0, 1, 2)
+    seeds = {cell_seed(seed, d, i) for seed in range(2) for d in range(3)
+             for i in range(3)}
+    assert len(seeds) == 18
+    assert cell_seed(0, 1, 2) != cell_seed(0, 12)
+
+
+def test_parallel_results_match_sequential_results():
+    sequential = run_experiments(torch.device('cpu'), seed=0, **EXPERIMENT)
+    parallel = run_experiments_parallel(num_workers=2, threads_per_worker=1,
+                                        seed=0, **EXPERIMENT)
+    assert len(parallel) == 1
+    for model_info, expected in zip(parallel[0]["model_info"],
+                                    sequential[0]["model_info"]):
+        assert model_info["type"] == expected["type"]
+        assert len(model_info["loss_history"]) == EXPERIMENT["num_reps"]
+        for losses, expected_losses in zip(model_info["loss_history"],
+                                           expected["loss_history"]):
+            assert losses == pytest.approx(expected_losses, rel=1e-4)
+    assert parallel[0]["model_info"][1]["shared_nfe"]
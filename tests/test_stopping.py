@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from anode.stopping import (LossPlateau, NFEBudget, NFECeiling,
+                            WallClockBudget, stopping_policies_from_config)
+
+
+def test_loss_plateau_only_checks_at_end_of_epoch():
+    policy = LossPlateau(patience=2, min_delta=.1)
+    trainer = SimpleNamespace(histories={'epoch_loss_history': [1., .5, .45, .41]})
+    assert policy.check(trainer, end_of_epoch=False) is None
+    assert policy.check(trainer, end_of_epoch=True) is not None
+    trainer.histories['epoch_loss_history'][-1] = .3
+    assert policy.check(trainer, end_of_epoch=True) is None
+
+
+def test_loss_plateau_uses_mean_loss_of_ensembles():
+    policy = LossPlateau(patience=1)
+    trainer = SimpleNamespace(histories={'epoch_loss_history': [[1., 3.], [0., 4.5]]})
+    assert policy.check(trainer, end_of_epoch=True) is not None
+
+
+def test_budgets():
+    trainer = SimpleNamespace(train_time=10., total_nfes=1000, last_batch_nfes=50)
+    assert WallClockBudget(5.).check(trainer, False) is not None
+    assert WallClockBudget(20.).check(trainer, False) is None
+    assert NFEBudget(500).check(trainer, False) is not None
+    assert NFEBudget(5000).check(trainer, False) is None
+    assert NFECeiling(40).check(trainer, False) is not None
+    assert NFECeiling(60).check(trainer, False) is None
+
+
+def test_stopping_policies_from_config():
+    assert stopping_policies_from_config(None) == []
+    policies = stopping_policies_from_config({"patience": 3, "nfe_ceiling": 100})
+    assert [type(policy) for policy in policies] == [LossPlateau, NFECeiling]
+    assert policies[0].patience == 3
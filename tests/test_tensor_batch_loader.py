@@ -0,0 +1,57 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from phd_experiments.datasets.tensor_batch_loader import TensorBatchLoader
+from torch.utils.data import DataLoader, Dataset, TensorDataset, random_split
+
+
+class RowDataset(Dataset):
+    def __init__(self, X, Y):
+        self.X = X
+        self.Y = Y
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, idx):
+        return self.X[idx], self.Y[idx]
+
+
+def make_tensors(num_points=10):
+    X = torch.arange(num_points * 2, dtype=torch.float32).view(num_points, 2)
+    return X, X.sum(1, keepdim=True)
+
+
+def test_unshuffled_batches_match_data_loader():
+    X, Y = make_tensors()
+    loader = TensorBatchLoader(X, Y, batch_size=4)
+    expected = list(DataLoader(TensorDataset(X, Y), batch_size=4))
+    assert len(loader) == len(expected) == 3
+    for (x, y), (x_expected, y_expected) in zip(loader, expected):
+        assert torch.equal(x, x_expected)
+        assert torch.equal(y, y_expected)
+
+
+def test_shuffle_is_seeded_and_drops_last():
+    X, Y = make_tensors()
+    epochs = [list(TensorBatchLoader(X, Y, batch_size=4, shuffle=True,
+                                     drop_last=True, seed=0)) for _ in range(2)]
+    assert len(epochs[0]) == 2
+    for (x, y), (x_again, _) in zip(*epochs):
+        assert torch.equal(x, x_again)
+        # Rows of X and Y stay paired
+        assert torch.equal(x.sum(1, keepdim=True), y)
+    seen = torch.cat([x for x, _ in epochs[0]])
+    assert len(seen.unique(dim=0)) == 8
+
+
+def test_from_dataset_resolves_subsets():
+    X, Y = make_tensors()
+    subset, _ = random_split(RowDataset(X, Y), [6, 4],
+                             generator=torch.Generator().manual_seed(0))
+    subset_of_subset = torch.utils.data.Subset(subset, [1, 3])
+    loader = TensorBatchLoader.from_dataset(subset_of_subset, batch_size=2)
+    x, y = next(iter(loader))
+    assert torch.equal(x, torch.stack([subset[1][0], subset[3][0]]))
+    assert torch.equal(y, torch.stack([subset[1][1], subset[3][1]]))
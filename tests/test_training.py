@@ -0,0 +1,77 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchdiffeq")
+
+from anode.models import ODENet
+from anode.training import Trainer
+from torch.utils.data import DataLoader, TensorDataset
+
+
+def make_trainer(**kwargs):
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+    model = ODENet(device, data_dim=2, hidden_dim=16, output_dim=1,
+                   augment_dim=1, implicit_augment=True)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+    return Trainer(model, optimizer, device, verbose=False, **kwargs)
+
+
+def make_data_loader(num_points=32, batch_size=8):
+    generator = torch.Generator().manual_seed(0)
+    inputs = torch.randn(num_points, 2, generator=generator)
+    targets = inputs.sum(1, keepdim=True)
+    return DataLoader(TensorDataset(inputs, targets), batch_size=batch_size)
+
+
+def test_evaluate_train_evaluate_with_implicit_augment():
+    trainer = make_trainer()
+    data_loader = make_data_loader()
+    before = trainer.evaluate(data_loader)
+    trainer.train(data_loader, 1)
+    after = trainer.evaluate(data_loader, batch_size=32)
+    assert before["num_points"] == after["num_points"] == 32
+    assert after["nfe"] > 0
+    assert trainer.model.training
+
+
+def test_evaluate_restores_tolerances():
+    trainer = make_trainer()
+    solver = trainer.model.odeblock.solver
+    tolerances = (solver.rtol, solver.atol)
+    trainer.evaluate(make_data_loader(), tol=1e-1)
+    assert (solver.rtol, solver.atol) == tolerances
+
+
+def test_retry_factors_do_not_compound():
+    trainer = make_trainer(checkpoint_freq=1, max_retries=3,
+                           retry_tol_factor=10., retry_lr_factor=.5)
+    solver = trainer.model.odeblock.solver
+    rtol = solver.rtol
+    trainer.save_checkpoint()
+    for retries in (1, 2, 3):
+        trainer.retries = retries
+        trainer.load_checkpoint()
+        # Checkpoints saved after a retry include its factors
+        trainer.save_checkpoint()
+        assert solver.rtol == pytest.approx(rtol * 10. ** retries)
+        assert trainer.optimizer.param_groups[0]['lr'] == pytest.approx(1e-2 * .5 ** retries)
+
+
+def test_nfe_ceiling_stops_training():
+    from anode.stopping import NFECeiling
+    trainer = make_trainer(stopping=[NFECeiling(0)], planned_epochs=3)
+    trainer.train(make_data_loader(), 3)
+    assert trainer.stop_reason is not None
+    assert trainer.steps == 1
+    assert trainer.histories['stop']['reason'] == trainer.stop_reason
+
+
+def test_regularizers_are_validated():
+    trainer = make_trainer(regularization={"kinetic_energy": .01,
+                                           "jacobian_frobenius": .01})
+    assert trainer.model.odeblock.regularizers == ('kinetic_energy', 'jacobian_frobenius')
+    trainer.train(make_data_loader(), 1)
+    assert len(trainer.histories['epoch_regularization_history']) == 1
+    with pytest.raises(ValueError):
+        make_trainer(regularization={"kinetic_enegry": .01})
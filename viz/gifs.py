@@ -109,7 +109,7 @@ def trajectory_gif(model, inputs, targets, timesteps, dpi=100, alpha=0.5,
     color = ['red' if targets[i, 0] > 0.0 else 'blue' for i in range(len(targets))]
 
     # Calculate trajectories (timesteps, batch_size, input_dim)
-    trajectories = model.odeblock.trajectory(inputs, timesteps).detach()
+    trajectories, _ = model.trajectory(inputs, timesteps)
     # Extract number of dimensions of features
     num_dims = trajectories.shape[2]
 
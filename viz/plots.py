@@ -1,11 +1,13 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import torch
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.patches import FancyArrowPatch
 from mpl_toolkits.mplot3d import Axes3D, proj3d
 
 from anode.discrete_models import ResidualBlock
+from anode.metrics import read_metrics
 from anode.models import ODEFunc
 
 categorical_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728']
@@ -32,13 +34,17 @@ def anode_plt(model, num_points, timesteps, inputs, targets, h_min=-2, h_max=2,
 
     # plot targets
     ax.scatter(xs=[t_max] * len(targets), ys=targets[:, 0].numpy(), zs=[0] * len(targets), color=color, s=80)
-    # plot trajectory
+    # plot trajectories of all inputs, computed in a single batched solve
     t = np.linspace(0, t_max, timesteps)
+    features_trajectory, preds = model.trajectory(inputs, timesteps)
+    # Shape (timesteps, num_points)
+    h_0 = features_trajectory[:, :, 0].cpu().numpy().copy()
+    h_1 = features_trajectory[:, :, 1].cpu().numpy().copy()
+    # End trajectories at the prediction, so they can be compared to targets
+    h_0[-1] = preds[:, 0].cpu().numpy()
+    h_1[-1] = 0
     for i in range(len(inputs)):
-        init_point = inputs[i:i + 1]
-        trajectory = model.trajectory(init_point, timesteps)
-        ax.plot(xs=t, ys=trajectory[:, 0, 0].detach().numpy(), zs=trajectory[:, 0, 1].detach().numpy(), c=color[i],
-                linewidth=2)
+        ax.plot(xs=t, ys=h_0[:, i], zs=h_1[:, i], c=color[i], linewidth=2)
     ax.set_title('ANODE trajectory for 1D input->target')
     ax.set_zlabel('h[1]')
     ax.set_xlabel('t')
@@ -72,7 +78,8 @@ def vector_field_plt(odefunc, num_points, timesteps, inputs=None, targets=None,
     targets : torch.Tensor or None
         Shape (num_points, 1). Target points for ODE.
 
-    model : anode.models.ODEBlock instance or None
+    model : anode.models.ODENet, anode.models.ODEBlock or
+            anode.discrete_models.ResNet instance or None
         If model is passed as argument along with inputs, it will be used to
         compute the trajectory of each point in inputs and will be overlayed on
         the plot.
@@ -114,14 +121,22 @@ def vector_field_plt(odefunc, num_points, timesteps, inputs=None, targets=None,
 
     if model is not None and inputs is not None:
         color = ['red' if targets[i, 0] > 0 else 'blue' for i in range(len(targets))]
+        # Shape (timesteps, num_points)
+        if hasattr(model, 'odeblock'):
+            features_trajectory, preds = model.trajectory(inputs, timesteps)
+            trajectories = features_trajectory[:, :, 0].cpu().numpy().copy()
+            # End trajectories at the prediction, so they can be compared to
+            # targets
+            trajectories[-1] = preds[:, 0].cpu().numpy()
+        elif hasattr(model, 'odefunc'):
+            with torch.no_grad():
+                trajectories = model.trajectory(inputs, timesteps)[:, :, 0].cpu().numpy()
+        else:
+            # ResNet trajectories are calculated one point at a time
+            trajectories = np.array([model.trajectory(inputs[i:i + 1], timesteps)
+                                     for i in range(len(inputs))]).T
         for i in range(len(inputs)):
-            init_point = inputs[i:i + 1]
-            trajectory = model.trajectory(init_point, timesteps)
-            if isinstance(trajectory, list):
-                trajectory = np.array(trajectory)
-            elif isinstance(trajectory, torch.Tensor):
-                trajectory = trajectory[:, 0, 0].detach().numpy()
-            plt.plot(t, trajectory, c=color[i], linewidth=2)
+            plt.plot(t, trajectories[:, i], c=color[i], linewidth=2)
 
     if len(extra_traj):
         for traj, color in extra_traj:
@@ -262,6 +277,30 @@ def histories_plt(all_history_info, plot_type='loss', shaded_err=False,
         plt.close()
 
 
+def history_info_from_metrics(model_type, metrics_paths):
+    """Returns history info of a model, as used by histories_plt, from the
+    metrics files written by anode.training.Trainer for every rep of the
+    model (e.g. [directory + '/metrics0_{}.jsonl'.format(j) for j in
+    range(num_reps)]).
+
+    Parameters
+    ----------
+    model_type : string
+        One of 'baseline', 'odenet' and 'anode'.
+
+    metrics_paths : list of string
+        Paths to metrics files, one for every rep. Reps which failed before
+        writing any metrics have no file and are skipped.
+    """
+    history_info = {"type": model_type}
+    for path in metrics_paths:
+        if not os.path.exists(path):
+            continue
+        for key, history in read_metrics(path).items():
+            history_info.setdefault(key, []).append(history)
+    return history_info
+
+
 def single_feature_plt(features, targets, save_fig=''):
     """Plots a feature map with points colored by their target value. Works for
     2 or 3 dimensions.
@@ -406,7 +445,7 @@ def trajectory_plt(model, inputs, targets, timesteps, highlight_inputs=False,
     alpha = 0.5
     color = ['red' if targets[i, 0] > 0.0 else 'blue' for i in range(len(targets))]
     # Calculate trajectories (timesteps, batch_size, input_dim)
-    trajectories = model.odeblock.trajectory(inputs, timesteps).detach()
+    trajectories, _ = model.trajectory(inputs, timesteps)
     # Features are trajectories at the final time
     features = trajectories[-1]
 